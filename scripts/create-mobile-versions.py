@@ -12,22 +12,113 @@ Scans movie folders and creates phone-optimized encodes:
 
 Jellyfin will show version selector when multiple versions exist.
 
+Several encodes can run at once (--jobs); each gets an equal share of the
+CPU-thread budget (--threads) via ffmpeg -threads. Queued and interrupted
+jobs are kept in the state store so they are picked up again after a restart,
+and encodes are paused while the CPU is above --max-temp.
+
+Work is ordered by expected space saved per CPU-second (source size versus
+projected mobile size, over an encode-time estimate from duration,
+resolution and HDR that learns from the measured fps of past jobs), so
+--limit spends the nightly budget where it saves the most.
+
+Video is encoded in keyframe-aligned segments written to a work directory
+and recorded in the state store, so an interrupted encode resumes from the
+last finished segment. --chunked encodes the segments in parallel (for
+single large sources where one x264 process can't use all cores). The
+segments are joined with the concat demuxer once all of them exist.
+
+--renditions decodes, scales and tonemaps once and uses a split filter
+graph to encode every MOBILE_SETTINGS["renditions"] entry (e.g. 1080p at
+CRF 23 and 720p at CRF 26) in the same ffmpeg process, named with
+Jellyfin's edition convention: "Movie (Year) {edition-Mobile 720p}.mkv".
+
+--predict-crf encodes a few short, evenly spaced sample clips at two CRFs,
+fits the size/CRF curve and uses the CRF that meets the target average
+bitrate, so grainy films don't come out at 12 Mbps. Sample results are
+cached per source in the state store.
+
+Sources whose video is already mobile-compatible (H.264 up to High@4.1,
+within the rendition's size, SDR, 8-bit, <= REMUX_MAX_VIDEO_KBPS) skip the
+transcode: the video is stream-copied and only the audio is converted. The
+log records the path chosen for each rendition and the time saved.
+
+Encodes are also paused (SIGSTOP) while qBittorrent traffic saturates the
+ZFS pool, judged from /api/v2/transfer/info and /proc/diskstats, and
+resumed once it quiets down (--no-io-throttle to disable). Time paused and
+data moved by both workloads are recorded per run.
+
+Encodes run with ffmpeg -progress: fps, speed, bitrate and an ETA are
+logged every minute and kept in a rolling JSON status file (STATUS_FILE);
+each attempt's summary is stored in the state store, and --status shows
+throughput per source class and preset.
+
 Usage:
     python3 create-mobile-versions.py [--dry-run] [--limit N] [--movie "Name"]
+                                      [--jobs N] [--threads N] [--max-temp C]
+                                      [--chunked] [--renditions] [--predict-crf]
+                                      [--no-io-throttle]
 """
 
 import os
 import sys
-import json
 import subprocess
 import argparse
 import re
-from pathlib import Path
+import shutil
+import time
+import math
+import heapq
+import hashlib
+import itertools
+import concurrent.futures
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+from probe_cache import ProbeCache, ProbeError, FFPROBE, run_ffprobe, file_key
+from encode_scheduler import EncodeScheduler
+from encode_state import EncodeState, COMPLETED, FAILED, QUEUED, IN_PROGRESS
+from encode_progress import JobProgress, StatusBoard, parse_progress, progress_args
+from io_monitor import IOMonitor
+
 MOVIES_DIR = "/tank/media/movies"
 LOG_FILE = "/home/anon/nas-media-server/logs/mobile-encode.log"
-STATE_FILE = "/home/anon/nas-media-server/logs/mobile-encode-state.json"
+STATE_DB = "/home/anon/nas-media-server/logs/mobile-encode-state.db"
+LEGACY_STATE_FILE = "/home/anon/nas-media-server/logs/mobile-encode-state.json"
+STATUS_FILE = "/home/anon/nas-media-server/logs/mobile-encode-status.json"
+FFMPEG = os.environ.get("FFMPEG", "/usr/lib/jellyfin-ffmpeg/ffmpeg")
+
+# Checkpointed encode segments (same pool as the movies)
+WORK_DIR = "/tank/media/.mobile-encode-work"
+
+# Parallel ffprobe workers used to warm the probe cache before encoding
+PROBE_WORKERS = 4
+
+# Encode scheduling: concurrent jobs, total ffmpeg threads shared between
+# them, and CPU temperature (C) above which running encodes are paused
+ENCODE_JOBS = 1
+THREAD_BUDGET = os.cpu_count() or 4
+MAX_CPU_TEMP = 85
+ZFS_POOL = "tank"  # Pool shared with qBittorrent, watched for I/O contention
+
+# Segment length (s) for checkpointed encodes, and segments encoded at
+# once in --chunked mode.
+# x264 scales poorly past a few threads, so several narrow encoders beat
+# one wide one on a single large source.
+CHUNK_SECONDS = 300
+CHUNK_WORKERS = 4
+
+# Starting encode speed (fps) per source class until real jobs are
+# measured, and expected mobile video bitrate (kbps) for size projections
+DEFAULT_ENCODE_FPS = {"2160p-hdr": 6.0, "2160p": 9.0, "1080p": 30.0, "720p": 60.0}
+MOBILE_VIDEO_KBPS = {"1080p": 4000, "720p": 2500}
+FPS_SMOOTHING = 0.3  # Weight of the newest measurement in the fps average
+
+# Allowed output/source duration difference and audio/video drift (s)
+DURATION_TOLERANCE = 1.0
+AV_SYNC_TOLERANCE = 0.5
+
+PROBE_CACHE = ProbeCache()
 
 # Mobile encode settings
 MOBILE_SETTINGS = {
@@ -40,8 +131,29 @@ MOBILE_SETTINGS = {
     "audio_bitrate": "128k",  # Lower bitrate for mobile
     "audio_channels": "2",  # Stereo for mobile
     "hw_decode": False,  # Software decode (more compatible)
+    "video_target_kbps": 4000,  # Average video bitrate aimed for with --predict-crf
+    # Outputs for --renditions mode, all fed from a single decode/tonemap
+    "renditions": [
+        {"name": "Mobile", "max_width": 1920, "max_height": 1080, "crf": "23", "target_kbps": 4000},
+        {"name": "Mobile 720p", "max_width": 1280, "max_height": 720, "crf": "26", "target_kbps": 2000},
+    ],
 }
 
+# Sources that already meet these are remuxed (video stream-copied) instead
+# of transcoded; only the audio is converted if needed
+REMUX_VIDEO_PROFILES = ("High", "Main", "Constrained Baseline")
+REMUX_MAX_LEVEL = 41
+REMUX_MAX_VIDEO_KBPS = 8000
+REMUX_PIX_FMTS = ("yuv420p", "yuvj420p")
+
+# CRF prediction (--predict-crf): evenly spaced sample clips are encoded at
+# two CRFs and the CRF hitting the rendition's target bitrate is
+# interpolated on a log-bitrate curve, then clamped to CRF_RANGE
+CRF_SAMPLE_COUNT = 4
+CRF_SAMPLE_SECONDS = 10
+CRF_SAMPLE_POINTS = (20, 28)
+CRF_RANGE = (18, 30)
+
 # Minimum file size (GB) to consider for mobile version
 # Files smaller than this are likely already mobile-friendly
 MIN_SIZE_GB = 4.0
@@ -85,33 +197,11 @@ def log(msg):
         f.write(line + "\n")
 
 
-def load_state():
-    """Load processing state."""
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE) as f:
-            return json.load(f)
-    return {"completed": [], "failed": [], "in_progress": None}
-
-
-def save_state(state):
-    """Save processing state."""
-    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
-
-
 def get_video_info(filepath):
-    """Get video metadata using ffprobe."""
-    cmd = [
-        "ffprobe", "-v", "quiet",
-        "-print_format", "json",
-        "-show_format", "-show_streams",
-        filepath
-    ]
+    """Get video metadata using ffprobe (cached by file identity)."""
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        return json.loads(result.stdout)
-    except Exception as e:
+        return PROBE_CACHE.probe(filepath)
+    except (ProbeError, OSError) as e:
         log(f"  Error probing {filepath}: {e}")
         return None
 
@@ -208,8 +298,8 @@ def get_movie_name(movie_dir):
     return dirname, ""
 
 
-def create_mobile_version(source_path, movie_dir, dry_run=False):
-    """Create mobile-friendly encode of the source file."""
+def mobile_output_path(movie_dir):
+    """Path of the mobile encode for a movie folder."""
     movie_name, year = get_movie_name(movie_dir)
 
     if year:
@@ -217,130 +307,765 @@ def create_mobile_version(source_path, movie_dir, dry_run=False):
     else:
         output_name = f"{movie_name} - Mobile.mkv"
 
-    output_path = os.path.join(movie_dir, output_name)
+    return os.path.join(movie_dir, output_name)
 
-    if os.path.exists(output_path):
-        log(f"  Mobile version already exists: {output_name}")
-        return True
 
-    # Get source info
-    info = get_video_info(source_path)
-    width, height = get_resolution(info)
-    hdr = is_hdr(info)
+def get_renditions(movie_dir, multi=False):
+    """Renditions to produce for a movie, each with its output path.
 
-    log(f"  Source: {width}x{height}, HDR={hdr}")
+    By default this is the single "- Mobile" encode. In multi-rendition
+    mode every entry of MOBILE_SETTINGS["renditions"] is produced and named
+    with Jellyfin's edition convention: "Movie (Year) {edition-<name>}.mkv".
+    """
+    if not multi:
+        return [{
+            "name": "Mobile",
+            "max_width": MOBILE_SETTINGS["max_width"],
+            "max_height": MOBILE_SETTINGS["max_height"],
+            "crf": MOBILE_SETTINGS["video_crf"],
+            "target_kbps": MOBILE_SETTINGS["video_target_kbps"],
+            "output": mobile_output_path(movie_dir),
+        }]
 
-    # Build ffmpeg command
-    cmd = [
-        "/usr/lib/jellyfin-ffmpeg/ffmpeg",
-        "-i", source_path,
-        "-map", "0:v:0",  # First video stream
-        "-map", "0:a:0",  # First audio stream
-    ]
+    dirname = os.path.basename(movie_dir)
+    renditions = []
+    for rendition in MOBILE_SETTINGS["renditions"]:
+        output = os.path.join(movie_dir, f"{dirname} {{edition-{rendition['name']}}}.mkv")
+        renditions.append(dict(rendition, output=output))
+    return renditions
 
-    # Map SRT/text subtitles only (skip PGS)
-    # We'll add subtitle mapping after checking streams
+
+def subtitle_maps(info, input_index=0):
+    """Map SRT/text subtitles only (PGS can't be copied into a mobile encode)."""
+    maps = []
     if info:
         sub_idx = 0
-        for i, stream in enumerate(info.get("streams", [])):
+        for stream in info.get("streams", []):
             if stream.get("codec_type") == "subtitle":
                 codec = stream.get("codec_name", "")
                 if codec in ["subrip", "srt", "ass", "ssa", "mov_text"]:
-                    cmd.extend(["-map", f"0:s:{sub_idx}"])
+                    maps.extend(["-map", f"{input_index}:s:{sub_idx}"])
                 sub_idx += 1
+    return maps
 
-    # Video filters
-    vf_filters = []
 
-    # Scale down if needed (always scale to max 1080p)
-    if width > MOBILE_SETTINGS["max_width"] or height > MOBILE_SETTINGS["max_height"]:
-        # Scale to fit within 1920x1080 while maintaining aspect ratio
-        vf_filters.append(f"scale='min({MOBILE_SETTINGS['max_width']},iw)':'min({MOBILE_SETTINGS['max_height']},ih)':force_original_aspect_ratio=decrease")
+def scale_filter(max_width, max_height):
+    """Scale to fit within max_width x max_height, keeping the aspect ratio."""
+    return f"scale='min({max_width},iw)':'min({max_height},ih)':force_original_aspect_ratio=decrease"
 
-    # Tonemap HDR to SDR if needed
-    if hdr:
-        vf_filters.append("zscale=t=linear:npl=100,format=gbrpf32le,zscale=p=bt709,tonemap=tonemap=hable:desat=0,zscale=t=bt709:m=bt709:r=tv,format=yuv420p")
 
-    # Ensure output is yuv420p for compatibility
-    vf_filters.append("format=yuv420p")
+def video_filter_graph(width, height, hdr, renditions, source="0:v:0"):
+    """Build a -filter_complex graph feeding one video output per rendition.
+
+    Decoding, the first downscale and HDR tonemapping happen once; a split
+    then feeds each rendition its own final scale. Returns (graph, labels).
+    """
+    max_width = max(r["max_width"] for r in renditions)
+    max_height = max(r["max_height"] for r in renditions)
 
-    if vf_filters:
-        cmd.extend(["-vf", ",".join(vf_filters)])
+    common = []
+    # Scale down if needed (to the largest rendition)
+    if width > max_width or height > max_height:
+        common.append(scale_filter(max_width, max_height))
 
-    # Video codec settings
-    cmd.extend([
+    # Tonemap HDR to SDR if needed
+    if hdr:
+        common.append("zscale=t=linear:npl=100,format=gbrpf32le,zscale=p=bt709,tonemap=tonemap=hable:desat=0,zscale=t=bt709:m=bt709:r=tv,format=yuv420p")
+
+    labels = [f"v{i}" for i in range(len(renditions))]
+    if len(renditions) == 1:
+        # Ensure output is yuv420p for compatibility
+        chain = ",".join(common + ["format=yuv420p"])
+        return f"[{source}]{chain}[{labels[0]}]", labels
+
+    common.append(f"split={len(renditions)}" + "".join(f"[s{i}]" for i in range(len(renditions))))
+    graph = [f"[{source}]" + ",".join(common)]
+    for i, rendition in enumerate(renditions):
+        branch = []
+        if rendition["max_width"] < max_width or rendition["max_height"] < max_height:
+            branch.append(scale_filter(rendition["max_width"], rendition["max_height"]))
+        branch.append("format=yuv420p")
+        graph.append(f"[s{i}]" + ",".join(branch) + f"[{labels[i]}]")
+    return ";".join(graph), labels
+
+
+def video_codec_args(threads=None, crf=None):
+    """x264 settings shared by full, chunked and multi-rendition encodes."""
+    args = [
         "-c:v", MOBILE_SETTINGS["video_codec"],
         "-preset", MOBILE_SETTINGS["video_preset"],
-        "-crf", MOBILE_SETTINGS["video_crf"],
+        "-crf", str(crf or MOBILE_SETTINGS["video_crf"]),
         "-profile:v", "high",
         "-level", "4.1",
+    ]
+    if threads:
+        args.extend(["-threads", str(threads)])
+    return args
+
+
+def rendition_key(rendition, graph):
+    """Short hash of everything that determines a rendition's encoded video.
+
+    Covers the filter graph (scaling/tonemapping, which differs between
+    single and multi-rendition runs), the rendition's size and CRF and the
+    x264 settings, so segment files from other settings are never reused.
+    """
+    settings = "|".join([
+        graph,
+        rendition["name"],
+        f"{rendition['max_width']}x{rendition['max_height']}",
+        " ".join(video_codec_args(crf=rendition["crf"])),
     ])
+    return hashlib.sha1(settings.encode()).hexdigest()[:12]
+
 
-    # Audio settings
-    cmd.extend([
+def audio_codec_args():
+    return [
         "-c:a", MOBILE_SETTINGS["audio_codec"],
         "-b:a", MOBILE_SETTINGS["audio_bitrate"],
         "-ac", MOBILE_SETTINGS["audio_channels"],
-    ])
+    ]
 
-    # Subtitle settings (copy text subs)
-    cmd.extend(["-c:s", "copy"])
 
-    # Output
-    cmd.extend([
-        "-movflags", "+faststart",
-        "-y",
-        output_path
-    ])
+def run_ffmpeg(cmd, scheduler=None, progress=None):
+    """Run an ffmpeg command, registering it with the scheduler. Returns exit code.
+
+    With a JobProgress, ffmpeg's -progress key/value stream is parsed into
+    it (fps, speed, out_time, size) for the ETA and status file.
+    """
+    if progress:
+        cmd = cmd[:1] + progress_args() + cmd[1:]
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True
+    )
+    if scheduler:
+        scheduler.register(process)
+    stream = progress.stream() if progress else None
 
-    if dry_run:
-        log(f"  [DRY RUN] Would encode to: {output_name}")
-        log(f"  Command: {' '.join(cmd[:20])}...")
-        return True
+    try:
+        if progress:
+            for block in parse_progress(process.stdout):
+                progress.update(stream, block)
+        # Drain whatever is left (errors, or all output without progress)
+        for _ in process.stdout:
+            pass
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if scheduler:
+            scheduler.unregister(process)
+        if progress:
+            progress.finish_stream(stream)
 
-    log(f"  Encoding to: {output_name}")
-    log(f"  This may take a while...")
+    return process.returncode
 
+
+def get_duration(info):
+    """Container duration in seconds (0 if unknown)."""
     try:
-        # Run ffmpeg
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-        )
-
-        # Monitor progress
-        for line in process.stdout:
-            if "frame=" in line and "fps=" in line:
-                # Extract progress info
-                print(f"\r  {line.strip()[:80]}", end="", flush=True)
-
-        print()  # Newline after progress
+        return float((info or {}).get("format", {}).get("duration", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def stream_duration(stream):
+    """Stream duration in seconds from the stream or its MKV DURATION tag."""
+    if stream.get("duration"):
+        return float(stream["duration"])
+    tag = stream.get("tags", {}).get("DURATION", "")
+    match = re.match(r"(\d+):(\d+):([\d.]+)", tag)
+    if match:
+        h, m, sec = match.groups()
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    return None
+
+
+def find_keyframes(source_path, duration, chunk_seconds, start_time=0.0):
+    """Return keyframe times (relative to start_time) near every chunk_seconds boundary.
+
+    Rather than reading every packet of a multi-GB remux, ffprobe seeks to
+    each wanted split point (-read_intervals) and reports the first video
+    packet there, which is always a keyframe.
+    """
+    targets = [t for t in range(int(chunk_seconds), int(duration), int(chunk_seconds))]
+    if not targets:
+        return [0.0]
+    intervals = ",".join(f"{t}%+#1" for t in targets)
+    cmd = [
+        FFPROBE, "-v", "quiet",
+        "-select_streams", "v:0",
+        "-read_intervals", intervals,
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        source_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+    keyframes = {0.0}
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and "K" in parts[1]:
+            try:
+                keyframes.add(max(0.0, float(parts[0]) - start_time))
+            except ValueError:
+                continue
+    return sorted(k for k in keyframes if k < duration)
+
+
+def plan_segments(keyframes, duration, min_seconds=10):
+    """Turn keyframe split points into (start, length) segments."""
+    points = []
+    for k in keyframes:
+        if not points or k - points[-1] >= min_seconds:
+            points.append(k)
+    segments = []
+    for i, start in enumerate(points):
+        end = points[i + 1] if i + 1 < len(points) else None
+        segments.append((start, (end - start) if end is not None else None))
+    return segments
+
+
+def verify_output(source_info, output_path):
+    """Check the encode's duration and A/V sync against the source."""
+    try:
+        out_info = run_ffprobe(output_path)
+    except ProbeError as e:
+        return False, f"could not probe output: {e}"
+
+    src_duration = get_duration(source_info)
+    out_duration = get_duration(out_info)
+    if src_duration and abs(out_duration - src_duration) > DURATION_TOLERANCE:
+        return False, f"duration {out_duration:.1f}s vs source {src_duration:.1f}s"
+
+    durations = {}
+    for stream in out_info.get("streams", []):
+        kind = stream.get("codec_type")
+        if kind in ("video", "audio") and kind not in durations:
+            durations[kind] = stream_duration(stream)
+    if durations.get("video") and durations.get("audio"):
+        drift = abs(durations["video"] - durations["audio"])
+        if drift > AV_SYNC_TOLERANCE:
+            return False, f"audio/video drift {drift:.2f}s"
+
+    return True, f"duration {out_duration:.1f}s matches source"
+
+
+def video_bitrate_kbps(info):
+    """Video bitrate of the source from the stream, its BPS tag or the container."""
+    for stream in (info or {}).get("streams", []):
+        if stream.get("codec_type") == "video":
+            tags = stream.get("tags", {})
+            for value in (stream.get("bit_rate"), tags.get("BPS"), tags.get("BPS-eng")):
+                try:
+                    if value and int(value) > 0:
+                        return int(value) / 1000
+                except ValueError:
+                    continue
+            break
+    try:
+        # Whole-file rate is an upper bound for the video stream
+        return int((info or {}).get("format", {}).get("bit_rate", 0)) / 1000 or None
+    except (TypeError, ValueError):
+        return None
 
-        process.wait()
 
-        if process.returncode != 0:
-            log(f"  ERROR: ffmpeg exited with code {process.returncode}")
-            # Clean up partial file
-            if os.path.exists(output_path):
-                os.remove(output_path)
+def remux_check(info, rendition):
+    """Can the source video be stream-copied for this rendition? Returns (ok, reason)."""
+    video = next((s for s in (info or {}).get("streams", []) if s.get("codec_type") == "video"), None)
+    if not video:
+        return False, "no video stream"
+    if video.get("codec_name") != "h264":
+        return False, f"video is {video.get('codec_name')}"
+    if video.get("profile") not in REMUX_VIDEO_PROFILES:
+        return False, f"H.264 profile {video.get('profile')}"
+    if (video.get("level") or 0) > REMUX_MAX_LEVEL:
+        return False, f"H.264 level {video['level'] / 10:g}"
+    if video.get("pix_fmt") not in REMUX_PIX_FMTS:
+        return False, f"pixel format {video.get('pix_fmt')}"
+    if is_hdr(info):
+        return False, "HDR"
+    width, height = get_resolution(info)
+    if width > rendition["max_width"] or height > rendition["max_height"]:
+        return False, f"{width}x{height} exceeds {rendition['max_width']}x{rendition['max_height']}"
+    kbps = video_bitrate_kbps(info)
+    if not kbps or kbps > REMUX_MAX_VIDEO_KBPS:
+        return False, f"video bitrate {kbps or 'unknown'} kbps"
+    return True, f"H.264 {video['profile']} {width}x{height} SDR 8-bit, {kbps:.0f} kbps"
+
+
+def audio_is_mobile(info):
+    """True if the first audio stream can be copied into a mobile version as-is."""
+    for stream in (info or {}).get("streams", []):
+        if stream.get("codec_type") == "audio":
+            return (stream.get("codec_name") == MOBILE_SETTINGS["audio_codec"]
+                    and (stream.get("channels") or 0) <= int(MOBILE_SETTINGS["audio_channels"]))
+    return False
+
+
+def remux_video(source_path, info, renditions, scheduler=None, progress=None):
+    """Write each rendition with the source video stream-copied (one read of the source).
+
+    Audio is copied when it is already AAC stereo and transcoded otherwise;
+    text subtitles are copied as in a full encode. Returns True on success.
+    """
+    cmd = [FFMPEG, "-i", source_path]
+    for rendition in renditions:
+        cmd.extend(["-map", "0:v:0", "-map", "0:a:0"])
+        cmd.extend(subtitle_maps(info))
+        cmd.extend(["-c:v", "copy"])
+        cmd.extend(["-c:a", "copy"] if audio_is_mobile(info) else audio_codec_args())
+        cmd.extend(["-c:s", "copy", "-y", rendition["output"]])
+
+    returncode = run_ffmpeg(cmd, scheduler=scheduler, progress=progress)
+    if returncode != 0:
+        log(f"  ERROR: remux exited with code {returncode}")
+        return False
+    for rendition in renditions:
+        ok, detail = verify_output(info, rendition["output"])
+        if not ok:
+            log(f"  ERROR: {rendition['name']} failed verification: {detail}")
             return False
+    return True
 
-        # Verify output
-        if os.path.exists(output_path):
-            size_mb = os.path.getsize(output_path) / (1024**2)
-            log(f"  Success! Output: {size_mb:.1f} MB")
-            return True
+
+def fit_crf(samples, target_kbps):
+    """Interpolate the CRF giving target_kbps from {crf: kbps} samples.
+
+    x264 bitrate falls roughly exponentially with CRF, so log(bitrate) is
+    fitted as a straight line through the two sample points.
+    """
+    points = sorted(samples.items())
+    (crf_lo, kbps_lo), (crf_hi, kbps_hi) = points[0], points[-1]
+    if kbps_lo <= 0 or kbps_hi <= 0 or kbps_lo == kbps_hi or crf_lo == crf_hi:
+        return None
+    slope = (math.log(kbps_hi) - math.log(kbps_lo)) / (crf_hi - crf_lo)
+    crf = crf_lo + (math.log(target_kbps) - math.log(kbps_lo)) / slope
+    crf = min(max(crf, CRF_RANGE[0]), CRF_RANGE[1])
+    return round(crf * 2) / 2  # x264 takes fractional CRF; half steps are plenty
+
+
+def sample_crf_bitrates(source_path, info, rendition, scheduler=None, threads=None):
+    """Encode CRF_SAMPLE_COUNT clips at each CRF_SAMPLE_POINTS value; return {crf: kbps}."""
+    width, height = get_resolution(info)
+    duration = get_duration(info)
+    crfs = list(CRF_SAMPLE_POINTS)
+    # One decode/tonemap per clip feeds an encoder per sample CRF
+    graph, labels = video_filter_graph(width, height, is_hdr(info), [rendition] * len(crfs))
+
+    sample_dir = os.path.join(WORK_DIR, os.path.basename(os.path.dirname(rendition["output"])) + ".samples")
+    os.makedirs(sample_dir, exist_ok=True)
+    sizes = {crf: 0 for crf in crfs}
+    seconds = 0.0
+    try:
+        for i in range(CRF_SAMPLE_COUNT):
+            start = duration * (i + 1) / (CRF_SAMPLE_COUNT + 1)
+            length = min(CRF_SAMPLE_SECONDS, duration - start)
+            cmd = [FFMPEG, "-v", "error"]
+            if threads:
+                cmd.extend(["-threads", str(threads)])
+            cmd.extend(["-ss", f"{start:.3f}", "-i", source_path, "-t", f"{length:.3f}",
+                        "-filter_complex", graph])
+            outputs = []
+            for label, crf in zip(labels, crfs):
+                out = os.path.join(sample_dir, f"sample{i}.crf{crf}.mkv")
+                outputs.append((crf, out))
+                cmd.extend(["-map", f"[{label}]", "-an", "-sn", "-dn"])
+                cmd.extend(video_codec_args(threads, crf))
+                cmd.extend(["-y", out])
+            if run_ffmpeg(cmd, scheduler=scheduler) != 0:
+                raise RuntimeError(f"sample encode {i} failed")
+            for crf, out in outputs:
+                sizes[crf] += os.path.getsize(out)
+            seconds += length
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+
+    return {crf: size * 8 / 1000 / seconds for crf, size in sizes.items()}
+
+
+def predict_crfs(source_path, info, renditions, state, scheduler=None, threads=None):
+    """Replace each rendition's CRF with one predicted to hit its target bitrate.
+
+    Sample bitrates are cached in the state store per source identity and
+    rendition settings, so re-runs don't encode the samples again.
+    """
+    predicted = []
+    for rendition in renditions:
+        target = rendition.get("target_kbps")
+        if not target or not get_duration(info):
+            predicted.append(rendition)
+            continue
+
+        key = "|".join([
+            file_key(source_path),
+            f"{rendition['max_width']}x{rendition['max_height']}",
+            MOBILE_SETTINGS["video_preset"],
+            ",".join(str(c) for c in CRF_SAMPLE_POINTS),
+            f"{CRF_SAMPLE_COUNT}x{CRF_SAMPLE_SECONDS}",
+        ])
+        samples = state.get_crf_samples(key)
+        if samples is None:
+            log(f"  Encoding {CRF_SAMPLE_COUNT} sample clips for {rendition['name']} CRF prediction...")
+            samples = sample_crf_bitrates(source_path, info, rendition, scheduler, threads)
+            state.put_crf_samples(key, samples)
+
+        crf = fit_crf(samples, target)
+        if crf is None:
+            predicted.append(rendition)
+            continue
+        rates = ", ".join(f"CRF {c:g}: {k:.0f} kbps" for c, k in sorted(samples.items()))
+        log(f"  {rendition['name']}: {rates} -> CRF {crf:g} for {target} kbps")
+        predicted.append(dict(rendition, crf=f"{crf:g}"))
+    return predicted
+
+
+def segment_settings(renditions, graph):
+    """Effective encode settings of each rendition, as stored in a segment checkpoint."""
+    return [{
+        "name": rendition["name"],
+        "max_width": rendition["max_width"],
+        "max_height": rendition["max_height"],
+        "crf": str(rendition["crf"] or MOBILE_SETTINGS["video_crf"]),
+        "x264": video_codec_args(crf=rendition["crf"]),
+        "key": rendition_key(rendition, graph),
+    } for rendition in renditions]
+
+
+class SegmentCheckpoint:
+    """Per-segment progress of one job, persisted in the state store.
+
+    The segment plan is stored with the source's size and mtime and each
+    rendition's encode settings, so a replaced source or changed settings
+    (e.g. a different predicted CRF) start over instead of mixing segments.
+    """
+
+    def __init__(self, state, dirname):
+        self.state = state
+        self.dirname = dirname
+
+    def load(self, source_path, settings=None):
+        """Return (segments, done) from an earlier run of this source, or None.
+
+        With settings (from segment_settings()), a checkpoint written under
+        any other settings is rejected too; without, only the source is
+        checked (for progress estimates before the settings are known).
+        """
+        entry = self.state.load_segments(self.dirname)
+        if not entry or entry["source"] != source_path:
+            return None
+        st = os.stat(source_path)
+        if entry["size"] != st.st_size or entry["mtime"] != int(st.st_mtime):
+            return None
+        if settings is not None and entry["settings"] != settings:
+            return None
+        return [tuple(seg) for seg in entry["plan"]], set(entry["done"])
+
+    def start(self, source_path, segments, settings):
+        st = os.stat(source_path)
+        self.state.start_segments(self.dirname, source_path, st.st_size, int(st.st_mtime),
+                                  [list(seg) for seg in segments], settings)
+
+    def mark_done(self, index):
+        self.state.mark_segment_done(self.dirname, index)
+
+    def clear(self):
+        self.state.clear_segments(self.dirname)
+
+
+def encode_segments(source_path, info, renditions, threads=None, scheduler=None,
+                    workers=1, checkpoint=None, progress=None):
+    """Encode video in keyframe-aligned segments, then concat.
+
+    Each segment is a separate ffmpeg process with identical x264 settings
+    that writes one file per rendition to WORK_DIR, renamed into place only
+    once complete. With a checkpoint, finished segments are recorded in the
+    state store and an interrupted job resumes from them. Each rendition's
+    segments are joined losslessly with the concat demuxer while audio and
+    subtitles are muxed from the source; outputs are only assembled when
+    every segment exists. progress (a JobProgress) receives the telemetry
+    of the segment encodes.
+    """
+    width, height = get_resolution(info)
+    hdr = is_hdr(info)
+    duration = get_duration(info)
+    graph, labels = video_filter_graph(width, height, hdr, renditions)
+
+    work_dir = os.path.join(WORK_DIR, os.path.basename(os.path.dirname(renditions[0]["output"])))
+    keys = [rendition_key(rendition, graph) for rendition in renditions]
+
+    def seg_path(i, r):
+        # Named by rendition settings, not list position, so a resume with
+        # different renditions can't pick up segments encoded for another
+        return os.path.join(work_dir, f"seg{i:04d}.{keys[r]}.mkv")
+
+    def segment_complete(i):
+        return all(os.path.exists(seg_path(i, r)) for r in range(len(renditions)))
+
+    settings = segment_settings(renditions, graph)
+    resumed = checkpoint.load(source_path, settings) if checkpoint else None
+    if resumed:
+        segments, done = resumed
+        done = {i for i in done if segment_complete(i)}
+        log(f"  Resuming: {len(done)}/{len(segments)} segments already encoded")
+    else:
+        # ffprobe reports absolute timestamps; -ss is relative to the start
+        try:
+            start_time = float(info.get("format", {}).get("start_time", 0))
+        except (TypeError, ValueError):
+            start_time = 0.0
+        keyframes = find_keyframes(source_path, duration, CHUNK_SECONDS, start_time)
+        segments = plan_segments(keyframes, duration)
+        done = set()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if checkpoint:
+            checkpoint.start(source_path, segments, settings)
+
+    os.makedirs(work_dir, exist_ok=True)
+    todo = [i for i in range(len(segments)) if i not in done]
+    workers = max(1, min(workers, len(todo) or 1))
+    seg_threads = max(1, (threads or THREAD_BUDGET) // workers)
+    log(f"  Segmented encode: {len(todo)}/{len(segments)} segments to encode, "
+        f"{workers} worker(s) x {seg_threads} threads, {len(renditions)} rendition(s)")
+
+    def encode_segment(i):
+        start, length = segments[i]
+        cmd = [FFMPEG, "-v", "error", "-threads", str(seg_threads),
+               "-ss", f"{start:.6f}", "-i", source_path]
+        if length is not None:
+            cmd.extend(["-t", f"{length:.6f}"])
+        cmd.extend(["-filter_complex", graph])
+        for r, rendition in enumerate(renditions):
+            cmd.extend(["-map", f"[{labels[r]}]", "-an", "-sn", "-dn"])
+            cmd.extend(video_codec_args(seg_threads, rendition["crf"]))
+            cmd.extend(["-f", "matroska", "-y", seg_path(i, r) + ".part"])
+        if run_ffmpeg(cmd, scheduler=scheduler, progress=progress) != 0:
+            raise RuntimeError(f"segment {i} failed")
+        for r in range(len(renditions)):
+            os.replace(seg_path(i, r) + ".part", seg_path(i, r))
+        if checkpoint:
+            checkpoint.mark_done(i)
+        log(f"  Segment {i + 1}/{len(segments)} done")
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(encode_segment, i) for i in todo]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    finally:
+        # On the first failure, drop the queued segments instead of encoding
+        # the rest of the movie before the error surfaces
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    missing = [i for i in range(len(segments)) if not segment_complete(i)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} segment(s) missing, not assembling output")
+
+    for r, rendition in enumerate(renditions):
+        list_path = os.path.join(work_dir, f"concat.{keys[r]}.txt")
+        with open(list_path, "w") as f:
+            # Relative names avoid quoting issues with apostrophes in titles
+            for i in range(len(segments)):
+                f.write(f"file '{os.path.basename(seg_path(i, r))}'\n")
+
+        cmd = [FFMPEG, "-v", "error",
+               "-f", "concat", "-safe", "0", "-i", list_path,
+               "-i", source_path,
+               "-map", "0:v:0", "-map", "1:a:0"]
+        cmd.extend(subtitle_maps(info, input_index=1))
+        cmd.extend(["-c:v", "copy"])
+        cmd.extend(audio_codec_args())
+        cmd.extend(["-c:s", "copy", "-y", rendition["output"]])
+        if run_ffmpeg(cmd, scheduler=scheduler) != 0:
+            raise RuntimeError(f"concat failed for {rendition['name']}")
+
+        ok, detail = verify_output(info, rendition["output"])
+        if not ok:
+            raise RuntimeError(f"verification failed for {rendition['name']}: {detail}")
+        log(f"  Verified {rendition['name']}: {detail}")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    if checkpoint:
+        checkpoint.clear()
+    return True
+
+
+def create_mobile_version(source_path, movie_dir, dry_run=False, threads=None, scheduler=None,
+                          chunked=False, checkpoint=None, multi_rendition=False,
+                          crf_state=None, fps_table=None, progress=None):
+    """Create mobile-friendly encode(s) of the source file.
+
+    threads caps ffmpeg's thread count; scheduler (if given) tracks the
+    ffmpeg process so it can be paused for thermal backoff. The video is
+    encoded in keyframe-aligned segments (in parallel when chunked) that
+    are checkpointed so an interrupted encode can resume. multi_rendition
+    produces every MOBILE_SETTINGS["renditions"] entry from one decode.
+    crf_state (the state store) enables sample-based CRF prediction
+    towards each rendition's target bitrate.
+
+    Renditions the source video already satisfies (H.264, SDR, 8-bit,
+    small enough) are remuxed instead of transcoded; fps_table (learned
+    encode speeds) is used to log the time that saved. progress (a
+    JobProgress) collects ffmpeg telemetry for the ETA and status file.
+
+    Returns (success, pipeline): pipeline is the path actually taken,
+    "remux", "segmented", "chunked" or "single-pass" (with "+remux" when
+    some renditions were remuxed and the rest transcoded), or None when
+    nothing was encoded (outputs already exist, dry run).
+    """
+    renditions = get_renditions(movie_dir, multi_rendition)
+    for rendition in renditions:
+        if os.path.exists(rendition["output"]):
+            log(f"  Mobile version already exists: {os.path.basename(rendition['output'])}")
+    renditions = [r for r in renditions if not os.path.exists(r["output"])]
+    if not renditions:
+        return True, None
+
+    # Get source info
+    info = get_video_info(source_path)
+    width, height = get_resolution(info)
+    hdr = is_hdr(info)
+
+    log(f"  Source: {width}x{height}, HDR={hdr}")
+
+    # Cheapest valid pipeline per rendition: stream-copy the video if possible
+    remux = []
+    for rendition in renditions:
+        ok, reason = remux_check(info, rendition)
+        path = "remux (video copy)" if ok else "transcode"
+        log(f"  {rendition['name']}: {path} - {reason}")
+        if ok:
+            remux.append(rendition)
+    renditions = [r for r in renditions if r not in remux]
+
+    # Every remux is the same stream copy of the source video, so only the
+    # largest rendition is written; the others are hardlinks to it
+    linked = []
+    if len(remux) > 1:
+        primary = max(remux, key=lambda r: r["max_width"] * r["max_height"])
+        linked = [r for r in remux if r is not primary]
+        remux = [primary]
+
+    if remux:
+        names = ", ".join(os.path.basename(r["output"]) for r in remux)
+        if dry_run:
+            log(f"  [DRY RUN] Would remux to: {names}")
+            for rendition in linked:
+                log(f"  [DRY RUN] Would hardlink {os.path.basename(rendition['output'])} to it")
         else:
-            log(f"  ERROR: Output file not created")
-            return False
+            log(f"  Remuxing to: {names}")
+            started = time.monotonic()
+            # Telemetry tracks the transcode when one follows the remux
+            if not remux_video(source_path, info, remux, scheduler=scheduler,
+                               progress=None if renditions else progress):
+                for rendition in remux:
+                    if os.path.exists(rendition["output"]):
+                        os.remove(rendition["output"])
+                return False, "remux"
+            elapsed = time.monotonic() - started
+            transcode_seconds, _ = estimate_job(source_path, info, fps_table or {})
+            log(f"  Remuxed in {elapsed:.0f}s, ~{max(0, transcode_seconds - elapsed) / 60:.0f} min "
+                f"saved versus a full transcode")
+            for rendition in remux:
+                size_mb = os.path.getsize(rendition["output"]) / (1024**2)
+                log(f"  Success! {rendition['name']}: {size_mb:.1f} MB")
+            for rendition in linked:
+                try:
+                    os.link(remux[0]["output"], rendition["output"])
+                    log(f"  {rendition['name']}: hardlinked to {os.path.basename(remux[0]['output'])} "
+                        f"(identical stream copy)")
+                except OSError as e:
+                    log(f"  {rendition['name']}: hardlink failed ({e}), transcoding instead")
+                    renditions.append(rendition)
+        if not renditions:
+            return True, None if dry_run else "remux"
+    output_names = ", ".join(os.path.basename(r["output"]) for r in renditions)
+
+    if crf_state is not None:
+        if dry_run:
+            log("  [DRY RUN] Would predict CRF from sample encodes")
+        else:
+            try:
+                renditions = predict_crfs(source_path, info, renditions, crf_state,
+                                          scheduler=scheduler, threads=threads)
+            except Exception as e:
+                log(f"  CRF prediction failed ({e}), using configured CRF")
+
+    # Build ffmpeg command
+    graph, labels = video_filter_graph(width, height, hdr, renditions)
+    cmd = [FFMPEG]
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    cmd.extend(["-i", source_path, "-filter_complex", graph])
+    for label, rendition in zip(labels, renditions):
+        cmd.extend([
+            "-map", f"[{label}]",  # Scaled/tonemapped first video stream
+            "-map", "0:a:0",  # First audio stream
+        ])
+        cmd.extend(subtitle_maps(info))
+        cmd.extend(video_codec_args(threads, rendition["crf"]))
+        cmd.extend(audio_codec_args())
+
+        # Subtitle settings (copy text subs)
+        cmd.extend(["-c:s", "copy"])
+
+        # Output
+        cmd.extend([
+            "-movflags", "+faststart",
+            "-y",
+            rendition["output"]
+        ])
+
+    segmented = bool(get_duration(info))
+    if not segmented:
+        log("  Unknown source duration, using a single-pass encode (not resumable)")
+    pipeline = ("chunked" if chunked else "segmented") if segmented else "single-pass"
+    if remux and not dry_run:
+        pipeline += "+remux"
+
+    if dry_run:
+        mode = "chunked " if chunked and segmented else ""
+        log(f"  [DRY RUN] Would {mode}encode to: {output_names}")
+        log(f"  Command: {' '.join(cmd[:20])}...")
+        return True, None
+
+    log(f"  Encoding to: {output_names}")
+    log("  This may take a while...")
+
+    def remove_outputs():
+        for rendition in renditions:
+            if os.path.exists(rendition["output"]):
+                os.remove(rendition["output"])
+
+    try:
+        if segmented:
+            encode_segments(source_path, info, renditions, threads=threads, scheduler=scheduler,
+                            workers=CHUNK_WORKERS if chunked else 1, checkpoint=checkpoint,
+                            progress=progress)
+        else:
+            returncode = run_ffmpeg(cmd, scheduler=scheduler, progress=progress)
+            if returncode != 0:
+                log(f"  ERROR: ffmpeg exited with code {returncode}")
+                # Clean up partial files
+                remove_outputs()
+                return False, pipeline
+
+        # Verify output
+        for rendition in renditions:
+            if not os.path.exists(rendition["output"]):
+                log(f"  ERROR: Output file not created: {os.path.basename(rendition['output'])}")
+                return False, pipeline
+            size_mb = os.path.getsize(rendition["output"]) / (1024**2)
+            log(f"  Success! {rendition['name']}: {size_mb:.1f} MB")
+        return True, pipeline
 
     except Exception as e:
         log(f"  ERROR: {e}")
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        return False
+        remove_outputs()
+        return False, pipeline
 
 
 def scan_movies(limit=None, movie_filter=None):
@@ -373,6 +1098,105 @@ def scan_movies(limit=None, movie_filter=None):
     return needs_mobile
 
 
+def source_fps(info):
+    """Source frame rate from the first video stream (default 24)."""
+    for stream in (info or {}).get("streams", []):
+        if stream.get("codec_type") == "video":
+            for key in ("avg_frame_rate", "r_frame_rate"):
+                try:
+                    num, den = stream.get(key, "0/0").split("/")
+                    if float(num) and float(den):
+                        return float(num) / float(den)
+                except ValueError:
+                    continue
+            break
+    return 24.0
+
+
+def encode_class(info):
+    """Bucket a source by the things that dominate encode speed."""
+    width, height = get_resolution(info)
+    if height > 1080 or width > 1920:
+        res = "2160p"
+    elif height > 720:
+        res = "1080p"
+    else:
+        res = "720p"
+    return f"{res}-hdr" if is_hdr(info) else res
+
+
+def estimate_job(source_path, info, fps_table, remaining=1.0):
+    """Estimate (cpu_seconds, saved_bytes) for encoding a source.
+
+    Cost is the frame count divided by the encode fps for the source's
+    class, learned from past jobs when available. Benefit is the source
+    size minus the projected mobile size at the typical bitrate.
+    """
+    duration = get_duration(info)
+    cls = encode_class(info)
+    encode_fps = fps_table.get(cls, {}).get("fps") or DEFAULT_ENCODE_FPS.get(cls, 10.0)
+    cost = duration * source_fps(info) / encode_fps * remaining
+
+    _, height = get_resolution(info)
+    out_kbps = MOBILE_VIDEO_KBPS["1080p" if height > 720 else "720p"]
+    out_kbps += int(MOBILE_SETTINGS["audio_bitrate"].rstrip("k"))
+    projected = duration * out_kbps * 1000 / 8
+    try:
+        source_size = os.path.getsize(source_path)
+    except OSError:
+        source_size = 0
+    return cost, max(0, source_size - projected)
+
+
+def record_encode_fps(state, info, seconds_encoded, elapsed):
+    """Fold a finished job's measured fps into the per-class average."""
+    if elapsed <= 0 or seconds_encoded <= 0:
+        return None
+    fps = seconds_encoded * source_fps(info) / elapsed
+    cls = encode_class(info)
+    average = state.record_fps(cls, fps, FPS_SMOOTHING)
+    log(f"  Measured {fps:.1f} fps ({cls} average now {average:.1f} fps)")
+    return fps
+
+
+class JobQueue:
+    """Heap-backed priority queue; highest priority pops first, FIFO on ties."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+
+    def push(self, job, priority):
+        heapq.heappush(self._heap, (-priority, next(self._seq), job))
+
+    def pop(self):
+        return heapq.heappop(self._heap)[2]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def prioritize(jobs, state):
+    """Order jobs by expected bytes saved per CPU-second, best first."""
+    fps_table = state.fps_table()
+    infos = PROBE_CACHE.probe_many([source for _, source in jobs], workers=PROBE_WORKERS)
+    queue = JobQueue()
+    for job in jobs:
+        movie_dir, source = job
+        info = infos.get(source)
+        if not info or not get_duration(info):
+            queue.push(job, 0.0)  # Unknown cost: run after everything we can rank
+            continue
+        # Partly encoded jobs only cost what is left
+        entry = state.load_segments(os.path.basename(movie_dir))
+        remaining = 1.0
+        if entry and entry.get("plan"):
+            remaining = 1 - len(entry.get("done", [])) / len(entry["plan"])
+        cost, benefit = estimate_job(source, info, fps_table, remaining)
+        queue.push(job, benefit / max(cost, 1.0))
+    return [queue.pop() for _ in range(len(queue))]
+
+
 def main():
     parser = argparse.ArgumentParser(description="Create mobile-friendly movie versions")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be done")
@@ -380,18 +1204,55 @@ def main():
     parser.add_argument("--movie", type=str, help="Process specific movie (partial name match)")
     parser.add_argument("--list", action="store_true", help="List movies needing mobile versions")
     parser.add_argument("--status", action="store_true", help="Show processing status")
+    parser.add_argument("--jobs", type=int, default=ENCODE_JOBS, help="Encodes to run at once")
+    parser.add_argument("--threads", type=int, default=THREAD_BUDGET,
+                        help="Total ffmpeg threads shared between concurrent encodes")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Encode each source in keyframe-aligned segments in parallel")
+    parser.add_argument("--renditions", action="store_true",
+                        help="Produce every MOBILE_SETTINGS renditions entry from one decode")
+    parser.add_argument("--predict-crf", action="store_true",
+                        help="Pick each encode's CRF from sample clips to hit its target bitrate")
+    parser.add_argument("--no-io-throttle", action="store_true",
+                        help="Don't pause encodes while torrents saturate the pool")
+    parser.add_argument("--max-temp", type=float, default=MAX_CPU_TEMP,
+                        help="Pause encodes while CPU temperature (C) is above this (0 = off)")
     args = parser.parse_args()
 
-    state = load_state()
+    state = EncodeState(STATE_DB, legacy_json=LEGACY_STATE_FILE)
 
     if args.status:
-        print(f"Completed: {len(state['completed'])}")
-        print(f"Failed: {len(state['failed'])}")
-        print(f"In progress: {state['in_progress']}")
-        if state['failed']:
+        counts = state.counts()
+        running = [j["dirname"] for j in state.jobs_with_status(IN_PROGRESS)]
+        print(f"Completed: {counts.get(COMPLETED, 0)}")
+        print(f"Failed: {counts.get(FAILED, 0)}")
+        print(f"Queued: {counts.get(QUEUED, 0)}")
+        print(f"In progress: {', '.join(running) or None}")
+        for name, done, total in state.segment_progress():
+            print(f"  {name}: {done}/{total} segments encoded")
+        runs = state.last_scheduler_runs()
+        if runs:
+            print("\nRecent runs:")
+            for run in runs:
+                when = datetime.fromtimestamp(run["started_at"]).strftime("%Y-%m-%d %H:%M")
+                torrent = (f", torrents {run['torrent_bytes'] / 1024**3:.1f} GB"
+                           if run["torrent_bytes"] is not None else "")
+                print(f"  {when}: {run['jobs']} job(s), {(run['encoded_seconds'] or 0) / 60:.0f} min "
+                      f"encoded, paused {run['heat_paused_s'] / 60:.0f} min heat / "
+                      f"{run['io_paused_s'] / 60:.0f} min I/O{torrent}")
+        throughput = state.throughput()
+        if throughput:
+            print("\nThroughput by source class/preset:")
+            for row in throughput:
+                print(f"  {row['cls']:<10} {row['preset']:<9} {row['pipeline']:<9} "
+                      f"{row['runs']:>3} runs  {row['speed']:.2f}x  {row['fps']:.1f} fps  "
+                      f"{row['kbps']:.0f} kbps")
+        failed = state.jobs_with_status(FAILED)
+        if failed:
             print("\nFailed movies:")
-            for f in state['failed']:
-                print(f"  - {f}")
+            for job in failed:
+                detail = f" ({job['error']})" if job["error"] else ""
+                print(f"  - {job['dirname']} [attempts: {job['attempts']}]{detail}")
         return
 
     log("=" * 60)
@@ -399,10 +1260,13 @@ def main():
     log("=" * 60)
 
     # Scan for movies needing mobile versions
-    needs_mobile = scan_movies(limit=args.limit, movie_filter=args.movie)
+    needs_mobile = scan_movies(movie_filter=args.movie)
 
     if args.list:
-        print(f"\nMovies needing mobile versions ({len(needs_mobile)}):\n")
+        # Same order the encoder would use
+        needs_mobile = prioritize(needs_mobile, state)[:args.limit]
+        PROBE_CACHE.save()
+        print(f"\nMovies needing mobile versions ({len(needs_mobile)}), best savings per CPU-second first:\n")
         for movie_dir, source in needs_mobile:
             dirname = os.path.basename(movie_dir)
             source_name = os.path.basename(source)
@@ -411,38 +1275,131 @@ def main():
             print(f"    Source: {source_name} ({size_gb:.1f} GB)")
         return
 
-    if not needs_mobile:
+    if not needs_mobile and not state.queued():
         log("All movies have mobile versions!")
         return
 
-    # Process each movie
-    for i, (movie_dir, source) in enumerate(needs_mobile, 1):
+    # Persistent job queue: drop stale entries, then add anything newly found
+    for movie_dir, source in state.queued():
+        if not os.path.exists(source) or has_mobile_version(movie_dir):
+            state.dequeue(os.path.basename(movie_dir))
+    for movie_dir, source in needs_mobile:
+        state.enqueue(movie_dir, source)
+
+    # Jobs left in progress by a restart go first
+    interrupted_names = state.interrupted()
+    if interrupted_names:
+        log(f"Resuming {len(interrupted_names)} interrupted job(s)")
+
+    scanned = set(needs_mobile)
+    jobs = [e for e in state.queued() if e in scanned]
+    interrupted = [e for e in jobs if os.path.basename(e[0]) in interrupted_names]
+
+    # Interrupted jobs keep their place; the rest go by savings per CPU-second
+    # (this also warms the probe cache for every source in parallel)
+    jobs = interrupted + prioritize([e for e in jobs if e not in interrupted], state)
+    PROBE_CACHE.save()
+    if args.limit:
+        jobs = jobs[:args.limit]
+
+    io_monitor = None
+    if not args.no_io_throttle and not args.dry_run:
+        io_monitor = IOMonitor(pool=ZFS_POOL, log=log)
+    scheduler = EncodeScheduler(
+        jobs=args.jobs,
+        thread_budget=args.threads,
+        max_temp=args.max_temp,
+        io_monitor=io_monitor,
+        log=log,
+    )
+    log(f"Running {scheduler.jobs} encode(s) at a time, {scheduler.threads_per_job} threads each")
+
+    counter = itertools.count(1)
+    status_board = StatusBoard(STATUS_FILE)
+    run_started = time.time()
+    encoded_seconds = []
+
+    def work(job, threads):
+        movie_dir, source = job
         dirname = os.path.basename(movie_dir)
-
-        # Skip if already completed
-        if dirname in state["completed"]:
-            log(f"[{i}/{len(needs_mobile)}] Skipping (already done): {dirname}")
-            continue
-
-        log(f"\n[{i}/{len(needs_mobile)}] Processing: {dirname}")
-
-        state["in_progress"] = dirname
-        save_state(state)
-
-        success = create_mobile_version(source, movie_dir, dry_run=args.dry_run)
-
-        if success:
-            if not args.dry_run:
-                state["completed"].append(dirname)
-        else:
-            state["failed"].append(dirname)
-
-        state["in_progress"] = None
-        save_state(state)
+        log(f"\n[{next(counter)}/{len(jobs)}] Processing: {dirname}")
+
+        if not args.dry_run:
+            state.start_job(dirname, input_bytes=os.path.getsize(source))
+
+        checkpoint = SegmentCheckpoint(state, dirname)
+        prior = checkpoint.load(source)
+        remaining = 1 - len(prior[1]) / len(prior[0]) if prior else 1.0
+        started = time.monotonic()
+        info = get_video_info(source)
+        duration = get_duration(info)
+        progress = None
+        if not args.dry_run:
+            progress = JobProgress(dirname, duration, board=status_board,
+                                   done_seconds=duration * (1 - remaining), log=log)
+
+        success, pipeline = create_mobile_version(source, movie_dir, dry_run=args.dry_run,
+                                                  threads=threads, scheduler=scheduler,
+                                                  chunked=args.chunked,
+                                                  checkpoint=checkpoint,
+                                                  multi_rendition=args.renditions,
+                                                  crf_state=state if args.predict_crf else None,
+                                                  fps_table=state.fps_table(),
+                                                  progress=progress)
+        if not args.dry_run:
+            fps = None
+            renditions = get_renditions(movie_dir, args.renditions)
+            # Hardlinked remuxes share one inode; count its bytes once
+            stats = {(st.st_dev, st.st_ino): st.st_size
+                     for st in (os.stat(r["output"]) for r in renditions if os.path.exists(r["output"]))}
+            output_bytes = sum(stats.values()) or None
+            # Remuxes would skew the learned transcode speed
+            transcoded = pipeline not in (None, "remux")
+            if success and transcoded:
+                fps = record_encode_fps(state, info, duration * remaining,
+                                        time.monotonic() - started)
+            summary = progress.close()
+            encoded_seconds.append(summary["media_seconds"])
+            state.record_run(dirname, summary, success, encode_class(info),
+                             MOBILE_SETTINGS["video_preset"], pipeline or "none")
+            if summary["media_seconds"]:
+                log(f"  Telemetry: {summary['media_seconds'] / 60:.0f} min encoded in "
+                    f"{summary['wall_seconds'] / 60:.0f} min ({summary['speed']:.2f}x, "
+                    f"{summary['fps']:.1f} fps, {summary['kbps'] or '?'} kbps)")
+            state.finish_job(dirname, success, output_bytes=output_bytes, fps=fps,
+                             error=None if success else "encode failed")
+        PROBE_CACHE.save()
+        return success
+
+    for job, result in scheduler.run(jobs, work):
+        if isinstance(result, Exception):
+            log(f"  ERROR: {os.path.basename(job[0])}: {result}")
+            state.finish_job(os.path.basename(job[0]), False, error=str(result))
+
+    if not args.dry_run:
+        io_totals = io_monitor.totals() if io_monitor else {}
+        wall = max(time.time() - run_started, 1.0)
+        encoded = sum(encoded_seconds)
+        state.record_scheduler_run(run_started, len(jobs), scheduler.paused_seconds,
+                                   encoded, io_totals)
+        log(f"Paused {scheduler.paused_seconds['heat'] / 60:.0f} min for heat, "
+            f"{scheduler.paused_seconds['io'] / 60:.0f} min for I/O contention")
+        line = f"Encoded {encoded / 60:.0f} min of video ({encoded / wall:.2f}x realtime)"
+        if io_totals.get("torrent_bytes") is not None:
+            line += (f"; torrents moved {io_totals['torrent_bytes'] / 1024**3:.1f} GB "
+                     f"({io_totals['torrent_bytes'] / wall / 1024**2:.1f} MB/s)")
+        if io_totals.get("pool_read_bytes") is not None:
+            line += (f"; pool read {io_totals['pool_read_bytes'] / 1024**3:.1f} GB, "
+                     f"wrote {io_totals['pool_write_bytes'] / 1024**3:.1f} GB")
+        log(line)
+
+    state.compact()
+    counts = state.counts()
 
     log("\n" + "=" * 60)
-    log(f"Completed: {len(state['completed'])}")
-    log(f"Failed: {len(state['failed'])}")
+    log(f"Completed: {counts.get(COMPLETED, 0)}")
+    log(f"Failed: {counts.get(FAILED, 0)}")
+    log(PROBE_CACHE.summary())
     log("=" * 60)
 
 
@@ -5,86 +5,98 @@ Filter IPTV M3U channels:
 - Remove religious channels
 - Optionally filter to only channels with EPG data
 - Test if streams are actually working
+
+All inputs stream through lib/m3u_pipeline.py in one pass: channels are
+read line by line, go through the filter stages and are written straight
+to --output. The stages come from --rules (config/iptv/filter-rules.json,
+what update-iptv.sh uses) or from the individual flags.
+
+Channel classification (religious / non-US) uses the compiled keyword
+matcher in lib/channel_classifier.py, one scan per channel. --benchmark N
+times it against the original linear keyword scans on a synthetic N-entry
+M3U and checks that both give the same answers.
+
+--test-streams probes with lib/stream_prober.py: HLS playlist, variant and
+a ranged GET of the first segment over asyncio, with ffprobe only for
+non-HLS URLs. Results persist in lib/stream_health.py's store, so a daily
+run only reprobes URLs whose TTL expired and skips hosts that are down.
+--probe-self-test checks the prober against lib/hls_standin.py, a local
+fake HLS server; --cluster-self-test checks the cluster stage's grouping.
 """
 
+import os
 import re
+import sys
 import gzip
+import json
+import time
+import hashlib
+import resource
 import subprocess
-import concurrent.futures
-from pathlib import Path
+import tempfile
+import itertools
 import argparse
 
-# Religious keywords to filter out
-RELIGIOUS_KEYWORDS = [
-    'church', 'jesus', 'christ', 'christian', 'gospel', 'bible', 'faith',
-    'prayer', 'worship', 'ministry', 'ministries', 'pastor', 'sermon',
-    'catholic', 'baptist', 'methodist', 'lutheran', 'episcopal', 'orthodox',
-    'jewish', 'torah', 'kosher', 'islam', 'muslim', 'quran', 'allah',
-    'hindu', 'buddhist', 'sikh', 'religious', 'god tv', 'tbn', 'daystar',
-    'ewtn', 'ctv', 'salvation', 'healing', 'miracle', 'angel', 'heaven',
-    'trinity', 'divine', 'blessed', 'holy', 'spirit', 'apostolic',
-    'pentecostal', 'evangelical', 'televangelism', 'preacher', 'revival',
-    'hillsong', 'bethel', 'creflo', 'joel osteen', 'kenneth copeland',
-    'benny hinn', 'joyce meyer', '3abn', 'hope channel', 'upliftv',
-    'inspiration', 'word network', 'son life', 'victory channel',
-    'god\'s learning', 'juce tv', 'smile of a child', 'nrb', 'fetv'
-]
-
-# Non-US country indicators to filter out
-NON_US_INDICATORS = [
-    '🇬🇧', '🇨🇦', '🇦🇺', '🇩🇪', '🇫🇷', '🇪🇸', '🇮🇹', '🇧🇷', '🇲🇽', '🇯🇵',
-    '🇰🇷', '🇨🇳', '🇮🇳', '🇷🇺', '🇵🇱', '🇳🇱', '🇧🇪', '🇦🇹', '🇨🇭', '🇸🇪',
-    '🇳🇴', '🇩🇰', '🇫🇮', '🇵🇹', '🇬🇷', '🇹🇷', '🇮🇱', '🇦🇪', '🇸🇦', '🇪🇬',
-    '🇿🇦', '🇳🇬', '🇰🇪', '🇵🇭', '🇮🇩', '🇹🇭', '🇻🇳', '🇲🇾', '🇸🇬', '🇭🇰',
-    '🇹🇼', '🇦🇷', '🇨🇱', '🇨🇴', '🇵🇪', '🇻🇪', '🇵🇰', '🇧🇩', '🇱🇰', '🇳🇵',
-    'UK:', 'CA:', 'AU:', 'DE:', 'FR:', 'ES:', 'IT:', 'BR:', 'MX:', 'IN:',
-    '(UK)', '(CA)', '(AU)', '(DE)', '(FR)', '(ES)', '(IT)', '(BR)', '(MX)',
-    'United Kingdom', 'Canada', 'Australia', 'Germany', 'France', 'Spain',
-    'Italy', 'Brazil', 'Mexico', 'India', 'Russia', 'China', 'Japan',
-    'Arabic', 'Hindi', 'Spanish', 'Portuguese', 'French', 'German',
-    'Korean', 'Chinese', 'Japanese', 'Russian', 'Turkish', 'Polish',
-    'Telemundo', 'Univision', 'Azteca',  # Spanish-language US but often foreign content
-]
-
-# US indicators (positive match)
-US_INDICATORS = [
-    '🇺🇸', 'US:', 'USA:', '(US)', '(USA)', 'United States',
-    'ABC', 'CBS', 'NBC', 'FOX', 'CNN', 'MSNBC', 'ESPN', 'NFL', 'NBA', 'MLB',
-    'PBS', 'CW', 'AMC', 'FX', 'TNT', 'TBS', 'USA Network', 'Syfy', 'Bravo',
-    'HGTV', 'Food Network', 'Discovery', 'History', 'A&E', 'Lifetime',
-    'Comedy Central', 'MTV', 'VH1', 'BET', 'Nickelodeon', 'Cartoon Network',
-    'Disney', 'Freeform', 'Hallmark', 'Paramount', 'Showtime', 'HBO', 'Starz',
-    'Cinemax', 'Epix', 'Weather Channel', 'C-SPAN', 'Bloomberg', 'CNBC',
-    'Newsmax', 'OAN', 'Pluto', 'Tubi', 'Roku', 'Peacock', 'Xumo',
-]
-
-
-def is_religious(name, group=''):
-    """Check if channel is religious."""
-    text = f"{name} {group}".lower()
-    return any(kw in text for kw in RELIGIOUS_KEYWORDS)
-
-
-def is_likely_us(name, group=''):
-    """Check if channel is likely US-based."""
-    text = f"{name} {group}"
-
-    # Negative indicators (non-US)
-    for indicator in NON_US_INDICATORS:
-        if indicator.lower() in text.lower():
-            return False
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from channel_classifier import run_benchmark, synthetic_m3u
+from m3u_pipeline import RULES_FILE, cluster_self_test, load_rules, read_m3u, run_pipeline
+from stream_prober import CONCURRENCY, PER_HOST
+from stream_health import HEALTH_FILE
+from hls_standin import self_test
+
+
+EPG_CHUNK_CHARS = 1024 * 1024
+EPG_CHANNEL_RE = re.compile(r'<channel\s+id="([^"]*)"')
+
+
+def open_epg(epg_path):
+    if epg_path.endswith('.gz'):
+        return gzip.open(epg_path, 'rt', encoding='utf-8', errors='ignore')
+    return open(epg_path, 'r', encoding='utf-8', errors='ignore')
+
+
+def scan_epg_channel_ids(f, chunk_chars=EPG_CHUNK_CHARS):
+    """Yield channel IDs from an XMLTV stream, reading fixed-size chunks.
+
+    Channels come before programmes in XMLTV, so reading stops at the first
+    <programme. A partial tag at the end of a chunk is carried over to the
+    next one (attribute values can't contain '<', so the last '<' is a safe
+    cut point).
+    """
+    carry = ''
+    while True:
+        chunk = f.read(chunk_chars)
+        buffer = carry + chunk
+        end = buffer.find('<programme')
+        if end != -1:
+            buffer = buffer[:end]
+            chunk = ''
+        cut = buffer.rfind('<') if chunk else len(buffer)
+        if cut == -1:
+            cut = len(buffer)
+        for match in EPG_CHANNEL_RE.finditer(buffer, 0, cut):
+            yield match.group(1)
+        carry = buffer[cut:]
+        if not chunk:
+            return
+
+
+def load_epg_channel_ids(epg_paths):
+    """Load all channel IDs from EPG files, streaming only their <channel> section."""
+    ids = set()
 
-    # Positive indicators (US)
-    for indicator in US_INDICATORS:
-        if indicator.lower() in text.lower():
-            return True
+    for epg_path in epg_paths:
+        try:
+            with open_epg(epg_path) as f:
+                ids.update(channel_id.lower() for channel_id in scan_epg_channel_ids(f))
+        except Exception as e:
+            print(f"  Warning: Could not load {epg_path}: {e}")
 
-    # Default: include if no clear country indicator
-    return True
+    return ids
 
 
-def load_epg_channel_ids(epg_paths):
-    """Load all channel IDs from EPG files."""
+def load_epg_channel_ids_full(epg_paths):
+    """Load all channel IDs by reading each EPG into memory (the old way, for --epg-benchmark)."""
     ids = set()
 
     for epg_path in epg_paths:
@@ -106,197 +118,189 @@ def load_epg_channel_ids(epg_paths):
     return ids
 
 
-def test_stream(url, timeout=5):
-    """Test if a stream URL is working."""
-    try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'quiet', '-i', url, '-show_entries', 'format=duration', '-of', 'csv=p=0'],
-            timeout=timeout,
-            capture_output=True
-        )
-        return result.returncode == 0
-    except:
-        return None  # Unknown
-
-
-def parse_m3u(m3u_path):
-    """Parse M3U file and extract channel info."""
-    with open(m3u_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
-
-    channels = []
-    lines = content.split('\n')
-    header = lines[0] if lines[0].startswith('#EXTM3U') else '#EXTM3U'
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-
-        if line.startswith('#EXTINF'):
-            # Extract channel name
-            name_match = re.search(r',(.+)$', line)
-            name = name_match.group(1).strip() if name_match else ''
-
-            # Extract group
-            group_match = re.search(r'group-title="([^"]*)"', line)
-            group = group_match.group(1) if group_match else ''
-
-            # Extract tvg-id
-            tvg_match = re.search(r'tvg-id="([^"]*)"', line)
-            tvg_id = tvg_match.group(1) if tvg_match else ''
-
-            # Get URL (next non-comment line)
-            url = ''
-            for j in range(i + 1, min(i + 5, len(lines))):
-                if lines[j].strip() and not lines[j].strip().startswith('#'):
-                    url = lines[j].strip()
-                    break
-
-            if url:
-                channels.append({
-                    'name': name,
-                    'group': group,
-                    'tvg_id': tvg_id,
-                    'url': url,
-                    'extinf': line
-                })
-
-        i += 1
-
-    return header, channels
+EPG_LOADERS = {'streaming': load_epg_channel_ids, 'full': load_epg_channel_ids_full}
+
+
+def epg_benchmark_child(mode, epg_paths):
+    """Run one EPG loader and print its time, peak RSS and result digest as JSON."""
+    start = time.perf_counter()
+    ids = EPG_LOADERS[mode](epg_paths)
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        'seconds': seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'ids': len(ids),
+        'digest': hashlib.sha1('\n'.join(sorted(ids)).encode()).hexdigest(),
+    }))
+
+
+def epg_benchmark(epg_paths):
+    """Compare the streaming and full-read EPG loaders, each in a fresh process."""
+    results = {}
+    for mode in ('full', 'streaming'):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                               '--epg-benchmark-child', mode, '--epg', *epg_paths],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"  {mode}: failed\n{proc.stderr}")
+            return False
+        results[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+        r = results[mode]
+        print(f"  {mode:<9}  {r['seconds']:6.2f}s  peak RSS {r['peak_rss_mb']:7.1f} MB  "
+              f"{r['ids']} channel IDs")
+    same = results['full']['digest'] == results['streaming']['digest']
+    print("Parity: OK" if same else "Parity: MISMATCH")
+    return same
+
+
+def rules_from_args(args):
+    """Pipeline rules from --rules, or built from the individual flags.
+
+    Flags given on the command line (--test-streams, --epg-only, keywords,
+    probe options) are applied on top of a rules file.
+    """
+    if args.rules:
+        rules = load_rules(args.rules)
+    else:
+        stages = []
+        if args.no_religious:
+            stages.append({'stage': 'religious'})
+        if args.us_only:
+            stages.append({'stage': 'country'})
+        if args.strict_us:
+            stages.append({'stage': 'strict_country'})
+        stages += [{'stage': 'epg', 'enabled': False}, {'stage': 'keyword'},
+                   {'stage': 'health', 'enabled': False}, {'stage': 'cluster'}]
+        rules = {'stages': stages, 'sort': True}
+
+    by_stage = {rule['stage']: rule for rule in rules['stages']}
+
+    def stage(name):
+        if name not in by_stage:
+            # Before dedup/cluster, so dead or unlisted duplicates don't shadow good ones
+            rule = {'stage': name}
+            dedup = next((i for i, r in enumerate(rules['stages'])
+                          if r['stage'] in ('dedup', 'cluster')), len(rules['stages']))
+            rules['stages'].insert(dedup, rule)
+            by_stage[name] = rule
+        return by_stage[name]
+
+    if args.epg_only:
+        stage('epg')['enabled'] = True
+    if args.include_keywords or args.exclude_keywords:
+        rule = stage('keyword')
+        rule['include'] = (rule.get('include') or []) + (args.include_keywords or [])
+        rule['exclude'] = (rule.get('exclude') or []) + (args.exclude_keywords or [])
+    if args.test_streams:
+        stage('health')['enabled'] = True
+    health = by_stage.get('health')
+    if health is not None:
+        for key, value in (('concurrency', args.probe_concurrency),
+                           ('per_host', args.probe_per_host),
+                           ('health_file', args.health_file)):
+            if value is not None:
+                health[key] = value
+        if args.retest_all:
+            health['retest'] = True
+    return rules
 
 
 def main():
     parser = argparse.ArgumentParser(description='Filter IPTV M3U channels')
-    parser.add_argument('--input', '-i', required=True, nargs='+', help='Input M3U file(s)')
-    parser.add_argument('--output', '-o', required=True, help='Output M3U file')
+    parser.add_argument('--input', '-i', nargs='+', help='Input M3U file(s)')
+    parser.add_argument('--output', '-o', help='Output M3U file')
     parser.add_argument('--epg', '-e', nargs='+', help='EPG file(s) for filtering')
     parser.add_argument('--epg-only', action='store_true', help='Only include channels with EPG')
-    parser.add_argument('--test-streams', action='store_true', help='Test if streams work (slow)')
+    parser.add_argument('--test-streams', action='store_true', help='Test if streams work')
+    parser.add_argument('--probe-concurrency', type=int,
+                        help=f'Streams probed at once (default: {CONCURRENCY})')
+    parser.add_argument('--probe-per-host', type=int,
+                        help=f'Connections per stream host (default: {PER_HOST})')
+    parser.add_argument('--health-file', help=f'Stream health store (default: {HEALTH_FILE})')
+    parser.add_argument('--retest-all', action='store_true',
+                        help='Probe every stream, ignoring cached health')
     parser.add_argument('--us-only', action='store_true', default=True, help='Only US channels')
     parser.add_argument('--no-religious', action='store_true', default=True, help='Filter religious')
+    parser.add_argument('--strict-us', action='store_true',
+                        help='Also apply the stricter non-US list (always on with --rules)')
+    parser.add_argument('--rules', nargs='?', const=RULES_FILE, metavar='FILE',
+                        help=f'Take the filter stages from a rules file (default: {RULES_FILE})')
     parser.add_argument('--include-keywords', nargs='+', help='Must contain these keywords')
     parser.add_argument('--exclude-keywords', nargs='+', help='Must not contain these keywords')
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='Benchmark/parity-check the classifier on a synthetic N-entry M3U')
+    parser.add_argument('--epg-benchmark', action='store_true',
+                        help='Compare time and peak RSS of streaming vs full-read EPG loading of --epg')
+    parser.add_argument('--epg-benchmark-child', choices=sorted(EPG_LOADERS), help=argparse.SUPPRESS)
+    parser.add_argument('--probe-self-test', action='store_true',
+                        help='Check the stream prober against a local fake HLS server')
+    parser.add_argument('--cluster-self-test', action='store_true',
+                        help='Check the cluster stage on hand-made duplicate channels')
     args = parser.parse_args()
 
-    # Load EPG channel IDs if filtering by EPG
-    epg_ids = set()
-    if args.epg:
-        print("Loading EPG channel IDs...")
-        epg_ids = load_epg_channel_ids(args.epg)
-        print(f"  Found {len(epg_ids)} EPG channel IDs")
-
-    # Parse all input M3U files
-    all_channels = []
-    for m3u_path in args.input:
-        print(f"Loading {m3u_path}...")
-        header, channels = parse_m3u(m3u_path)
-        all_channels.extend(channels)
-        print(f"  Found {len(channels)} channels")
-
-    print(f"\nTotal channels: {len(all_channels)}")
-
-    # Filter channels
-    filtered = []
-    stats = {'religious': 0, 'non_us': 0, 'no_epg': 0, 'keyword': 0, 'dead': 0}
-
-    print("Filtering channels...")
-
-    for ch in all_channels:
-        name = ch['name']
-        group = ch['group']
-        tvg_id = ch['tvg_id']
+    if args.probe_self_test:
+        failures = self_test()
+        print("Self-test: OK" if not failures else f"Self-test: {failures} failures")
+        sys.exit(1 if failures else 0)
+
+    if args.cluster_self_test:
+        failures = cluster_self_test()
+        print("Self-test: OK" if not failures else f"Self-test: {failures} failures")
+        sys.exit(1 if failures else 0)
+
+    if args.epg_benchmark_child:
+        epg_benchmark_child(args.epg_benchmark_child, args.epg or [])
+        return
+
+    if args.epg_benchmark:
+        if not args.epg:
+            parser.error('--epg-benchmark needs --epg')
+        sys.exit(0 if epg_benchmark(args.epg) else 1)
+
+    if args.benchmark:
+        with tempfile.NamedTemporaryFile(suffix='.m3u') as tmp:
+            synthetic_m3u(tmp.name, args.benchmark)
+            start = time.perf_counter()
+            channels = list(read_m3u(tmp.name))
+            print(f"Parsed {len(channels)} channels in {time.perf_counter() - start:.2f}s")
+        mismatches = run_benchmark(channels)
+        print("Parity: OK" if not mismatches else f"Parity: {mismatches} mismatches")
+        sys.exit(1 if mismatches else 0)
+
+    if not args.input or not args.output:
+        parser.error('--input and --output are required')
 
-        # Filter religious
-        if args.no_religious and is_religious(name, group):
-            stats['religious'] += 1
-            continue
-
-        # Filter non-US
-        if args.us_only and not is_likely_us(name, group):
-            stats['non_us'] += 1
-            continue
-
-        # Filter by EPG
-        if args.epg_only and epg_ids:
-            if tvg_id.lower() not in epg_ids:
-                stats['no_epg'] += 1
-                continue
-
-        # Custom keyword filters
-        text = f"{name} {group}".lower()
-
-        if args.include_keywords:
-            if not any(kw.lower() in text for kw in args.include_keywords):
-                stats['keyword'] += 1
-                continue
-
-        if args.exclude_keywords:
-            if any(kw.lower() in text for kw in args.exclude_keywords):
-                stats['keyword'] += 1
-                continue
+    try:
+        rules = rules_from_args(args)
+    except (OSError, ValueError) as e:
+        parser.error(f"bad rules file: {e}")
+    enabled = [r['stage'] for r in rules['stages'] if r.get('enabled', True)]
+    print(f"Stages: {' -> '.join(enabled)}")
+
+    context = {'log': print}
+    if 'epg' in enabled and args.epg:
+        print("Loading EPG channel IDs...")
+        context['epg_ids'] = load_epg_channel_ids(args.epg)
+        print(f"  Found {len(context['epg_ids'])} EPG channel IDs")
 
-        filtered.append(ch)
+    start = time.time()
+    stats = run_pipeline(args.input, args.output, rules, context)
 
     print(f"\nFiltering results:")
-    print(f"  Religious removed: {stats['religious']}")
-    print(f"  Non-US removed: {stats['non_us']}")
-    print(f"  No EPG removed: {stats['no_epg']}")
-    print(f"  Keyword filtered: {stats['keyword']}")
-    print(f"  Remaining: {len(filtered)}")
-
-    # Test streams if requested
-    if args.test_streams and filtered:
-        print(f"\nTesting {len(filtered)} streams (this may take a while)...")
-        working = []
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {executor.submit(test_stream, ch['url']): ch for ch in filtered}
-
-            for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                ch = futures[future]
-                result = future.result()
-                if result is True or result is None:  # Working or unknown
-                    working.append(ch)
-                else:
-                    stats['dead'] += 1
-
-                if (i + 1) % 50 == 0:
-                    print(f"  Tested {i + 1}/{len(filtered)}...")
-
-        filtered = working
-        print(f"  Dead streams removed: {stats['dead']}")
-        print(f"  Working streams: {len(filtered)}")
-
-    # Deduplicate by name
-    seen_names = set()
-    deduped = []
-    for ch in filtered:
-        if ch['name'].lower() not in seen_names:
-            seen_names.add(ch['name'].lower())
-            deduped.append(ch)
-
-    if len(deduped) < len(filtered):
-        print(f"  Duplicates removed: {len(filtered) - len(deduped)}")
-        filtered = deduped
-
-    # Sort by group then name
-    filtered.sort(key=lambda x: (x['group'].lower(), x['name'].lower()))
-
-    # Write output
-    print(f"\nWriting {len(filtered)} channels to {args.output}")
-
-    with open(args.output, 'w', encoding='utf-8') as f:
-        f.write('#EXTM3U\n')
-        for ch in filtered:
-            f.write(f"{ch['extinf']}\n")
-            f.write(f"{ch['url']}\n")
-
-    print("Done!")
+    for stage, before, after in stats:
+        if stage == 'read':
+            print(f"  Read: {after} channels")
+        else:
+            print(f"  {stage}: {before - after} removed")
+    if 'health' in context:
+        print(f"  {context['health'].summary()}")
+    print(f"  Remaining: {stats[-1][2]}")
+
+    print(f"\nWrote {stats[-1][2]} channels to {args.output} in {time.time() - start:.1f}s")
 
     # Show sample of included channels
     print(f"\nSample channels included:")
-    for ch in filtered[:20]:
+    for ch in itertools.islice(read_m3u(args.output), 20):
         print(f"  [{ch['group']}] {ch['name']}")
 
 
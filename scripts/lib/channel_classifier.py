@@ -0,0 +1,250 @@
+"""
+Keyword classifier for IPTV channels, shared by filter-iptv-channels.py and
+update-iptv.sh.
+
+Every keyword list is compiled once into a single regex shaped like a trie
+(one branch per next character, so the regex engine never retries
+hundreds of alternatives at each position) inside a lookahead, so one scan
+of the lowercased "name group" text reports the longest keyword starting
+at every position. Each keyword carries the categories of all keywords
+that are prefixes of it, so the result is exactly the set of categories
+with any keyword occurring as a substring - the same answer as the old
+`any(kw.lower() in text.lower() for kw in ...)` loops.
+
+Usage:
+    from channel_classifier import CLASSIFIER, is_religious, is_likely_us
+
+    CLASSIFIER.classify("CNN International", "News")   # -> {"us"}
+    is_religious("Hope Channel", "Religious")          # -> True
+"""
+
+import re
+import time
+import random
+
+# Religious keywords to filter out
+RELIGIOUS_KEYWORDS = [
+    'church', 'jesus', 'christ', 'christian', 'gospel', 'bible', 'faith',
+    'prayer', 'worship', 'ministry', 'ministries', 'pastor', 'sermon',
+    'catholic', 'baptist', 'methodist', 'lutheran', 'episcopal', 'orthodox',
+    'jewish', 'torah', 'kosher', 'islam', 'muslim', 'quran', 'allah',
+    'hindu', 'buddhist', 'sikh', 'religious', 'god tv', 'tbn', 'daystar',
+    'ewtn', 'ctv', 'salvation', 'healing', 'miracle', 'angel', 'heaven',
+    'trinity', 'divine', 'blessed', 'holy', 'spirit', 'apostolic',
+    'pentecostal', 'evangelical', 'televangelism', 'preacher', 'revival',
+    'hillsong', 'bethel', 'creflo', 'joel osteen', 'kenneth copeland',
+    'benny hinn', 'joyce meyer', '3abn', 'hope channel', 'upliftv',
+    'inspiration', 'word network', 'son life', 'victory channel',
+    'god\'s learning', 'juce tv', 'smile of a child', 'nrb', 'fetv'
+]
+
+# Non-US country indicators to filter out
+NON_US_INDICATORS = [
+    '🇬🇧', '🇨🇦', '🇦🇺', '🇩🇪', '🇫🇷', '🇪🇸', '🇮🇹', '🇧🇷', '🇲🇽', '🇯🇵',
+    '🇰🇷', '🇨🇳', '🇮🇳', '🇷🇺', '🇵🇱', '🇳🇱', '🇧🇪', '🇦🇹', '🇨🇭', '🇸🇪',
+    '🇳🇴', '🇩🇰', '🇫🇮', '🇵🇹', '🇬🇷', '🇹🇷', '🇮🇱', '🇦🇪', '🇸🇦', '🇪🇬',
+    '🇿🇦', '🇳🇬', '🇰🇪', '🇵🇭', '🇮🇩', '🇹🇭', '🇻🇳', '🇲🇾', '🇸🇬', '🇭🇰',
+    '🇹🇼', '🇦🇷', '🇨🇱', '🇨🇴', '🇵🇪', '🇻🇪', '🇵🇰', '🇧🇩', '🇱🇰', '🇳🇵',
+    'UK:', 'CA:', 'AU:', 'DE:', 'FR:', 'ES:', 'IT:', 'BR:', 'MX:', 'IN:',
+    '(UK)', '(CA)', '(AU)', '(DE)', '(FR)', '(ES)', '(IT)', '(BR)', '(MX)',
+    'United Kingdom', 'Canada', 'Australia', 'Germany', 'France', 'Spain',
+    'Italy', 'Brazil', 'Mexico', 'India', 'Russia', 'China', 'Japan',
+    'Arabic', 'Hindi', 'Spanish', 'Portuguese', 'French', 'German',
+    'Korean', 'Chinese', 'Japanese', 'Russian', 'Turkish', 'Polish',
+    'Telemundo', 'Univision', 'Azteca',  # Spanish-language US but often foreign content
+]
+
+# US indicators (positive match)
+US_INDICATORS = [
+    '🇺🇸', 'US:', 'USA:', '(US)', '(USA)', 'United States',
+    'ABC', 'CBS', 'NBC', 'FOX', 'CNN', 'MSNBC', 'ESPN', 'NFL', 'NBA', 'MLB',
+    'PBS', 'CW', 'AMC', 'FX', 'TNT', 'TBS', 'USA Network', 'Syfy', 'Bravo',
+    'HGTV', 'Food Network', 'Discovery', 'History', 'A&E', 'Lifetime',
+    'Comedy Central', 'MTV', 'VH1', 'BET', 'Nickelodeon', 'Cartoon Network',
+    'Disney', 'Freeform', 'Hallmark', 'Paramount', 'Showtime', 'HBO', 'Starz',
+    'Cinemax', 'Epix', 'Weather Channel', 'C-SPAN', 'Bloomberg', 'CNBC',
+    'Newsmax', 'OAN', 'Pluto', 'Tubi', 'Roku', 'Peacock', 'Xumo',
+]
+
+# Stricter non-US list applied to the final playlist (was inline in update-iptv.sh)
+NON_US_STRICT = [
+    'Hindi', 'Punjabi', 'Tamil', 'Telugu', 'Bengali', 'Marathi', 'Gujarati',
+    'Kannada', 'Malayalam', 'Urdu', 'Arabic', 'Portuguese', 'Russian',
+    'Chinese', 'Korean', 'Japanese', 'Turkish', 'Polish', 'Italian',
+    'India', 'Pakistan', 'Bangladesh', 'Nepal', 'Mexico', 'Brazil',
+    'UK', 'Britain', 'Canada', 'Australia', 'Africa', 'Saudi', 'Iran',
+    'Russia', 'Ukraine', 'China', 'Japan', 'Korea', 'Taiwan',
+    'ABP', 'NDTV', 'Zee', 'Star India', 'Colors', 'Aaj Tak', 'TV9',
+    'Telemundo', 'Univision', 'Azteca', 'Al Arabiya', 'MBC', 'Globo',
+]
+
+CATEGORIES = {
+    'religious': RELIGIOUS_KEYWORDS,
+    'non_us': NON_US_INDICATORS,
+    'us': US_INDICATORS,
+    'non_us_strict': NON_US_STRICT,
+}
+
+
+def trie_pattern(words):
+    """Regex matching any of words, factored as a trie; greedy, so the longest wins."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        ends = '' in node
+        branches = [re.escape(char) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if ends:
+            # Word may stop here; (?:...)? is greedy, so longer words are tried first
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+class ChannelClassifier:
+    """Match text against several keyword lists in one pass."""
+
+    def __init__(self, categories=CATEGORIES):
+        keyword_categories = {}
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                keyword_categories.setdefault(keyword.lower(), set()).add(category)
+
+        # A match of a keyword implies a match of every keyword that is its prefix
+        self.categories_of = {}
+        for keyword in keyword_categories:
+            found = set()
+            for end in range(1, len(keyword) + 1):
+                found |= keyword_categories.get(keyword[:end], set())
+            self.categories_of[keyword] = frozenset(found)
+
+        self.regex = re.compile('(?=(' + trie_pattern(keyword_categories) + '))')
+
+    def categories(self, text):
+        """Set of categories with a keyword occurring in (already lowercased) text."""
+        found = set()
+        for match in self.regex.finditer(text):
+            found |= self.categories_of[match.group(1)]
+        return found
+
+    def classify(self, name, group=''):
+        return self.categories(f"{name} {group}".lower())
+
+
+CLASSIFIER = ChannelClassifier()
+
+
+def is_religious(name, group=''):
+    """Check if channel is religious."""
+    return 'religious' in CLASSIFIER.classify(name, group)
+
+
+def is_likely_us(name, group=''):
+    """Check if channel is likely US-based (no non-US indicator)."""
+    return 'non_us' not in CLASSIFIER.classify(name, group)
+
+
+def is_strict_us(name, group=''):
+    """Check the final playlist's stricter non-US list."""
+    return 'non_us_strict' not in CLASSIFIER.classify(name, group)
+
+
+# -- reference implementations (the original linear scans) -------------------
+
+def reference_is_religious(name, group=''):
+    text = f"{name} {group}".lower()
+    return any(kw in text for kw in RELIGIOUS_KEYWORDS)
+
+
+def reference_is_likely_us(name, group=''):
+    text = f"{name} {group}"
+    for indicator in NON_US_INDICATORS:
+        if indicator.lower() in text.lower():
+            return False
+    for indicator in US_INDICATORS:
+        if indicator.lower() in text.lower():
+            return True
+    return True
+
+
+def reference_is_strict_us(name, group=''):
+    text = f"{name} {group}".lower()
+    for ind in NON_US_STRICT:
+        if ind.lower() in text:
+            return False
+    return True
+
+
+def synthetic_m3u(path, entries, seed=1):
+    """Write an M3U with realistic-looking channel names mixing all keyword lists."""
+    rng = random.Random(seed)
+    words = ['News', 'Live', 'HD', 'Sports', 'Movies', 'Kids', 'Classic', 'Channel', 'TV',
+             'Network', '24/7', 'Plus', 'East', 'West', 'Local', 'Weather', 'Music', 'Retro']
+    keywords = RELIGIOUS_KEYWORDS + NON_US_INDICATORS + US_INDICATORS + NON_US_STRICT
+    groups = ['News', 'Entertainment', 'Sports', 'Religious', 'Kids', 'Movies', 'Music',
+              'General', 'Undefined', 'Local']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('#EXTM3U\n')
+        for i in range(entries):
+            parts = rng.sample(words, rng.randint(1, 3))
+            if rng.random() < 0.6:
+                keyword = rng.choice(keywords)
+                if rng.random() < 0.5:
+                    keyword = keyword.upper() if rng.random() < 0.5 else keyword.title()
+                parts.insert(rng.randint(0, len(parts)), keyword)
+            name = ' '.join(parts)
+            group = rng.choice(groups)
+            f.write(f'#EXTINF:-1 tvg-id="ch{i}.us" group-title="{group}",{name}\n')
+            f.write(f'https://example.com/stream/{i}.m3u8\n')
+
+
+def run_benchmark(channels, log=print):
+    """Time and compare the compiled classifier against the reference scans.
+
+    channels is a list of dicts with 'name' and 'group' (as parse_m3u
+    returns). Returns the number of disagreements (0 means parity).
+    """
+    checks = [
+        ('is_religious', reference_is_religious, is_religious),
+        ('is_likely_us', reference_is_likely_us, is_likely_us),
+        ('is_strict_us', reference_is_strict_us, is_strict_us),
+    ]
+    pairs = [(ch['name'], ch['group']) for ch in channels]
+    mismatches = 0
+
+    start = time.perf_counter()
+    reference = [[ref(n, g) for n, g in pairs] for _, ref, _ in checks]
+    ref_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = [[fn(n, g) for n, g in pairs] for _, _, fn in checks]
+    new_seconds = time.perf_counter() - start
+
+    # Classification happens once per channel in the filters, so time that too
+    start = time.perf_counter()
+    for n, g in pairs:
+        CLASSIFIER.classify(n, g)
+    single_seconds = time.perf_counter() - start
+
+    for (label, _, _), ref_results, new_results in zip(checks, reference, compiled):
+        diff = [pairs[i] for i, (a, b) in enumerate(zip(ref_results, new_results)) if a != b]
+        mismatches += len(diff)
+        matched = sum(1 for r in ref_results if not r) if label != 'is_religious' \
+            else sum(ref_results)
+        log(f"  {label}: {matched} flagged, {len(diff)} mismatches")
+        for name, group in diff[:5]:
+            log(f"    mismatch: {name!r} [{group}]")
+
+    log(f"  Reference (3 linear scans): {ref_seconds:.2f}s")
+    log(f"  Compiled  (3 calls):        {new_seconds:.2f}s ({ref_seconds / new_seconds:.1f}x)")
+    log(f"  Compiled  (1 classify):     {single_seconds:.2f}s ({ref_seconds / single_seconds:.1f}x)")
+    return mismatches
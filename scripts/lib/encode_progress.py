@@ -0,0 +1,225 @@
+"""
+Structured ffmpeg progress telemetry for the encode scripts.
+
+ffmpeg is run with "-progress pipe:1 -nostats", which prints key=value
+blocks (frame, fps, bitrate, total_size, out_time_us, speed, progress)
+about twice a second instead of \r-terminated "frame=" lines. A
+JobProgress folds the blocks of every ffmpeg process working on a job
+(e.g. parallel segments) into one view with an ETA from the source
+duration, and a StatusBoard keeps a small JSON status file of all running
+jobs that other tools (or `cat`) can read while the service runs.
+
+Usage:
+    from encode_progress import JobProgress, StatusBoard, parse_progress, progress_args
+
+    board = StatusBoard("/path/to/mobile-encode-status.json")
+    progress = JobProgress("Movie (2021)", duration=7200, board=board, log=log)
+    stream = progress.stream()
+    for block in parse_progress(process.stdout):
+        progress.update(stream, block)
+    progress.finish_stream(stream)
+    summary = progress.close()
+"""
+
+import os
+import json
+import time
+import itertools
+import threading
+from datetime import datetime
+
+# Seconds between status file rewrites and between progress log lines
+STATUS_INTERVAL = 10
+LOG_INTERVAL = 60
+
+
+def progress_args():
+    """ffmpeg options for machine-readable progress on stdout."""
+    return ["-progress", "pipe:1", "-nostats"]
+
+
+def parse_progress(lines):
+    """Yield one dict per -progress block; other output lines are ignored."""
+    block = {}
+    for line in lines:
+        key, sep, value = line.strip().partition("=")
+        if not sep or " " in key:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def _number(value, suffix=""):
+    """Parse "1.5x" / "812.3kbits/s" / "N/A" style values (None if unknown)."""
+    if value is None:
+        return None
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class StatusBoard:
+    """Rolling JSON status file of every running job, rewritten atomically."""
+
+    def __init__(self, path, interval=STATUS_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def update(self, name, entry, force=False):
+        with self._lock:
+            self.jobs[name] = entry
+            self._write(force)
+
+    def remove(self, name):
+        with self._lock:
+            self.jobs.pop(name, None)
+            self._write(force=True)
+
+    def _write(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._written < self.interval:
+            return
+        self._written = now
+        status = {"updated": datetime.now().isoformat(timespec="seconds"), "jobs": self.jobs}
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(status, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # Telemetry must never fail an encode
+
+
+class JobProgress:
+    """Aggregate -progress telemetry for one job across its ffmpeg processes.
+
+    duration is the source length in seconds; done_seconds is how much of
+    it was already encoded before this run (resumed segments).
+    """
+
+    def __init__(self, name, duration, board=None, done_seconds=0.0, log=None,
+                 log_interval=LOG_INTERVAL):
+        self.name = name
+        self.duration = duration or 0.0
+        self.board = board
+        self.done_before = done_seconds
+        self.log = log
+        self.log_interval = log_interval
+
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._logged = self.started
+        self.live = {}      # stream id -> latest block numbers
+        self.finished = {"seconds": 0.0, "frames": 0, "bytes": 0}
+
+    def stream(self):
+        """Register an ffmpeg process; returns the id to report its blocks under."""
+        stream_id = next(self._ids)
+        with self._lock:
+            self.live[stream_id] = {"seconds": 0.0, "frames": 0, "bytes": 0,
+                                    "fps": 0.0, "speed": 0.0}
+        return stream_id
+
+    def update(self, stream_id, block):
+        out_us = _number(block.get("out_time_us") or block.get("out_time_ms"))
+        values = {
+            "seconds": max(0.0, out_us / 1e6) if out_us is not None else None,
+            "frames": _number(block.get("frame")),
+            "bytes": _number(block.get("total_size")),
+            "fps": _number(block.get("fps")),
+            "speed": _number(block.get("speed"), "x"),
+        }
+        with self._lock:
+            entry = self.live.setdefault(stream_id, {})
+            # N/A (e.g. before the first frame) keeps the previous value
+            for key, value in values.items():
+                if value is not None:
+                    entry[key] = int(value) if key in ("frames", "bytes") else value
+        self._report()
+
+    def finish_stream(self, stream_id):
+        with self._lock:
+            entry = self.live.pop(stream_id, None)
+            if entry:
+                for key in self.finished:
+                    self.finished[key] += entry[key]
+        self._report()
+
+    def totals(self):
+        """Seconds/frames/bytes encoded this run, plus current fps and speed."""
+        with self._lock:
+            totals = dict(self.finished)
+            totals["fps"] = totals["speed"] = 0.0
+            for entry in self.live.values():
+                for key in ("seconds", "frames", "bytes", "fps", "speed"):
+                    totals[key] += entry[key]
+        return totals
+
+    def snapshot(self):
+        """Status entry for the rolling status file."""
+        totals = self.totals()
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        done = min(self.duration, self.done_before + totals["seconds"]) if self.duration \
+            else self.done_before + totals["seconds"]
+        # Average speed over the run is steadier than ffmpeg's instantaneous one
+        avg_speed = totals["seconds"] / elapsed
+        eta = (self.duration - done) / avg_speed if self.duration and avg_speed > 0 else None
+        entry = {
+            "done": round(done, 1),
+            "duration": round(self.duration, 1),
+            "percent": round(done / self.duration * 100, 1) if self.duration else None,
+            "fps": round(totals["fps"], 1),
+            "speed": round(totals["speed"], 2),
+            "kbps": round(totals["bytes"] * 8 / 1000 / totals["seconds"]) if totals["seconds"] else None,
+            "eta": round(eta) if eta is not None else None,
+            "eta_at": datetime.fromtimestamp(time.time() + eta).isoformat(timespec="seconds")
+                      if eta is not None else None,
+            "elapsed": round(elapsed),
+        }
+        return entry
+
+    def _report(self, force=False):
+        entry = self.snapshot()
+        if self.board:
+            self.board.update(self.name, entry, force)
+        now = time.monotonic()
+        if self.log and (force or now - self._logged >= self.log_interval):
+            self._logged = now
+            percent = f"{entry['percent']:.1f}%" if entry["percent"] is not None else "?"
+            eta = format_seconds(entry["eta"]) if entry["eta"] is not None else "?"
+            self.log(f"  Progress: {percent} at {entry['fps']:.1f} fps, "
+                     f"{entry['speed']:.2f}x, {entry['kbps'] or '?'} kbps, ETA {eta}")
+
+    def close(self):
+        """Drop the job from the status file and return its run summary."""
+        totals = self.totals()
+        wall = time.monotonic() - self.started
+        if self.board:
+            self.board.remove(self.name)
+        return {
+            "started_at": self.started_at,
+            "wall_seconds": round(wall, 1),
+            "media_seconds": round(totals["seconds"], 1),
+            "frames": totals["frames"],
+            "output_bytes": totals["bytes"],
+            "fps": round(totals["frames"] / wall, 2) if wall > 0 else None,
+            "speed": round(totals["seconds"] / wall, 3) if wall > 0 else None,
+            "kbps": round(totals["bytes"] * 8 / 1000 / totals["seconds"]) if totals["seconds"] else None,
+        }
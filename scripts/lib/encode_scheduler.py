@@ -0,0 +1,208 @@
+"""
+Parallel job scheduler for long-running ffmpeg encodes.
+
+Runs up to `jobs` encodes at once and splits a CPU-thread budget between
+them so each ffmpeg gets its own -threads allocation. A monitor thread
+reads the CPU temperature from hwmon (the same /sys/class/hwmon devices
+hardware-control.sh uses) and backs off when the NAS runs hot: running
+encoders are paused with SIGSTOP and no new job starts until the
+temperature drops below the resume threshold. With an io_monitor (see
+io_monitor.py) encodes are also paused while torrent traffic saturates the
+pool. Each pause reason is tracked separately, so encoders only resume
+once all of them have cleared, and the time paused is counted per reason.
+
+Usage:
+    from encode_scheduler import EncodeScheduler
+
+    scheduler = EncodeScheduler(jobs=2, thread_budget=4, max_temp=85)
+    scheduler.run(items, work)   # work(item, threads) -> result
+"""
+
+import os
+import glob
+import time
+import signal
+import threading
+
+HWMON_GLOB = "/sys/class/hwmon/hwmon*"
+
+# hwmon drivers to read, in order of preference (CPU package first,
+# then the IT8625 Super I/O chip the fan control uses)
+TEMP_SENSORS = ("coretemp", "k10temp", "it8625")
+
+
+def read_cpu_temp():
+    """Return the hottest reading (C) of the preferred hwmon sensor, or None."""
+    devices = {}
+    for hwmon in glob.glob(HWMON_GLOB):
+        try:
+            with open(os.path.join(hwmon, "name")) as f:
+                devices.setdefault(f.read().strip(), hwmon)
+        except OSError:
+            continue
+
+    for sensor in TEMP_SENSORS:
+        hwmon = devices.get(sensor)
+        if not hwmon:
+            continue
+        readings = []
+        for path in glob.glob(os.path.join(hwmon, "temp*_input")):
+            try:
+                with open(path) as f:
+                    readings.append(int(f.read().strip()) / 1000)
+            except (OSError, ValueError):
+                continue
+        if readings:
+            return max(readings)
+    return None
+
+
+class EncodeScheduler:
+    """Run work items concurrently within a thread budget, with thermal backoff."""
+
+    def __init__(self, jobs=1, thread_budget=None, max_temp=None, resume_temp=None,
+                 poll_seconds=15, io_monitor=None, log=print):
+        self.jobs = max(1, jobs)
+        self.thread_budget = thread_budget or os.cpu_count() or 1
+        self.threads_per_job = max(1, self.thread_budget // self.jobs)
+        self.max_temp = max_temp
+        self.resume_temp = resume_temp if resume_temp is not None else (
+            max_temp - 10 if max_temp else None)
+        self.poll_seconds = poll_seconds
+        self.io_monitor = io_monitor
+        self.log = log
+
+        self.processes = set()
+        self.pause_reasons = {}     # kind -> monotonic time paused
+        self.paused_seconds = {"heat": 0.0, "io": 0.0}
+        self._lock = threading.Lock()
+        self._cool = threading.Event()
+        self._cool.set()
+        self._stop = threading.Event()
+
+    # -- process registry -------------------------------------------------
+
+    def register(self, process):
+        """Track a running encoder so it can be paused/resumed."""
+        with self._lock:
+            self.processes.add(process)
+            if self.paused:
+                self._signal(process, signal.SIGSTOP)
+
+    def unregister(self, process):
+        with self._lock:
+            self.processes.discard(process)
+
+    def _signal(self, process, sig):
+        try:
+            os.kill(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @property
+    def paused(self):
+        return bool(self.pause_reasons)
+
+    def pause(self, reason, kind="heat"):
+        with self._lock:
+            if kind in self.pause_reasons:
+                return
+            if not self.pause_reasons:
+                self._cool.clear()
+                for process in self.processes:
+                    self._signal(process, signal.SIGSTOP)
+            self.pause_reasons[kind] = time.monotonic()
+        self.log(f"  Pausing {len(self.processes)} encode(s): {reason}")
+
+    def resume(self, reason, kind="heat"):
+        with self._lock:
+            if kind not in self.pause_reasons:
+                return
+            self.paused_seconds[kind] = (self.paused_seconds.get(kind, 0.0)
+                                         + time.monotonic() - self.pause_reasons.pop(kind))
+            if self.pause_reasons:
+                waiting = ", ".join(self.pause_reasons)
+                self.log(f"  {reason}, still paused for {waiting}")
+                return
+            for process in self.processes:
+                self._signal(process, signal.SIGCONT)
+            self._cool.set()
+        self.log(f"  Resuming encodes: {reason}")
+
+    def resume_all(self, reason):
+        for kind in list(self.pause_reasons):
+            self.resume(reason, kind)
+
+    # -- thermal monitor ---------------------------------------------------
+
+    def check_temperature(self):
+        """Pause above max_temp, resume below resume_temp."""
+        if not self.max_temp:
+            return
+        temp = read_cpu_temp()
+        if temp is None:
+            return
+        hot = "heat" in self.pause_reasons
+        if not hot and temp >= self.max_temp:
+            self.pause(f"CPU at {temp:.0f}C (limit {self.max_temp}C)")
+        elif hot and temp <= self.resume_temp:
+            self.resume(f"CPU cooled to {temp:.0f}C")
+
+    def check_io(self):
+        """Pause while torrents saturate the pool, resume when it is quiet."""
+        if not self.io_monitor:
+            return
+        action, detail = self.io_monitor.check(paused="io" in self.pause_reasons)
+        if action == "pause":
+            self.pause(f"I/O contention ({detail})", kind="io")
+        elif action == "resume":
+            self.resume(f"pool quiet ({detail})", kind="io")
+
+    def _monitor(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.check_temperature()
+            self.check_io()
+
+    # -- running -----------------------------------------------------------
+
+    def run(self, items, work):
+        """Run work(item, threads) for every item, at most `jobs` at a time.
+
+        Returns a list of (item, result) in completion order. Exceptions
+        raised by work are returned as the result.
+        """
+        results = []
+        slots = threading.Semaphore(self.jobs)
+        workers = []
+
+        def runner(item):
+            try:
+                result = work(item, self.threads_per_job)
+            except Exception as e:
+                result = e
+            with self._lock:
+                results.append((item, result))
+            slots.release()
+
+        monitor = threading.Thread(target=self._monitor, daemon=True)
+        monitor.start()
+        try:
+            for item in items:
+                slots.acquire()
+                self.check_temperature()
+                self._cool.wait()  # Don't start new jobs while hot
+                t = threading.Thread(target=runner, args=(item,))
+                t.start()
+                workers.append(t)
+            for t in workers:
+                t.join()
+        except KeyboardInterrupt:
+            # Let stopped children see the interrupt
+            self.resume_all("interrupted")
+            raise
+        finally:
+            self._stop.set()
+            monitor.join()
+            self.resume_all("run finished")  # Count any pause still open
+
+        return results
@@ -0,0 +1,367 @@
+"""
+SQLite-backed state store for create-mobile-versions.
+
+Replaces the old mobile-encode-state.json, which was rewritten in full
+several times per movie, scanned as lists and could be left truncated by
+a crash mid-write. Every update here is a small transaction in WAL mode
+with synchronous=FULL, so it is fsync'd and atomic; lookups go through
+primary keys and a status index.
+
+Tables:
+    jobs        one row per movie: status, queue position and the metrics
+                of its latest attempt (start, end, fps, input/output bytes)
+    segments    checkpointed segment plan, encode settings and progress per job
+    encode_fps  learned encode speed per source class
+    job_runs    -progress telemetry summary of every encode attempt
+    scheduler_runs  time paused (heat / I/O contention) and bytes moved by
+                encodes and torrents per run
+    crf_samples sample-encode bitrates per source, for CRF prediction
+
+Usage:
+    from encode_state import EncodeState
+
+    state = EncodeState("/path/to/mobile-encode-state.db")
+    state.enqueue(movie_dir, source)
+    state.start_job(dirname, input_bytes)
+    state.finish_job(dirname, success=True, output_bytes=..., fps=...)
+    print(state.counts())
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    dirname      TEXT PRIMARY KEY,
+    movie_dir    TEXT,
+    source       TEXT,
+    status       TEXT NOT NULL,
+    queued_at    REAL,
+    started_at   REAL,
+    ended_at     REAL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    fps          REAL,
+    input_bytes  INTEGER,
+    output_bytes INTEGER,
+    error        TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, queued_at);
+
+CREATE TABLE IF NOT EXISTS segments (
+    dirname TEXT PRIMARY KEY,
+    source  TEXT NOT NULL,
+    size    INTEGER NOT NULL,
+    mtime   INTEGER NOT NULL,
+    plan    TEXT NOT NULL,
+    done    TEXT NOT NULL DEFAULT '[]',
+    settings TEXT
+);
+
+CREATE TABLE IF NOT EXISTS encode_fps (
+    cls     TEXT PRIMARY KEY,
+    fps     REAL NOT NULL,
+    samples INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id            INTEGER PRIMARY KEY,
+    dirname       TEXT NOT NULL,
+    started_at    REAL,
+    ended_at      REAL,
+    success       INTEGER,
+    cls           TEXT,
+    preset        TEXT,
+    pipeline      TEXT,
+    wall_seconds  REAL,
+    media_seconds REAL,
+    frames        INTEGER,
+    output_bytes  INTEGER,
+    fps           REAL,
+    speed         REAL,
+    kbps          REAL
+);
+CREATE INDEX IF NOT EXISTS job_runs_dirname ON job_runs (dirname);
+
+CREATE TABLE IF NOT EXISTS scheduler_runs (
+    id                 INTEGER PRIMARY KEY,
+    started_at         REAL,
+    ended_at           REAL,
+    jobs               INTEGER,
+    heat_paused_s      REAL,
+    io_paused_s        REAL,
+    encoded_seconds    REAL,
+    torrent_bytes      INTEGER,
+    pool_read_bytes    INTEGER,
+    pool_write_bytes   INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS crf_samples (
+    key        TEXT PRIMARY KEY,
+    samples    TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Job statuses
+QUEUED = "queued"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# VACUUM once free pages exceed this share of the database
+COMPACT_FREE_RATIO = 0.25
+
+
+class EncodeState:
+    """Transactional job/segment/metrics store (safe to share between threads)."""
+
+    def __init__(self, path, legacy_json=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            columns = [r["name"] for r in self.conn.execute("PRAGMA table_info(segments)")]
+            if "settings" not in columns:
+                # Checkpoints from before settings were stored never match, so they restart
+                self.conn.execute("ALTER TABLE segments ADD COLUMN settings TEXT")
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate(legacy_json)
+
+    def _write(self, sql, params=()):
+        with self._lock, self.conn:
+            return self.conn.execute(sql, params)
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # -- jobs ----------------------------------------------------------------
+
+    def status_of(self, dirname):
+        rows = self._read("SELECT status FROM jobs WHERE dirname = ?", (dirname,))
+        return rows[0]["status"] if rows else None
+
+    def is_completed(self, dirname):
+        return self.status_of(dirname) == COMPLETED
+
+    def enqueue(self, movie_dir, source):
+        """Queue a job unless it is already queued, running or completed."""
+        dirname = os.path.basename(movie_dir)
+        self._write(
+            """INSERT INTO jobs (dirname, movie_dir, source, status, queued_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (dirname) DO UPDATE SET
+                   movie_dir = excluded.movie_dir,
+                   source = excluded.source,
+                   status = CASE WHEN status = ? THEN ? ELSE status END,
+                   queued_at = CASE WHEN status = ? THEN excluded.queued_at ELSE queued_at END""",
+            (dirname, movie_dir, source, QUEUED, time.time(), FAILED, QUEUED, FAILED))
+
+    def dequeue(self, dirname):
+        """Drop a queued job that no longer needs encoding."""
+        self._write("DELETE FROM jobs WHERE dirname = ? AND status IN (?, ?)",
+                    (dirname, QUEUED, IN_PROGRESS))
+
+    def queued(self):
+        """Queued and interrupted jobs as (movie_dir, source), oldest first."""
+        rows = self._read(
+            "SELECT movie_dir, source FROM jobs WHERE status IN (?, ?) ORDER BY queued_at",
+            (QUEUED, IN_PROGRESS))
+        return [(r["movie_dir"], r["source"]) for r in rows]
+
+    def interrupted(self):
+        """Dirnames left in progress by a run that did not finish."""
+        return {r["dirname"] for r in self._read(
+            "SELECT dirname FROM jobs WHERE status = ?", (IN_PROGRESS,))}
+
+    def start_job(self, dirname, input_bytes=None):
+        self._write(
+            """UPDATE jobs SET status = ?, started_at = ?, ended_at = NULL,
+                   attempts = attempts + 1, input_bytes = ?, error = NULL
+               WHERE dirname = ?""",
+            (IN_PROGRESS, time.time(), input_bytes, dirname))
+
+    def finish_job(self, dirname, success, output_bytes=None, fps=None, error=None):
+        self._write(
+            """UPDATE jobs SET status = ?, ended_at = ?, output_bytes = ?, fps = ?, error = ?
+               WHERE dirname = ?""",
+            (COMPLETED if success else FAILED, time.time(), output_bytes, fps, error, dirname))
+
+    def counts(self):
+        """Number of jobs per status (uses the status index)."""
+        rows = self._read("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {r["status"]: r["n"] for r in rows}
+
+    def jobs_with_status(self, status):
+        return [dict(r) for r in self._read(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY ended_at, dirname", (status,))]
+
+    # -- segment checkpoints -------------------------------------------------
+
+    def load_segments(self, dirname):
+        rows = self._read("SELECT * FROM segments WHERE dirname = ?", (dirname,))
+        if not rows:
+            return None
+        r = rows[0]
+        return {"source": r["source"], "size": r["size"], "mtime": r["mtime"],
+                "plan": json.loads(r["plan"]), "done": json.loads(r["done"]),
+                "settings": json.loads(r["settings"]) if r["settings"] else None}
+
+    def start_segments(self, dirname, source, size, mtime, plan, settings=None):
+        self._write(
+            "INSERT OR REPLACE INTO segments (dirname, source, size, mtime, plan, done, settings) "
+            "VALUES (?, ?, ?, ?, ?, '[]', ?)",
+            (dirname, source, size, mtime, json.dumps(plan, separators=(",", ":")),
+             json.dumps(settings, separators=(",", ":"))))
+
+    def mark_segment_done(self, dirname, index):
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT done FROM segments WHERE dirname = ?",
+                                    (dirname,)).fetchone()
+            if row is None:
+                return
+            done = json.loads(row["done"])
+            if index not in done:
+                done.append(index)
+                self.conn.execute("UPDATE segments SET done = ? WHERE dirname = ?",
+                                  (json.dumps(sorted(done)), dirname))
+
+    def clear_segments(self, dirname):
+        self._write("DELETE FROM segments WHERE dirname = ?", (dirname,))
+
+    def segment_progress(self):
+        """[(dirname, done, total)] for every checkpointed job."""
+        return [(r["dirname"], len(json.loads(r["done"])), len(json.loads(r["plan"])))
+                for r in self._read("SELECT dirname, plan, done FROM segments ORDER BY dirname")]
+
+    # -- learned encode speed ------------------------------------------------
+
+    def fps_table(self):
+        return {r["cls"]: {"fps": r["fps"], "samples": r["samples"]}
+                for r in self._read("SELECT * FROM encode_fps")}
+
+    def record_fps(self, cls, fps, smoothing):
+        """Fold a measurement into the per-class moving average; returns the new average."""
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT fps, samples FROM encode_fps WHERE cls = ?",
+                                    (cls,)).fetchone()
+            if row:
+                avg = row["fps"] + smoothing * (fps - row["fps"])
+                samples = row["samples"] + 1
+            else:
+                avg, samples = fps, 1
+            self.conn.execute("INSERT OR REPLACE INTO encode_fps VALUES (?, ?, ?)",
+                              (cls, round(avg, 2), samples))
+        return avg
+
+    # -- run telemetry ---------------------------------------------------------
+
+    def record_run(self, dirname, summary, success, cls, preset, pipeline):
+        """Store the telemetry summary of one encode attempt (see JobProgress.close)."""
+        self._write(
+            """INSERT INTO job_runs (dirname, started_at, ended_at, success, cls, preset, pipeline,
+                   wall_seconds, media_seconds, frames, output_bytes, fps, speed, kbps)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (dirname, summary.get("started_at"), time.time(), int(bool(success)), cls, preset,
+             pipeline, summary.get("wall_seconds"), summary.get("media_seconds"),
+             summary.get("frames"), summary.get("output_bytes"), summary.get("fps"),
+             summary.get("speed"), summary.get("kbps")))
+
+    def throughput(self):
+        """Per (class, preset, pipeline) totals over all recorded runs."""
+        return [dict(r) for r in self._read(
+            """SELECT cls, preset, pipeline, COUNT(*) AS runs,
+                      SUM(media_seconds) AS media_seconds, SUM(wall_seconds) AS wall_seconds,
+                      SUM(frames) / SUM(wall_seconds) AS fps,
+                      SUM(media_seconds) / SUM(wall_seconds) AS speed,
+                      SUM(output_bytes) * 8 / 1000 / SUM(media_seconds) AS kbps
+               FROM job_runs WHERE wall_seconds > 0 AND media_seconds > 0
+               GROUP BY cls, preset, pipeline ORDER BY cls, preset, pipeline""")]
+
+    def record_scheduler_run(self, started_at, jobs, paused_seconds, encoded_seconds, io_totals):
+        self._write(
+            """INSERT INTO scheduler_runs (started_at, ended_at, jobs, heat_paused_s, io_paused_s,
+                   encoded_seconds, torrent_bytes, pool_read_bytes, pool_write_bytes)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (started_at, time.time(), jobs, round(paused_seconds.get("heat", 0.0), 1),
+             round(paused_seconds.get("io", 0.0), 1), encoded_seconds,
+             io_totals.get("torrent_bytes"), io_totals.get("pool_read_bytes"),
+             io_totals.get("pool_write_bytes")))
+
+    def last_scheduler_runs(self, limit=5):
+        return [dict(r) for r in self._read(
+            "SELECT * FROM scheduler_runs ORDER BY id DESC LIMIT ?", (limit,))]
+
+    # -- CRF prediction samples ---------------------------------------------
+
+    def get_crf_samples(self, key):
+        """Cached {crf: kbps} for a source/settings key, or None."""
+        rows = self._read("SELECT samples FROM crf_samples WHERE key = ?", (key,))
+        if not rows:
+            return None
+        return {float(crf): kbps for crf, kbps in json.loads(rows[0]["samples"]).items()}
+
+    def put_crf_samples(self, key, samples):
+        self._write("INSERT OR REPLACE INTO crf_samples VALUES (?, ?, ?)",
+                    (key, json.dumps(samples, separators=(",", ":")), time.time()))
+
+    # -- maintenance ---------------------------------------------------------
+
+    def compact(self):
+        """Fold the WAL back into the database and VACUUM if mostly free space."""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if pages and free / pages > COMPACT_FREE_RATIO:
+                self.conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _migrate(self, legacy_json):
+        """Import the old JSON state file once, then set it aside."""
+        try:
+            with open(legacy_json) as f:
+                old = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        with self._lock, self.conn:
+            for dirname in set(old.get("failed", [])):
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO jobs (dirname, status, ended_at) VALUES (?, ?, ?)",
+                    (dirname, FAILED, now))
+            for dirname in set(old.get("completed", [])):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO jobs (dirname, status, ended_at) VALUES (?, ?, ?)",
+                    (dirname, COMPLETED, now))
+            for i, (movie_dir, source) in enumerate(old.get("queue", [])):
+                self.conn.execute(
+                    """INSERT OR REPLACE INTO jobs (dirname, movie_dir, source, status, queued_at)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (os.path.basename(movie_dir), movie_dir, source, QUEUED, now + i * 1e-3))
+            in_progress = old.get("in_progress") or []
+            for dirname in [in_progress] if isinstance(in_progress, str) else in_progress:
+                self.conn.execute("UPDATE jobs SET status = ? WHERE dirname = ? AND status = ?",
+                                  (IN_PROGRESS, dirname, QUEUED))
+            for dirname, seg in old.get("segments", {}).items():
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO segments (dirname, source, size, mtime, plan, done) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (dirname, seg["source"], seg["size"], seg["mtime"],
+                     json.dumps(seg["plan"]), json.dumps(seg.get("done", []))))
+            for cls, entry in old.get("encode_fps", {}).items():
+                self.conn.execute("INSERT OR REPLACE INTO encode_fps VALUES (?, ?, ?)",
+                                  (cls, entry["fps"], entry["samples"]))
+        os.replace(legacy_json, legacy_json + ".migrated")
@@ -0,0 +1,211 @@
+"""
+Local HLS stand-in server and self-test for lib/stream_prober.py.
+
+StandInServer serves a handful of fake playlists and segments on
+127.0.0.1 (master and media playlists, chunked transfer, redirects, 404s,
+a dead segment, a slow host, raw TS), optionally over HTTPS with a
+throwaway self-signed certificate. self_test() probes each one and checks
+the prober's verdict, bitrate and per-host connection cap, so the prober
+can be verified without touching real IPTV providers:
+
+    python3 filter-iptv-channels.py --probe-self-test
+"""
+
+import os
+import ssl
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from stream_prober import SEGMENT_BYTES, StreamProber
+
+HLS_TYPE = "application/vnd.apple.mpegurl"
+TS_TYPE = "video/mp2t"
+
+MASTER = (b"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n"
+          b"#EXT-X-STREAM-INF:RESOLUTION=1920x1080,BANDWIDTH=3000000\nhigh/index.m3u8\n")
+MEDIA = b"#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.0,\nseg0.ts\n#EXTINF:6.0,\nseg1.ts\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body=b"", content_type=HLS_TYPE, headers=None, chunked=False):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(body), 7):
+                chunk = body[i:i + 7]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            self.route(urllib.parse.urlsplit(self.path))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def route(self, url):
+        path = url.path
+        query = urllib.parse.parse_qs(url.query)
+        if "delay" in query:
+            time.sleep(float(query["delay"][0]))
+        if path.endswith(".ts"):
+            if self.headers.get("Range") != f"bytes=0-{SEGMENT_BYTES - 1}":
+                self.send(400, b"", "text/plain")
+            else:
+                self.send(206, b"\x47" * SEGMENT_BYTES, TS_TYPE)
+        elif path.endswith("sized.bin"):
+            self.send(206, b"\x47" * SEGMENT_BYTES, TS_TYPE,
+                      headers={"Content-Range": f"bytes 0-{SEGMENT_BYTES - 1}/2000000"})
+        elif path.endswith("/index.m3u8"):
+            self.send(200, MEDIA, chunked=path.startswith("/chunked/"))
+        elif path == "/master.m3u8":
+            self.send(200, MASTER)
+        elif path == "/sized.m3u8":
+            self.send(200, b"#EXTM3U\n#EXTINF:4.0,\nsized.bin\n")
+        elif path == "/deadseg.m3u8":
+            self.send(200, b"#EXTM3U\n#EXTINF:6.0,\nmissing.bin\n")
+        elif path == "/empty.m3u8":
+            self.send(200, b"#EXTM3U\n#EXT-X-ENDLIST\n")
+        elif path == "/redirect":
+            self.send(302, headers={"Location": "/master.m3u8"})
+        elif path == "/slow.m3u8":
+            time.sleep(3)
+            self.send(200, MEDIA)
+        elif path == "/raw":
+            self.send(200, b"\x47" * 10000, TS_TYPE)
+        else:
+            self.send(404, b"not found", "text/plain")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # The default 5 drops connects from a burst of probes
+
+    def handle_error(self, request, client_address):
+        pass  # Probes that time out hang up mid-response; that's expected
+
+
+class StandInServer:
+    """The fake HLS server on a free local port, in a background thread."""
+
+    def __init__(self, certfile=None):
+        self.httpd = _Server(("127.0.0.1", 0), _Handler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.active = self.httpd.peak = 0
+        scheme = "http"
+        if certfile:
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(certfile)
+            self.httpd.socket = ctx.wrap_socket(self.httpd.socket, server_side=True)
+            scheme = "https"
+        self.base = f"{scheme}://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def peak(self):
+        """Most requests the server was handling at once."""
+        return self.httpd.peak
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return False
+
+
+def self_signed_cert(directory):
+    """Write a throwaway self-signed cert+key PEM; returns its path, or None without openssl."""
+    if not shutil.which("openssl"):
+        return None
+    path = os.path.join(directory, "standin.pem")
+    result = subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=stand-in.invalid", "-keyout", path, "-out", path],
+        capture_output=True)
+    return path if result.returncode == 0 else None
+
+
+def self_test(log=print):
+    """Probe the stand-in server and check every verdict. Returns the number of failures."""
+    # path -> (expected result, expected bitrate or ..., where ... = don't care)
+    cases = {
+        "/master.m3u8": (True, 3000000),
+        "/redirect": (True, 3000000),
+        "/chunked/index.m3u8": (True, None),
+        "/sized.m3u8": (True, 4000000),
+        "/deadseg.m3u8": (False, ...),
+        "/gone.m3u8": (False, ...),
+        "/empty.m3u8": (False, ...),
+        "/slow.m3u8": (None, ...),
+    }
+    failures = 0
+
+    def check(label, ok, detail=""):
+        nonlocal failures
+        failures += not ok
+        log(f"  {'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+
+    async def probe(urls, **options):
+        prober = StreamProber(**options)
+        return prober, await prober.probe_all(urls)
+
+    with StandInServer() as server:
+        _, results = asyncio.run(probe([server.base + path for path in cases], timeout=1))
+        for path, (want, want_bitrate) in cases.items():
+            result, detail, latency, bitrate = results[server.base + path]
+            check(f"{path}: {result}, bitrate {bitrate}",
+                  result is want and (want_bitrate is ... or bitrate == want_bitrate), detail)
+
+        # Without an ffprobe binary the verdict must be unknown, not dead
+        prober, results = asyncio.run(probe([server.base + "/raw"], timeout=1))
+        result, detail, _, _ = results[server.base + "/raw"]
+        have_ffprobe = shutil.which("ffprobe") is not None
+        check(f"/raw: not HLS, handed to ffprobe: {result}",
+              prober.stats["ffprobe"] == 1 and (result is None) is not have_ffprobe, detail)
+
+        _, results = asyncio.run(probe(["http://[bad"]))
+        check("malformed URL: False", results["http://[bad"][0] is False, results["http://[bad"][1])
+
+    with StandInServer() as server:
+        urls = [f"{server.base}/master.m3u8?delay=0.1&n={i}" for i in range(24)]
+        _, results = asyncio.run(probe(urls, per_host=3))
+        check(f"per-host cap 3: peak {server.peak} concurrent requests",
+              server.peak <= 3 and all(r[0] for r in results.values()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = self_signed_cert(tmp)
+        if cert is None:
+            log("  skip HTTPS with a self-signed certificate (no openssl)")
+        else:
+            with StandInServer(certfile=cert) as server:
+                _, results = asyncio.run(probe([server.base + "/master.m3u8"]))
+                result, detail, _, _ = results[server.base + "/master.m3u8"]
+                check(f"HTTPS, self-signed certificate: {result}", result is True, detail)
+
+    return failures
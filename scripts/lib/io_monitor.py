@@ -0,0 +1,201 @@
+"""
+Storage contention monitor for the encode scheduler.
+
+Mobile encodes and qBittorrent share the same ZFS pool, so a big download
+and an encode slow each other down. IOMonitor samples qBittorrent's
+aggregate transfer rates (/api/v2/transfer/info) and the pool's member
+disks in /proc/diskstats, and tells the scheduler to pause encodes while
+torrents are moving a lot of data and the pool is saturated, and to
+resume once either calms down. It also keeps totals so the run can report
+how much each workload moved.
+
+Pool disks are found with `zpool list -vHP` (or given in ENCODE_POOL_DEVICES,
+e.g. "sda,sdb,sdc,sdd").
+
+Usage:
+    from io_monitor import IOMonitor
+
+    monitor = IOMonitor(pool="tank")
+    action, detail = monitor.check(paused=False)   # "pause", "resume" or None
+    print(monitor.totals())
+"""
+
+import os
+import json
+import time
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+QB_URL = os.environ.get("QB_URL", "http://10.200.200.2:8080")
+QB_USER = os.environ.get("QB_USER", "admin")
+QB_PASS = os.environ.get("QB_PASS", "adminadmin")
+
+DISKSTATS = "/proc/diskstats"
+SECTOR_BYTES = 512
+
+# Pause when torrents move more than this AND the busiest pool disk is
+# above POOL_BUSY_UTIL; resume when torrents drop below TORRENT_QUIET_BPS or
+# the pool below POOL_QUIET_UTIL, after at least MIN_PAUSE_SECONDS
+TORRENT_BUSY_BPS = 30 * 1024 * 1024
+TORRENT_QUIET_BPS = 10 * 1024 * 1024
+POOL_BUSY_UTIL = 0.85
+POOL_QUIET_UTIL = 0.50
+MIN_PAUSE_SECONDS = 120
+
+
+def pool_devices(pool):
+    """Whole-disk block device names backing a ZFS pool (e.g. ["sda", "sdb"])."""
+    env = os.environ.get("ENCODE_POOL_DEVICES")
+    if env:
+        return [d.strip() for d in env.split(",") if d.strip()]
+    try:
+        result = subprocess.run(["zpool", "list", "-vHP", pool],
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    devices = []
+    for line in result.stdout.splitlines():
+        path = line.strip().split("\t")[0]
+        if not path.startswith("/dev/"):
+            continue
+        name = os.path.basename(os.path.realpath(path))
+        # Partitions (sda1, nvme0n1p1) count against their disk
+        parent = os.path.basename(os.path.realpath(f"/sys/class/block/{name}/.."))
+        if os.path.exists(f"/sys/class/block/{name}/partition") and parent:
+            name = parent
+        if name not in devices:
+            devices.append(name)
+    return devices
+
+
+def read_diskstats(devices):
+    """{device: (sectors_read, sectors_written, ms_doing_io)} for the given disks."""
+    stats = {}
+    try:
+        with open(DISKSTATS) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 13 and parts[2] in devices:
+                    stats[parts[2]] = (int(parts[5]), int(parts[9]), int(parts[12]))
+    except OSError:
+        pass
+    return stats
+
+
+class QBittorrentRates:
+    """Minimal qBittorrent Web API client for the global transfer rates."""
+
+    def __init__(self, url=QB_URL, username=QB_USER, password=QB_PASS, timeout=5):
+        self.url = url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.logged_in = False
+
+    def _login(self):
+        data = urllib.parse.urlencode({"username": self.username,
+                                       "password": self.password}).encode()
+        with self.opener.open(f"{self.url}/api/v2/auth/login", data, timeout=self.timeout) as resp:
+            if resp.read().decode() != "Ok.":
+                raise OSError("qBittorrent login failed")
+        self.logged_in = True
+
+    def transfer_info(self):
+        """dl/up speed (bytes/s) and session totals, or raises OSError."""
+        if not self.logged_in:
+            self._login()
+        try:
+            with self.opener.open(f"{self.url}/api/v2/transfer/info", timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 403:  # Session expired
+                self.logged_in = False
+            raise
+        except ValueError as e:
+            raise OSError(f"bad transfer/info response: {e}")
+
+
+class IOMonitor:
+    """Decide when encodes should yield the pool to torrent traffic."""
+
+    def __init__(self, pool="tank", qbittorrent=None, log=print):
+        self.qb = qbittorrent or QBittorrentRates()
+        self.devices = pool_devices(pool)
+        self.log = log
+        self._last_disk = read_diskstats(self.devices)
+        self._last_time = time.monotonic()
+        self._first_disk = dict(self._last_disk)
+        self._first_qb = None
+        self._last_qb = None
+        self._qb_error = None
+        self._paused_at = None
+        self.sample()  # Baseline for rates and run totals
+
+    def sample(self):
+        """Return (torrent_bps, pool_util, pool_read_bps, pool_write_bps); None if unknown."""
+        now = time.monotonic()
+        interval = max(now - self._last_time, 1e-3)
+
+        torrent_bps = None
+        try:
+            info = self.qb.transfer_info()
+            torrent_bps = info.get("dl_info_speed", 0) + info.get("up_info_speed", 0)
+            self._last_qb = info
+            if self._first_qb is None:
+                self._first_qb = info
+            self._qb_error = None
+        except (OSError, urllib.error.URLError) as e:
+            if self._qb_error is None:
+                self.log(f"  qBittorrent rates unavailable ({e}), I/O throttling idle")
+            self._qb_error = e
+
+        disk = read_diskstats(self.devices)
+        util = read_bps = write_bps = None
+        if disk and self._last_disk:
+            deltas = [(disk[d][0] - self._last_disk[d][0], disk[d][1] - self._last_disk[d][1],
+                       disk[d][2] - self._last_disk[d][2]) for d in disk if d in self._last_disk]
+            if deltas:
+                # The busiest disk bounds the pool
+                util = min(1.0, max(ms for _, _, ms in deltas) / (interval * 1000))
+                read_bps = sum(r for r, _, _ in deltas) * SECTOR_BYTES / interval
+                write_bps = sum(w for _, w, _ in deltas) * SECTOR_BYTES / interval
+        self._last_disk = disk
+        self._last_time = now
+        return torrent_bps, util, read_bps, write_bps
+
+    def check(self, paused):
+        """Return ("pause" | "resume" | None, detail) for the current I/O load."""
+        torrent_bps, util, _, _ = self.sample()
+        if torrent_bps is None or util is None:
+            return None, None
+        detail = f"torrents at {torrent_bps / 1024**2:.1f} MB/s, pool {util:.0%} busy"
+
+        if not paused:
+            if torrent_bps >= TORRENT_BUSY_BPS and util >= POOL_BUSY_UTIL:
+                self._paused_at = time.monotonic()
+                return "pause", detail
+        elif time.monotonic() - (self._paused_at or 0) >= MIN_PAUSE_SECONDS:
+            if torrent_bps < TORRENT_QUIET_BPS or util < POOL_QUIET_UTIL:
+                return "resume", detail
+        return None, detail
+
+    def totals(self):
+        """Bytes moved by torrents and read/written on the pool since start."""
+        totals = {"torrent_bytes": None, "pool_read_bytes": None, "pool_write_bytes": None}
+        if self._first_qb and self._last_qb:
+            totals["torrent_bytes"] = sum(
+                self._last_qb.get(k, 0) - self._first_qb.get(k, 0)
+                for k in ("dl_info_data", "up_info_data"))
+        disk = read_diskstats(self.devices)
+        common = [d for d in disk if d in self._first_disk]
+        if common:
+            totals["pool_read_bytes"] = sum(
+                disk[d][0] - self._first_disk[d][0] for d in common) * SECTOR_BYTES
+            totals["pool_write_bytes"] = sum(
+                disk[d][1] - self._first_disk[d][1] for d in common) * SECTOR_BYTES
+        return totals
@@ -0,0 +1,448 @@
+"""
+Streaming M3U pipeline for the IPTV refresh.
+
+Channels are read from any number of M3U files one line at a time, pass
+through a chain of filter stages (each a generator over channel dicts) and
+are written to the output playlist in the same pass, so neither input is
+ever loaded whole and no intermediate playlist is written. Which stages run,
+in what order and with what options comes from a JSON rules file
+(config/iptv/filter-rules.json):
+
+    {
+      "stages": [
+        {"stage": "religious"},
+        {"stage": "country"},
+        {"stage": "strict_country"},
+        {"stage": "epg", "enabled": false},
+        {"stage": "keyword", "include": [], "exclude": ["shop"]},
+        {"stage": "health", "enabled": false, "per_host": 8},
+        {"stage": "cluster", "source_priority": ["iptv-org", "distro"]}
+      ],
+      "sort": true
+    }
+
+Stages:
+    religious       drop channels matching the religious keyword list
+    country         drop channels with a non-US indicator
+    strict_country  drop channels matching the stricter non-US list
+    epg             keep only channels whose tvg-id is in the loaded EPG
+    keyword         "include": must match one; "exclude": must match none
+    health          drop dead streams (stream_prober + stream_health,
+                    probed in batches so the pass keeps streaming)
+    dedup           keep the first channel of each name (case-insensitive)
+    cluster         merge duplicates across sources by normalized name or
+                    tvg-id and keep the best stream of each (see below)
+
+With "sort" the surviving channels are ordered by group, then name, before
+writing; that buffers only the survivors, not the inputs.
+
+The cluster stage puts every channel under two blocking keys, its
+normalized name ("CBS News HD", "US: CBS News" and "CBS News [Geo-blocked]"
+all become "cbs news") and its tvg-id without a quality feed ("@HD",
+"@SD"), and unions channels that share a key, so the work is linear in the
+number of channels rather than pairwise. Other feeds ("@East", "@West") are
+different time-shifted channels: they stay in the tvg-id key, and two
+clusters holding different feeds of one tvg-id are never joined, so a
+shared name can't chain them together either. Within a cluster the stream is chosen by
+the health stage's measurements: among the working streams whose latency
+is within LATENCY_SLACK of the fastest, the highest bitrate wins. Streams
+without measurements come after measured ones, and ties fall back to
+source priority ("source_priority": input file name fragments, best
+first; otherwise input order). cluster_self_test() checks the grouping on
+hand-made cases (filter-iptv-channels.py --cluster-self-test).
+
+Usage:
+    from m3u_pipeline import load_rules, run_pipeline
+
+    stats = run_pipeline(["a.m3u", "b.m3u"], "out.m3u", load_rules(path), context)
+"""
+
+import os
+import re
+import json
+
+from channel_classifier import CLASSIFIER
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "config", "iptv", "filter-rules.json")
+
+# Channels per stream-health batch
+HEALTH_BATCH = 5000
+
+# Lines after #EXTINF searched for its URL (as the old parser did)
+URL_LOOKAHEAD = 4
+
+# Cluster stage: streams within this factor (or LATENCY_SLACK_MS) of the
+# fastest in a cluster count as equally fast, and bitrate decides
+LATENCY_SLACK = 1.5
+LATENCY_SLACK_MS = 250
+
+QUALITY_TOKENS = {'hd', 'fhd', 'uhd', 'sd', '4k', '8k', 'hevc', 'h264', 'h265',
+                  '1080p', '1080i', '720p', '480p', '360p', 'hq', 'lq'}
+# Bracketed tags made only of these (and quality tokens) are dropped
+# Not east/west: "ABC (East)" and "ABC (West)" are different time-shifted feeds
+TAG_TOKENS = QUALITY_TOKENS | {'us', 'usa', 'geo', 'blocked', 'not', '24', '7',
+                               'backup', 'alt', 'feed', 'live'}
+COUNTRY_PREFIX_RE = re.compile(r'^\s*(?:us|usa)\s*[:|\-]\s*', re.IGNORECASE)
+BRACKET_RE = re.compile(r'\(([^)]*)\)|\[([^\]]*)\]')
+NON_WORD_RE = re.compile(r'[^\w&+]+')
+
+NAME_RE = re.compile(r',(.+)$')
+GROUP_RE = re.compile(r'group-title="([^"]*)"')
+TVG_ID_RE = re.compile(r'tvg-id="([^"]*)"')
+
+
+def read_m3u(path):
+    """Yield one channel dict (name, group, tvg_id, url, extinf) per #EXTINF entry.
+
+    Reads line by line. An #EXTINF takes the first non-comment line among
+    the next URL_LOOKAHEAD lines as its URL; entries without one are skipped.
+    """
+    pending = []  # [extinf, lines left] waiting for a URL
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for raw in f:
+            line = raw.strip()
+            if line and not line.startswith('#'):
+                for extinf, left in pending:
+                    if left > 0:
+                        yield make_channel(extinf, line)
+                pending = []
+            else:
+                pending = [[e, left - 1] for e, left in pending if left > 1]
+                if line.startswith('#EXTINF'):
+                    pending.append([line, URL_LOOKAHEAD])
+
+
+def make_channel(extinf, url):
+    name = NAME_RE.search(extinf)
+    group = GROUP_RE.search(extinf)
+    tvg_id = TVG_ID_RE.search(extinf)
+    return {
+        'name': name.group(1).strip() if name else '',
+        'group': group.group(1) if group else '',
+        'tvg_id': tvg_id.group(1) if tvg_id else '',
+        'url': url,
+        'extinf': extinf,
+    }
+
+
+def read_all(paths, log=print):
+    for source, path in enumerate(paths):
+        log(f"Reading {path}...")
+        try:
+            for ch in read_m3u(path):
+                ch['source'] = source
+                ch['source_path'] = path
+                yield ch
+        except OSError as e:
+            log(f"  Warning: Could not read {path}: {e}")
+
+
+def categories(ch):
+    """Classifier categories for a channel, computed once and kept on the dict."""
+    if 'categories' not in ch:
+        ch['categories'] = CLASSIFIER.classify(ch['name'], ch['group'])
+    return ch['categories']
+
+
+# -- stages -------------------------------------------------------------------
+# Each factory takes (rule, context) and returns a function from a channel
+# iterator to a channel iterator.
+
+def category_stage(category):
+    def make(rule, context):
+        def stage(channels):
+            for ch in channels:
+                if category not in categories(ch):
+                    yield ch
+        return stage
+    return make
+
+
+def epg_stage(rule, context):
+    ids = context.get('epg_ids') or set()
+
+    def stage(channels):
+        for ch in channels:
+            if not ids or ch['tvg_id'].lower() in ids:
+                yield ch
+    return stage
+
+
+def keyword_stage(rule, context):
+    include = [kw.lower() for kw in rule.get('include') or []]
+    exclude = [kw.lower() for kw in rule.get('exclude') or []]
+
+    def stage(channels):
+        for ch in channels:
+            text = f"{ch['name']} {ch['group']}".lower()
+            if include and not any(kw in text for kw in include):
+                continue
+            if exclude and any(kw in text for kw in exclude):
+                continue
+            yield ch
+    return stage
+
+
+def health_stage(rule, context):
+    from stream_prober import CONCURRENCY, PER_HOST, probe_streams
+    from stream_health import HEALTH_FILE, StreamHealth, check_streams
+
+    log = context.get('log', print)
+    health = StreamHealth(rule.get('health_file') or HEALTH_FILE)
+    context['health'] = health
+    batch_size = rule.get('batch', HEALTH_BATCH)
+
+    def probe(urls):
+        log(f"  Probing {len(urls)} streams...")
+        return probe_streams(urls, concurrency=rule.get('concurrency', CONCURRENCY),
+                             per_host=rule.get('per_host', PER_HOST))
+
+    def check(batch):
+        results = check_streams([ch['url'] for ch in batch], health, probe,
+                                retest=rule.get('retest', False), log=log)
+        health.save()
+        for ch in batch:
+            ok, _, latency, bitrate, _ = results[ch['url']]
+            if ok is not False:  # Working or unknown
+                ch['ok'] = ok
+                ch['latency'] = latency
+                ch['bitrate'] = bitrate
+                yield ch
+
+    def stage(channels):
+        batch = []
+        for ch in channels:
+            batch.append(ch)
+            if len(batch) >= batch_size:
+                yield from check(batch)
+                batch = []
+        yield from check(batch)
+    return stage
+
+
+def dedup_stage(rule, context):
+    def stage(channels):
+        seen = set()
+        for ch in channels:
+            key = ch['name'].lower()
+            if key not in seen:
+                seen.add(key)
+                yield ch
+    return stage
+
+
+def normalize_name(name):
+    """Cluster key for a channel name: no country prefix, tags or quality suffixes."""
+    text = COUNTRY_PREFIX_RE.sub('', name.lower())
+
+    def drop_tag(match):
+        tokens = NON_WORD_RE.sub(' ', match.group(1) or match.group(2) or '').split()
+        return ' ' if all(t in TAG_TOKENS for t in tokens) else match.group(0)
+
+    tokens = NON_WORD_RE.sub(' ', BRACKET_RE.sub(drop_tag, text)).split()
+    while len(tokens) > 1 and tokens[-1] in QUALITY_TOKENS:
+        tokens.pop()
+    return ' '.join(tokens) or name.lower().strip()
+
+
+def normalize_tvg_id(tvg_id):
+    """Cluster key for a tvg-id: lowercased, without a quality feed like "@HD"."""
+    base, _, feed = tvg_id.strip().lower().partition('@')
+    base, feed = base.strip(), feed.strip()
+    return f"{base}@{feed}" if feed and feed not in QUALITY_TOKENS else base
+
+
+def source_rank(ch, priority):
+    """Lower is better: first matching source_priority fragment, else input order."""
+    path = os.path.basename(ch.get('source_path', ''))
+    for i, fragment in enumerate(priority):
+        if fragment in path:
+            return i
+    return len(priority) + ch.get('source', 0)
+
+
+def best_stream(members, priority):
+    """Pick the channel to keep from one cluster (see the module docstring)."""
+    measured = [ch for ch in members if ch.get('ok') is True and ch.get('latency') is not None]
+    if measured:
+        fastest = min(ch['latency'] for ch in measured)
+        limit = max(fastest * LATENCY_SLACK, fastest + LATENCY_SLACK_MS)
+        fast = [ch for ch in measured if ch['latency'] <= limit]
+        return min(fast, key=lambda ch: (-(ch.get('bitrate') or 0), ch['latency'],
+                                         source_rank(ch, priority)))
+    return min(members, key=lambda ch: (ch.get('ok') is not True, source_rank(ch, priority)))
+
+
+def cluster(channels):
+    """Group channels sharing a normalized name or tvg-id, in input order.
+
+    A union is skipped when the two clusters hold different feeds of the
+    same tvg-id, so "X.us@East" and "X.us@West" stay apart even if a name
+    key links them.
+    """
+    members = []
+    parent = []
+    feeds = []  # root index -> {tvg-id without feed: {feed, ...}}
+    owner = {}  # blocking key -> first channel index with it
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(a, b):
+        a, b = find(a), find(b)
+        if a == b:
+            return
+        shared = feeds[a].keys() & feeds[b].keys()
+        if any(len(feeds[a][base] | feeds[b][base]) > 1 for base in shared):
+            return  # Different feeds of one channel
+        root, child = min(a, b), max(a, b)
+        parent[child] = root
+        for base, names in feeds[child].items():
+            feeds[root].setdefault(base, set()).update(names)
+
+    for ch in channels:
+        index = len(members)
+        members.append(ch)
+        parent.append(index)
+        feeds.append({})
+        keys = [('name', normalize_name(ch['name']))]
+        if ch['tvg_id'].strip():
+            tvg_id = normalize_tvg_id(ch['tvg_id'])
+            keys.append(('tvg', tvg_id))
+            base, _, feed = tvg_id.partition('@')
+            if feed:
+                feeds[index][base] = {feed}
+        for key in keys:
+            if key in owner:
+                union(index, owner[key])
+            else:
+                owner[key] = index
+
+    clusters = {}
+    for index in range(len(members)):
+        clusters.setdefault(find(index), []).append(members[index])
+    return [clusters[root] for root in sorted(clusters)]
+
+
+def cluster_stage(rule, context):
+    priority = rule.get('source_priority') or []
+    log = context.get('log', print)
+
+    def stage(channels):
+        clusters = cluster(channels)
+        by_measurement = 0
+        for group in clusters:
+            best = best_stream(group, priority) if len(group) > 1 else group[0]
+            if best is not group[0] and any(ch.get('latency') is not None for ch in group):
+                by_measurement += 1
+            yield best
+
+        channel_count = sum(len(g) for g in clusters)
+        context['cluster_stats'] = {'clusters': len(clusters),
+                                    'merged': channel_count - len(clusters),
+                                    'by_measurement': by_measurement}
+        log(f"  Clustered {channel_count} channels into {len(clusters)} "
+            f"({by_measurement} picked over the first source by latency/bitrate)")
+    return stage
+
+
+def cluster_self_test(log=print):
+    """Check cluster() on hand-made playlists. Returns the number of failures."""
+    # label -> ([(name, tvg-id), ...], expected groups as channel indices)
+    cases = {
+        "quality variants merge": (
+            [("CBS News HD", "CBSNews.us@HD"), ("US: CBS News", "CBSNews.us"),
+             ("CBS News [Geo-blocked]", "")], [[0, 1, 2]]),
+        "X@East and X@West survive": (
+            [("Foo East", "Foo.us@East"), ("Foo West", "Foo.us@West")], [[0], [1]]),
+        "same name, different feeds": (
+            [("Foo", "Foo.us@East"), ("Foo", "Foo.us@West")], [[0], [1]]),
+        "name key can't chain a feed to another via tvg-id": (
+            [("Foo", "Foo.us@East"), ("Foo Network", "Foo.us@West"), ("Foo", "Foo.us@West")],
+            [[0], [1, 2]]),
+        "feedless tvg-id can't chain East to West": (
+            [("Foo", "Foo.us@East"), ("Foo HD", "Foo.us"), ("Foo", "Foo.us@West")],
+            [[0, 1], [2]]),
+        "East/West names without tvg-ids": (
+            [("ABC (East)", ""), ("ABC (West)", ""), ("US: ABC (East) HD", "")], [[0, 2], [1]]),
+    }
+    failures = 0
+    for label, (entries, expected) in cases.items():
+        channels = [{'name': name, 'tvg_id': tvg_id, 'index': i}
+                    for i, (name, tvg_id) in enumerate(entries)]
+        groups = [[ch['index'] for ch in group] for group in cluster(channels)]
+        ok = groups == expected
+        failures += not ok
+        log(f"  {'ok  ' if ok else 'FAIL'} {label}: {groups}")
+    return failures
+
+
+STAGES = {
+    'religious': category_stage('religious'),
+    'country': category_stage('non_us'),
+    'strict_country': category_stage('non_us_strict'),
+    'epg': epg_stage,
+    'keyword': keyword_stage,
+    'health': health_stage,
+    'dedup': dedup_stage,
+    'cluster': cluster_stage,
+}
+
+
+def load_rules(path=RULES_FILE):
+    """Read and validate a rules file; raises ValueError on unknown stages."""
+    with open(path) as f:
+        rules = json.load(f)
+    for rule in rules.get('stages', []):
+        if rule.get('stage') not in STAGES:
+            raise ValueError(f"{path}: unknown stage {rule.get('stage')!r}")
+    return rules
+
+
+def counted(channels, counts, key):
+    for ch in channels:
+        counts[key] += 1
+        yield ch
+
+
+def write_m3u(path, channels):
+    """Write channels to path atomically; returns how many were written."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('#EXTM3U\n')
+        for ch in channels:
+            f.write(f"{ch['extinf']}\n{ch['url']}\n")
+            written += 1
+    os.replace(tmp_path, path)
+    return written
+
+
+def run_pipeline(inputs, output, rules, context=None):
+    """Stream inputs through the enabled stages into output.
+
+    Returns [(stage, channels in, channels out), ...] with "read" first.
+    """
+    context = context if context is not None else {}
+    log = context.setdefault('log', print)
+    counts = {'read': 0}
+    channels = counted(read_all(inputs, log), counts, 'read')
+    for i, rule in enumerate(r for r in rules.get('stages', []) if r.get('enabled', True)):
+        key = f"{i}:{rule['stage']}"
+        counts[key] = 0
+        channels = counted(STAGES[rule['stage']](rule, context)(channels), counts, key)
+
+    if rules.get('sort', True):
+        channels = sorted(channels, key=lambda ch: (ch['group'].lower(), ch['name'].lower()))
+    write_m3u(output, channels)
+
+    keys = list(counts)
+    stats = [('read', 0, counts['read'])]
+    for prev, key in zip(keys, keys[1:]):
+        stats.append((key.split(':', 1)[1], counts[prev], counts[key]))
+    return stats
@@ -0,0 +1,216 @@
+"""
+Content-addressed ffprobe result cache shared by the media scripts.
+
+Probe results are keyed by (device, inode, size, mtime) so a renamed file
+still hits and a rewritten file always misses. Entries are stored as compact
+JSON and the least recently used ones are evicted once the cache file grows
+past PROBE_CACHE_MAX_MB.
+
+Usage:
+    from probe_cache import ProbeCache
+
+    cache = ProbeCache()
+    info = cache.probe("/tank/media/movies/Movie (2021)/Movie.mkv")
+    infos = cache.probe_many(paths, workers=4)
+    cache.save()
+    print(cache.summary())
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+import subprocess
+import concurrent.futures
+
+CACHE_FILE = os.environ.get(
+    "PROBE_CACHE_FILE", "/home/anon/nas-media-server/logs/ffprobe-cache.json"
+)
+MAX_CACHE_MB = float(os.environ.get("PROBE_CACHE_MAX_MB", "32"))
+FFPROBE = os.environ.get("FFPROBE", "ffprobe")
+
+# A hit only refreshes an entry's LRU timestamp once it is this old, so a
+# fully cached run doesn't rewrite the cache file
+USED_RESOLUTION = 24 * 3600
+
+# Per-stream keys that no consumer reads and that bloat the cache
+DROP_STREAM_KEYS = ("side_data_list", "disposition", "extradata_size")
+
+
+class ProbeError(Exception):
+    """ffprobe failed or returned unparseable output."""
+
+
+def file_key(filepath):
+    """Return the content-address key for a file: dev:ino:size:mtime_ns."""
+    st = os.stat(filepath)
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def run_ffprobe(filepath, timeout=60):
+    """Run ffprobe and return the parsed streams/format JSON."""
+    cmd = [
+        FFPROBE, "-v", "quiet",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        filepath
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ProbeError(str(e))
+    if result.returncode != 0:
+        raise ProbeError(f"ffprobe exited with code {result.returncode}")
+    try:
+        return json.loads(result.stdout)
+    except ValueError as e:
+        raise ProbeError(f"bad ffprobe output: {e}")
+
+
+def compact(info):
+    """Strip keys nobody reads so cached entries stay small."""
+    streams = []
+    for stream in info.get("streams", []):
+        streams.append({k: v for k, v in stream.items() if k not in DROP_STREAM_KEYS})
+    return {"streams": streams, "format": info.get("format", {})}
+
+
+class ProbeCache:
+    """Persistent ffprobe cache with LRU eviction and parallel batch probing."""
+
+    def __init__(self, path=CACHE_FILE, max_mb=MAX_CACHE_MB, timeout=60):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, filepath):
+        """Return cached info for filepath, or None on a miss."""
+        try:
+            key = file_key(filepath)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            now = int(time.time())
+            if now - entry.get("used", 0) >= USED_RESOLUTION:
+                entry["used"] = now
+                self.dirty = True
+            self.hits += 1
+            return entry["info"]
+
+    def store(self, filepath, info):
+        """Cache info for filepath under its current content key."""
+        key = file_key(filepath)
+        with self._lock:
+            self.entries[key] = {"used": int(time.time()), "info": compact(info)}
+            self.dirty = True
+
+    def probe(self, filepath):
+        """Return ffprobe info for filepath, probing only on a cache miss.
+
+        Raises ProbeError if ffprobe fails.
+        """
+        info = self.lookup(filepath)
+        if info is not None:
+            return info
+        with self._lock:
+            self.misses += 1
+        try:
+            info = run_ffprobe(filepath, timeout=self.timeout)
+        except ProbeError:
+            with self._lock:
+                self.errors += 1
+            raise
+        self.store(filepath, info)
+        return compact(info)
+
+    def probe_many(self, filepaths, workers=4):
+        """Probe several files, running cache misses in parallel.
+
+        Returns {filepath: info}; files that fail to probe map to None.
+        """
+        results = {}
+        pending = []
+        for filepath in filepaths:
+            info = self.lookup(filepath)
+            if info is not None:
+                results[filepath] = info
+            else:
+                pending.append(filepath)
+
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {executor.submit(self.probe, p): p for p in pending}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except ProbeError:
+                        results[futures[future]] = None
+
+        return results
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits max_bytes."""
+        sizes = {k: len(json.dumps(v, separators=(",", ":"))) + len(k) + 4
+                 for k, v in self.entries.items()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key in sorted(self.entries, key=lambda k: self.entries[k].get("used", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= sizes[key]
+            del self.entries[key]
+            evicted += 1
+        return evicted
+
+    def save(self):
+        """Atomically write the cache back to disk if it changed.
+
+        The cache file is shared by concurrent scripts, so under a lock file
+        the entries on disk are merged in first (newest "used" wins) and
+        other runs' probes aren't lost.
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                for key, entry in self._load().items():
+                    ours = self.entries.get(key)
+                    if ours is None or entry.get("used", 0) > ours.get("used", 0):
+                        self.entries[key] = entry
+                self._evict()
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.entries, f, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def summary(self):
+        """One-line hit rate summary for end-of-run logging."""
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0.0
+        line = f"ffprobe cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+        if self.errors:
+            line += f", {self.errors} probe errors"
+        return line
@@ -0,0 +1,234 @@
+"""
+Persistent stream-health store for filter-iptv-channels.py --test-streams.
+
+Most channels keep their status from one daily refresh to the next, so
+each stream URL's last probe result, latency, bitrate and consecutive
+failure count are kept in a small JSON file. Only entries whose TTL has expired
+are probed again. Working streams are rechecked every few days; failing
+or timed-out ones after a few hours, so a stream that comes back is
+picked up quickly.
+
+Failures are also aggregated per host. When nearly every recent probe of
+a host failed (a dead CDN or provider), one "canary" URL from that host
+is probed first: the one that worked most recently, so a single dead
+channel can't take its siblings down. If it still fails, the host's
+channels that are due for a probe are marked suspect without probing
+each one, while fresh results of any outcome keep their cached value; if
+it works, the due ones are probed as usual.
+
+Usage:
+    from stream_health import StreamHealth, check_streams
+
+    health = StreamHealth()
+    results = check_streams(urls, health, probe=probe_streams)
+    # -> {url: (True | False | None, detail, latency_ms, bitrate, "cached" | "probed" | "host")}
+    health.save()
+    print(health.summary())
+"""
+
+import os
+import json
+import time
+import zlib
+import threading
+import urllib.parse
+
+HEALTH_FILE = os.environ.get(
+    "STREAM_HEALTH_FILE", "/home/anon/nas-media-server/logs/stream-health.json"
+)
+
+# Seconds before a result is retested, by outcome
+OK_TTL = 3 * 24 * 3600
+FAIL_TTL = 6 * 3600
+UNKNOWN_TTL = 6 * 3600
+
+# A host is suspect when, among its streams checked within HOST_WINDOW,
+# at least HOST_MIN_FAILURES failed and they are HOST_FAIL_RATIO of the total
+HOST_WINDOW = 2 * 24 * 3600
+HOST_MIN_FAILURES = 3
+HOST_FAIL_RATIO = 0.9
+
+# Entries for URLs no longer in any playlist are dropped after this long
+FORGET_AFTER = 30 * 24 * 3600
+
+
+def host_of(url):
+    try:
+        return (urllib.parse.urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def ttl_for(url, entry):
+    """TTL for an entry, spread +/-20% by URL so rechecks don't all land on one day."""
+    base = OK_TTL if entry["ok"] is True else FAIL_TTL if entry["ok"] is False else UNKNOWN_TTL
+    spread = zlib.crc32(url.encode()) % 1000 / 1000
+    return base * (0.8 + 0.4 * spread)
+
+
+class StreamHealth:
+    """URL -> last probe result, with TTL-based expiry and per-host failure stats."""
+
+    def __init__(self, path=HEALTH_FILE):
+        self.path = path
+        self.dirty = False
+        self.hits = 0
+        self.probed = 0
+        self.host_skipped = 0
+        self.hosts_down = []
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def fresh(self, url, now=None):
+        """The stored entry for url if its TTL has not expired, else None."""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        now = now or time.time()
+        if now - entry["checked"] >= ttl_for(url, entry):
+            return None
+        return entry
+
+    def record(self, url, ok, detail, latency_ms, bitrate=None, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self.entries.get(url, {"failures": 0, "last_ok": None})
+            if ok is False:
+                entry["failures"] = entry.get("failures", 0) + 1
+            elif ok is True:
+                entry["failures"] = 0
+                entry["last_ok"] = int(now)
+            if ok is not False:  # A failed probe says nothing new about speed
+                entry.update(latency=latency_ms, bitrate=bitrate)
+            entry.update(ok=ok, detail=detail, checked=int(now), seen=int(now))
+            self.entries[url] = entry
+            self.dirty = True
+
+    def touch(self, url, now=None):
+        """Mark url as still listed so it is not forgotten."""
+        entry = self.entries.get(url)
+        if entry is not None:
+            entry["seen"] = int(now or time.time())
+            self.dirty = True
+
+    def suspect_hosts(self, now=None):
+        """Hosts whose recent probes nearly all failed: {host: failure_count}."""
+        now = now or time.time()
+        failures, working = {}, {}
+        for url, entry in self.entries.items():
+            if now - entry["checked"] >= HOST_WINDOW:
+                continue
+            host = host_of(url)
+            if entry["ok"] is True:
+                working[host] = working.get(host, 0) + 1
+            elif entry["ok"] is False:
+                failures[host] = failures.get(host, 0) + 1
+        return {host: count for host, count in failures.items()
+                if count >= HOST_MIN_FAILURES
+                and count >= HOST_FAIL_RATIO * (count + working.get(host, 0))}
+
+    def save(self, now=None):
+        """Atomically write the store back, forgetting long-unlisted URLs."""
+        now = now or time.time()
+        with self._lock:
+            if not self.dirty:
+                return
+            self.entries = {url: e for url, e in self.entries.items()
+                            if now - e.get("seen", e["checked"]) < FORGET_AFTER}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def summary(self):
+        """One-line summary for end-of-run logging."""
+        total = self.hits + self.probed + self.host_skipped
+        rate = (self.hits / total * 100) if total else 0.0
+        line = (f"stream health: {self.hits} cached, {self.probed} probed, "
+                f"{self.host_skipped} skipped on dead hosts ({rate:.0f}% incremental)")
+        if self.hosts_down:
+            line += f"; hosts down: {', '.join(sorted(self.hosts_down))}"
+        return line
+
+
+def check_streams(urls, health, probe, retest=False, log=print):
+    """Health of every URL, probing only expired entries.
+
+    probe(urls) must return {url: (result, detail, latency_ms, bitrate)} as
+    stream_prober.probe_streams does. With retest=True every URL is probed
+    regardless of TTL. Returns {url: (result, detail, latency_ms, bitrate, source)}.
+    """
+    now = time.time()
+    urls = list(dict.fromkeys(urls))
+    suspects = {} if retest else health.suspect_hosts(now)
+    results = {}
+    on_host = {host: [] for host in suspects}
+    held = {host: [] for host in suspects}
+    first = []
+    for url in urls:
+        health.touch(url, now)
+        host = host_of(url)
+        entry = None if retest else health.fresh(url, now)
+        if entry is not None:
+            results[url] = (entry["ok"], entry["detail"], entry.get("latency"),
+                            entry.get("bitrate"), "cached")
+        if host in suspects:
+            on_host[host].append(url)
+            if entry is None:
+                held[host].append(url)
+        elif entry is None:
+            first.append(url)
+
+    # Canary: the host's most recently working URL (first listed on a tie)
+    canaries = {}
+    for host, host_urls in on_host.items():
+        if host_urls:
+            canary = max(host_urls, key=lambda url: (health.entries.get(url) or {}).get("last_ok") or 0)
+            canaries[host] = canary
+            if canary in held[host]:
+                held[host].remove(canary)
+            first.append(canary)
+
+    def run(batch):
+        if not batch:
+            return {}
+        probed = probe(batch)
+        for url, (ok, detail, latency, bitrate) in probed.items():
+            health.record(url, ok, detail, latency, bitrate)
+            results[url] = (ok, detail, latency, bitrate, "probed")
+        health.probed += len(probed)
+        return probed
+
+    probed = run(first)
+
+    recovered = []
+    for host, canary in canaries.items():
+        if probed[canary][0] is not False:
+            recovered.extend(held[host])
+            continue
+        # Canary confirms the host is down: its channels that were due for a
+        # probe are suspect; still fresh results are kept as cached
+        health.hosts_down.append(host)
+        others = held[host]
+        kept = len(on_host[host]) - 1 - len(others)
+        log(f"  {host}: {suspects[host]} recent failures and canary failed, "
+            f"marking {len(others)} more streams suspect ({kept} fresh results kept)")
+        for url in others:
+            entry = health.entries.get(url) or {}
+            results[url] = (False, f"host {host} down", entry.get("latency"),
+                            entry.get("bitrate"), "host")
+        health.host_skipped += len(others)
+    run(recovered)
+
+    health.hits += sum(1 for r in results.values() if r[-1] == "cached")
+    return results
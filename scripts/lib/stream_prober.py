@@ -0,0 +1,350 @@
+"""
+Lightweight asyncio stream prober for filter-iptv-channels.py --test-streams.
+
+Almost every IPTV channel is HLS, and an HLS stream works when its
+playlist, one variant playlist and the first media segment can all be
+fetched. That needs three small HTTP requests, not an ffprobe process per
+URL. StreamProber does those requests with a plain asyncio HTTP/1.1 client
+(stdlib only, with hundreds of probes in flight) and caps the number of
+simultaneous connections to any one host, so a provider serving thousands
+of channels is not hammered. A URL that turns out not to be HLS (raw TS,
+RTMP, ...) falls back to ffprobe, which is limited to a few processes at a
+time.
+
+Results follow the old test_stream(): True = working, False = dead,
+None = unknown (timed out, or ffprobe could not be started here), which the
+filter keeps. Each also carries the
+probe's network latency in milliseconds (time spent in requests, not
+waiting for a host slot) and the stream's bitrate in bits/s when known:
+the highest BANDWIDTH of a master playlist, else the first segment's size
+(from Content-Range) over its duration, or ffprobe's format bit_rate.
+As with ffprobe, TLS certificates are not verified.
+
+lib/hls_standin.py checks the prober against a local fake HLS server
+(filter-iptv-channels.py --probe-self-test).
+
+Usage:
+    from stream_prober import probe_streams
+
+    results = probe_streams(urls, concurrency=200, per_host=8)
+    # -> {url: (True | False | None, "detail", latency_ms, bitrate_or_None)}
+"""
+
+import re
+import ssl
+import time
+import asyncio
+import urllib.parse
+
+USER_AGENT = "Mozilla/5.0"
+
+CONCURRENCY = 200       # Probes in flight
+PER_HOST = 8            # Open connections per host
+FFPROBE_WORKERS = 10    # ffprobe fallbacks at once
+TIMEOUT = 8             # Seconds per HTTP request / ffprobe run
+
+PLAYLIST_BYTES = 512 * 1024
+SEGMENT_BYTES = 4096
+MAX_REDIRECTS = 5
+
+HLS_CONTENT_TYPES = ("mpegurl", "x-mpegurl", "vnd.apple.mpegurl")
+
+BANDWIDTH_RE = re.compile(r'[:,]BANDWIDTH=(\d+)')
+EXTINF_RE = re.compile(r'#EXTINF:\s*([\d.]+)')
+CONTENT_RANGE_RE = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+# Like ffprobe (tls_verify=0), don't verify certificates: plenty of working
+# IPTV streams are served with self-signed or expired ones
+TLS_CONTEXT = ssl.create_default_context()
+TLS_CONTEXT.check_hostname = False
+TLS_CONTEXT.verify_mode = ssl.CERT_NONE
+
+
+class ProbeError(Exception):
+    """A stream answered, but not with something playable."""
+
+
+async def http_get(url, max_bytes, headers=None, timeout=TIMEOUT, limiter=None,
+                   redirects=MAX_REDIRECTS, timings=None):
+    """GET url over a fresh HTTP/1.1 connection, reading at most max_bytes of body.
+
+    Follows redirects. timeout applies to each request once its host slot
+    is free, so queueing behind a busy host never counts as a dead stream.
+    Returns (status, headers, body, final_url) with lowercased header names;
+    raises asyncio.TimeoutError, ProbeError or OSError. The duration of
+    each request is appended to timings, if given.
+    """
+    for _ in range(redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ProbeError(f"unsupported URL {url!r}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+
+        async with (limiter.host(parts.hostname, port) if limiter else _NO_LIMIT):
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    _request(parts, port, headers, max_bytes), timeout)
+            finally:
+                if timings is not None:
+                    timings.append(time.monotonic() - start)
+
+        status, response_headers, body = response
+        if status in (301, 302, 303, 307, 308) and "location" in response_headers:
+            url = urllib.parse.urljoin(url, response_headers["location"])
+            continue
+        return status, response_headers, body, url
+    raise ProbeError("too many redirects")
+
+
+async def _request(parts, port, headers, max_bytes):
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    lines = [f"GET {path} HTTP/1.1", f"Host: {parts.netloc}",
+             f"User-Agent: {USER_AGENT}", "Accept: */*", "Connection: close"]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+
+    ctx = TLS_CONTEXT if parts.scheme == "https" else None
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port, ssl=ctx, server_hostname=parts.hostname if ctx else None)
+    try:
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        status, response_headers = await _read_head(reader)
+        if status in (301, 302, 303, 307, 308):
+            return status, response_headers, b""
+        return status, response_headers, await _read_body(reader, response_headers, max_bytes)
+    finally:
+        writer.close()
+
+
+async def _read_head(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        raise ProbeError(f"bad status line {lines[0]!r}")
+    headers = {}
+    for line in lines[1:]:
+        key, sep, value = line.partition(":")
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def _read_body(reader, headers, max_bytes):
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = b""
+        while len(body) < max_bytes:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            except ValueError:
+                break
+            if size == 0:
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()  # CRLF after the chunk
+        return body[:max_bytes]
+
+    length = headers.get("content-length")
+    if length is not None and length.isdigit():
+        want = min(int(length), max_bytes)
+        try:
+            return await reader.readexactly(want)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+    body = b""
+    while len(body) < max_bytes:
+        chunk = await reader.read(max_bytes - len(body))
+        if not chunk:
+            break
+        body += chunk
+    return body
+
+
+def is_hls(url, headers, body):
+    content_type = headers.get("content-type", "").lower()
+    return (body.lstrip().startswith(b"#EXTM3U")
+            or any(t in content_type for t in HLS_CONTENT_TYPES)
+            or urllib.parse.urlsplit(url).path.lower().endswith((".m3u8", ".m3u")))
+
+
+def playlist_uris(text, tag):
+    """(tag line, URI) for each `tag` line (#EXT-X-STREAM-INF or #EXTINF) in a playlist."""
+    uris = []
+    pending = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(tag):
+            pending = line
+        elif line and not line.startswith("#") and pending:
+            uris.append((pending, line))
+            pending = None
+    return uris
+
+
+class _NoLimit:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_NO_LIMIT = _NoLimit()
+
+
+class HostLimiter:
+    """One semaphore per (host, port), created on first use."""
+
+    def __init__(self, per_host=PER_HOST):
+        self.per_host = per_host
+        self.semaphores = {}
+
+    def host(self, hostname, port):
+        key = (hostname.lower(), port)
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(self.per_host)
+        return self.semaphores[key]
+
+
+class StreamProber:
+    """Probe stream URLs concurrently; see probe_streams()."""
+
+    def __init__(self, concurrency=CONCURRENCY, per_host=PER_HOST, timeout=TIMEOUT,
+                 ffprobe_workers=FFPROBE_WORKERS):
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(concurrency)
+        self.ffprobe_slots = asyncio.Semaphore(ffprobe_workers)
+        self.limiter = HostLimiter(per_host)
+        self.stats = {"hls": 0, "ffprobe": 0}
+
+    async def probe(self, url):
+        """(True | False | None, detail, latency_ms, bitrate) for one URL."""
+        timings = []
+        bitrate = None
+        async with self.slots:
+            try:
+                result, detail, bitrate = await self._probe(url, timings)
+            except asyncio.TimeoutError:
+                result, detail = None, "timed out"
+            except ProbeError as e:
+                result, detail = False, str(e)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    ValueError) as e:
+                result, detail = False, f"{type(e).__name__}: {e}"
+        return result, detail, round(sum(timings) * 1000), bitrate
+
+    async def _probe(self, url, timings):
+        if urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+            return await self._ffprobe(url, timings)
+
+        fetch = dict(timeout=self.timeout, limiter=self.limiter, timings=timings)
+        status, headers, body, final_url = await http_get(url, PLAYLIST_BYTES, **fetch)
+        if status >= 400:
+            return False, f"HTTP {status}", None
+        if not is_hls(final_url, headers, body):
+            return await self._ffprobe(url, timings)
+        self.stats["hls"] += 1
+
+        text = body.decode("utf-8", errors="ignore")
+        bitrate = None
+        variants = playlist_uris(text, "#EXT-X-STREAM-INF")
+        if variants:
+            bandwidths = [int(m.group(1)) for tag, _ in variants
+                          for m in [BANDWIDTH_RE.search(tag)] if m]
+            bitrate = max(bandwidths) if bandwidths else None
+            variant_url = urllib.parse.urljoin(final_url, variants[0][1])
+            status, _, body, final_url = await http_get(variant_url, PLAYLIST_BYTES, **fetch)
+            if status >= 400:
+                return False, f"variant HTTP {status}", bitrate
+            text = body.decode("utf-8", errors="ignore")
+
+        segments = playlist_uris(text, "#EXTINF")
+        if not segments:
+            raise ProbeError("playlist has no segments")
+        extinf, segment = segments[0]
+        segment_url = urllib.parse.urljoin(final_url, segment)
+        status, headers, body, _ = await http_get(
+            segment_url, SEGMENT_BYTES, headers={"Range": f"bytes=0-{SEGMENT_BYTES - 1}"},
+            **fetch)
+        if status >= 400:
+            return False, f"segment HTTP {status}", bitrate
+        if not body:
+            raise ProbeError("empty segment")
+        if bitrate is None:
+            size = CONTENT_RANGE_RE.match(headers.get("content-range", ""))
+            duration = EXTINF_RE.match(extinf)
+            if size and duration and float(duration.group(1)) > 0:
+                bitrate = round(int(size.group(1)) * 8 / float(duration.group(1)))
+        return True, f"segment HTTP {status}", bitrate
+
+    async def _ffprobe(self, url, timings):
+        self.stats["ffprobe"] += 1
+        async with self.ffprobe_slots:
+            start = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "ffprobe", "-v", "quiet", "-i", url,
+                    "-show_entries", "format=bit_rate", "-of", "csv=p=0",
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            except OSError as e:
+                # A local problem (no ffprobe binary, fork failed), says nothing about the stream
+                return None, f"ffprobe not started: {e}", None
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+                returncode = process.returncode
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                process.kill()
+                await process.wait()
+                raise
+            finally:
+                timings.append(time.monotonic() - start)
+        rate = stdout.decode(errors="ignore").strip()
+        return returncode == 0, f"ffprobe exit {returncode}", int(rate) if rate.isdigit() else None
+
+    async def probe_all(self, urls, on_result=None):
+        """{url: (result, detail, latency_ms, bitrate)}; on_result(url, *result) is called as each finishes."""
+        results = {}
+
+        async def one(url):
+            result = await self.probe(url)
+            results[url] = result
+            if on_result:
+                on_result(url, *result)
+
+        await asyncio.gather(*(one(url) for url in interleave_hosts(urls)))
+        return results
+
+
+def interleave_hosts(urls):
+    """Unique URLs ordered round-robin by host.
+
+    Probes take their global slot in this order, so one provider with
+    thousands of channels does not fill every slot while its per-host limit
+    keeps all but a few of them waiting.
+    """
+    by_host = {}
+    for url in dict.fromkeys(urls):
+        try:
+            host = urllib.parse.urlsplit(url).hostname or ""
+        except ValueError:
+            host = ""  # probe() reports malformed URLs as dead
+        by_host.setdefault(host, []).append(url)
+    queues = list(by_host.values())
+    ordered = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        ordered.extend(q[i] for q in queues if i < len(q))
+    return ordered
+
+
+def probe_streams(urls, concurrency=CONCURRENCY, per_host=PER_HOST, timeout=TIMEOUT,
+                  on_result=None):
+    """Probe every URL; returns {url: (True | False | None, detail, latency_ms, bitrate)}."""
+    async def run():
+        prober = StreamProber(concurrency=concurrency, per_host=per_host, timeout=timeout)
+        return await prober.probe_all(urls, on_result)
+    return asyncio.run(run())
@@ -2,15 +2,29 @@
 """
 Match M3U channels to EPG by channel name using fuzzy matching.
 Creates a modified M3U with corrected tvg-id values.
+
+EPG names are normalized once and put in a character-trigram inverted
+index (EPGIndex). Each M3U name only gets the exact SequenceMatcher score
+against the top --candidates EPG names by trigram overlap, instead of
+against every EPG channel. --benchmark times both matchers and reports
+where they disagree (on synthetic names, or on --m3u/--epg if given).
 """
 
 import re
 import gzip
+import time
+import heapq
+import random
 import xml.etree.ElementTree as ET
-from pathlib import Path
+from collections import Counter
 from difflib import SequenceMatcher
 import argparse
 
+SUFFIX_RE = re.compile(r'\s*(hd|sd|fhd|uhd|4k|\+)$', re.IGNORECASE)
+
+# EPG names scored exactly per M3U channel
+CANDIDATES = 100
+
 def load_epg_channels(epg_path):
     """Load channel names and IDs from EPG XML file."""
     channels = {}
@@ -66,13 +80,35 @@ def parse_m3u(m3u_path):
                 'name': name,
                 'tvg_id': tvg_id,
                 'url': url,
-                'original_line': line
+                'original_line': line,
+                'line_number': i
             })
 
     return channels
 
+def retag_line(line, epg_id):
+    """Set tvg-id on an #EXTINF line, adding the attribute if it is missing."""
+    if 'tvg-id="' in line:
+        return re.sub(r'tvg-id="[^"]*"', lambda _: f'tvg-id="{epg_id}"', line)
+    return line.replace('#EXTINF:-1 ', f'#EXTINF:-1 tvg-id="{epg_id}" ')
+
+def write_retagged_m3u(m3u_path, output_path, tvg_ids):
+    """Copy an M3U line by line, retagging the lines in tvg_ids ({line_number: epg_id}).
+
+    Line numbers are the ones parse_m3u() records, so each channel's own
+    #EXTINF line is rewritten, in a single pass over the file.
+    """
+    with open(m3u_path, 'r', encoding='utf-8') as src, \
+            open(output_path, 'w', encoding='utf-8') as dst:
+        for i, line in enumerate(src):
+            epg_id = tvg_ids.get(i)
+            if epg_id is not None:
+                body = line.rstrip('\n')
+                line = retag_line(body, epg_id) + line[len(body):]
+            dst.write(line)
+
 def fuzzy_match(name, epg_channels, threshold=0.7):
-    """Find best matching EPG channel using fuzzy matching."""
+    """Find best matching EPG channel by scoring every EPG name (reference matcher)."""
     name_lower = name.lower()
 
     # Try exact match first
@@ -100,15 +136,199 @@ def fuzzy_match(name, epg_channels, threshold=0.7):
 
     return best_match, best_score
 
+
+def clean_name(name):
+    return SUFFIX_RE.sub('', name)
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EPGIndex:
+    """Trigram inverted index over EPG names for candidate generation.
+
+    match() has fuzzy_match()'s semantics (exact name first, then the best
+    max(raw, suffix-stripped) ratio at or above threshold, earliest EPG
+    entry on ties) but only scores the top-k names by trigram overlap.
+    """
+
+    def __init__(self, epg_channels, candidates=CANDIDATES):
+        self.channels = epg_channels
+        self.candidates = candidates
+        self.names = list(epg_channels)
+        self.clean = [clean_name(name) for name in self.names]
+        self.sizes = []
+        self.postings = {}
+        for index, name in enumerate(self.clean):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+
+    def candidate_indexes(self, clean_query):
+        """Indexes of the top-k EPG names by trigram Dice coefficient, in EPG order.
+
+        Every EPG name sharing a trigram with the query is ranked, so a strong
+        match is only missed when k closer names (by trigrams) outrank it.
+        """
+        grams = trigrams(clean_query)
+        overlap = Counter()
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting:
+                overlap.update(posting)
+        size = len(grams)
+        # Dice coefficient, so long EPG names don't win just by size
+        top = heapq.nlargest(self.candidates, overlap.items(), key=lambda item: (
+            2 * item[1] / (size + self.sizes[item[0]]), -item[0]))
+        return sorted(index for index, _ in top)
+
+    def match(self, name, threshold=0.7):
+        name_lower = name.lower()
+        if name_lower in self.channels:
+            return self.channels[name_lower], 1.0
+
+        clean_query = clean_name(name_lower)
+        best_match = None
+        best_score = 0
+        for index in self.candidate_indexes(clean_query):
+            # Same argument order as fuzzy_match(); ratio() isn't symmetric
+            score = max(SequenceMatcher(None, name_lower, self.names[index]).ratio(),
+                        SequenceMatcher(None, clean_query, self.clean[index]).ratio())
+            if score > best_score and score >= threshold:
+                best_score = score
+                best_match = self.channels[self.names[index]]
+        return best_match, best_score
+
+
+def synthetic_names(count, seed):
+    """Channel-like names: networks, call signs, cities, quality suffixes."""
+    rng = random.Random(seed)
+    networks = ['ABC', 'CBS', 'NBC', 'FOX', 'PBS', 'CW', 'MyNetwork', 'Telemundo', 'ION',
+                'News', 'Sports', 'Movies', 'Classic', 'Kids', 'Weather', 'Music', 'Comedy']
+    cities = ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix', 'Boston', 'Denver',
+              'Seattle', 'Atlanta', 'Miami', 'Dallas', 'Detroit', 'Portland', 'Austin']
+    names = []
+    for _ in range(count):
+        call = rng.choice('KW') + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3))
+        parts = [rng.choice(networks), str(rng.randint(2, 69))]
+        if rng.random() < 0.7:
+            parts.append(rng.choice(cities))
+        if rng.random() < 0.6:
+            parts.append(f"({call})")
+        if rng.random() < 0.3:
+            parts.append(rng.choice(['HD', 'SD', 'FHD', '4K', '+']))
+        names.append(' '.join(parts))
+    return names
+
+
+def mutate(name, rng):
+    """An M3U-style spelling of an EPG name."""
+    choice = rng.random()
+    if choice < 0.3:
+        return name
+    if choice < 0.5:
+        return f"{clean_name(name)} HD"
+    if choice < 0.7:
+        return re.sub(r'\s*\([^)]*\)', '', name)
+    if choice < 0.85:
+        i = rng.randrange(len(name))
+        return name[:i] + name[i + 1:]
+    return name.upper()
+
+
+def run_benchmark(m3u_names, epg_channels, threshold, candidates, sample, log=print):
+    """Time the indexed matcher against fuzzy_match and report disagreements.
+
+    The reference matcher runs on `sample` M3U names (it is far too slow for
+    all of them) and its total time is extrapolated. Returns the number of
+    sampled names where the matchers picked different EPG channels.
+    """
+    start = time.perf_counter()
+    index = EPGIndex(epg_channels, candidates)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.match(name, threshold) for name in m3u_names]
+    indexed_seconds = time.perf_counter() - start
+
+    sampled = random.Random(0).sample(range(len(m3u_names)), min(sample, len(m3u_names)))
+    start = time.perf_counter()
+    reference = {i: fuzzy_match(m3u_names[i], epg_channels, threshold) for i in sampled}
+    reference_seconds = time.perf_counter() - start
+    per_name = reference_seconds / max(len(sampled), 1)
+
+    log(f"  {len(m3u_names)} M3U names x {len(epg_channels)} EPG names, "
+        f"threshold {threshold}, top {candidates} candidates")
+    log(f"  Index build:     {build_seconds:.2f}s")
+    log(f"  Indexed match:   {indexed_seconds:.2f}s for all")
+    log(f"  Reference match: {reference_seconds:.2f}s for {len(sampled)} sampled "
+        f"(~{per_name * len(m3u_names):.0f}s for all, "
+        f"{per_name * len(m3u_names) / max(indexed_seconds, 1e-9):.0f}x)")
+
+    same = lower = higher = 0
+    mismatches = []
+    for i in sampled:
+        (ref_match, ref_score), (new_match, new_score) = reference[i], indexed[i]
+        if (ref_match and ref_match['id']) == (new_match and new_match['id']):
+            same += 1
+            continue
+        mismatches.append((m3u_names[i], ref_match, ref_score, new_match, new_score))
+        if new_score < ref_score:
+            lower += 1
+        else:
+            higher += 1
+    found = sum(1 for i in sampled if reference[i][0])
+    missed = sum(1 for name, ref_match, *_ in mismatches if ref_match)
+    log(f"  Parity: {same}/{len(sampled)} sampled names matched identically")
+    log(f"  Recall: {found - missed}/{found} reference matches found "
+        f"({(found - missed) / max(found, 1):.1%})")
+    if mismatches:
+        log(f"    {lower} where the best EPG name was outside the top {candidates}, "
+            f"{higher} equal-score ties resolved differently")
+        for name, ref_match, ref_score, new_match, new_score in mismatches[:10]:
+            log(f"    {name!r}: reference {ref_match and ref_match['name']!r} ({ref_score:.2f}), "
+                f"indexed {new_match and new_match['name']!r} ({new_score:.2f})")
+    return len(mismatches)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Match M3U channels to EPG')
-    parser.add_argument('--m3u', required=True, help='Input M3U file')
-    parser.add_argument('--epg', required=True, help='EPG XML file')
+    parser.add_argument('--m3u', help='Input M3U file')
+    parser.add_argument('--epg', help='EPG XML file')
     parser.add_argument('--output', help='Output M3U file (optional)')
     parser.add_argument('--threshold', type=float, default=0.7, help='Match threshold (0-1)')
     parser.add_argument('--report-only', action='store_true', help='Only show matches, do not modify')
+    parser.add_argument('--candidates', type=int, default=CANDIDATES,
+                        help=f'EPG names scored per channel (default: {CANDIDATES})')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time indexed vs full matching and report parity '
+                             '(synthetic 5k x 30k names unless --m3u/--epg are given)')
+    parser.add_argument('--benchmark-sample', type=int, default=200,
+                        help='M3U names the full matcher runs on in --benchmark (default: 200)')
     args = parser.parse_args()
 
+    if args.benchmark:
+        if args.m3u and args.epg:
+            epg_channels = load_epg_channels(args.epg)
+            m3u_names = [ch['name'] for ch in parse_m3u(args.m3u)]
+        else:
+            epg_names = synthetic_names(30000, seed=1)
+            epg_channels = {}
+            for i, name in enumerate(epg_names):
+                epg_channels.setdefault(name.lower(), {'id': f'ch{i}.us', 'name': name})
+            rng = random.Random(2)
+            m3u_names = [mutate(rng.choice(epg_names), rng) if rng.random() < 0.8
+                         else synthetic_names(1, seed=rng.random())[0] for _ in range(5000)]
+        run_benchmark(m3u_names, epg_channels, args.threshold, args.candidates,
+                      args.benchmark_sample)
+        return
+
+    if not args.m3u or not args.epg:
+        parser.error('--m3u and --epg are required')
+
     print(f"Loading EPG from {args.epg}...")
     epg_channels = load_epg_channels(args.epg)
     print(f"  Found {len(epg_channels)} channels in EPG")
@@ -118,12 +338,13 @@ def main():
     print(f"  Found {len(m3u_channels)} channels in M3U")
 
     print(f"\nMatching channels (threshold: {args.threshold})...")
+    index = EPGIndex(epg_channels, args.candidates)
     matched = 0
     unmatched = 0
     results = []
 
     for ch in m3u_channels:
-        match, score = fuzzy_match(ch['name'], epg_channels, args.threshold)
+        match, score = index.match(ch['name'], args.threshold)
 
         if match:
             matched += 1
@@ -156,22 +377,9 @@ def main():
     if args.output and not args.report_only:
         print(f"\nGenerating output M3U: {args.output}")
 
-        with open(args.m3u, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        for result in results:
-            if result['epg_id']:
-                old_line = result['original']['original_line']
-                # Update tvg-id in the line
-                if 'tvg-id="' in old_line:
-                    new_line = re.sub(r'tvg-id="[^"]*"', f'tvg-id="{result["epg_id"]}"', old_line)
-                else:
-                    # Add tvg-id if not present
-                    new_line = old_line.replace('#EXTINF:-1 ', f'#EXTINF:-1 tvg-id="{result["epg_id"]}" ')
-                content = content.replace(old_line, new_line)
-
-        with open(args.output, 'w', encoding='utf-8') as f:
-            f.write(content)
+        tvg_ids = {result['original']['line_number']: result['epg_id']
+                   for result in results if result['epg_id']}
+        write_retagged_m3u(args.m3u, args.output, tvg_ids)
 
         print(f"  Output written to {args.output}")
 
@@ -2,19 +2,51 @@
 """
 Move completed mobile downloads to their movie folders.
 
-Scans /tank/media/downloads/mobile for completed downloads and moves
-video files to the corresponding movie folder with "- Mobile" suffix.
+Scans /tank/media/downloads/mobile for completed downloads and places
+video files in the corresponding movie folder with "- Mobile" suffix.
+
+By default files are hardlinked when downloads and movies share a
+filesystem, so nothing is copied and the torrent keeps seeding. Across
+datasets the file is copied in chunks (copy_file_range/sendfile),
+verified and renamed into place atomically. --placement move restores
+the old move-and-clean-up behaviour.
+
+With --watch the initial scan is followed by an inotify watch on the
+download directory, so each item is moved as soon as it has finished
+writing (no .!qB parts left and its size is stable).
+
+Usage:
+    python3 organize-mobile-downloads.py [--watch] [--settle-seconds N]
+                                         [--placement link|move] [--benchmark]
 """
 
 import os
 import sys
 import re
+import time
+import errno
 import shutil
+import hashlib
+import struct
+import select
+import argparse
+import ctypes
+import ctypes.util
 from pathlib import Path
 
 DOWNLOAD_DIR = "/tank/media/downloads/mobile"
 MOVIES_DIR = "/tank/media/movies"
 
+# qBittorrent appends this to files that are still downloading
+INCOMPLETE_SUFFIX = ".!qB"
+
+# Chunk size for cross-filesystem copies and progress report interval (%)
+COPY_CHUNK = 64 * 1024 * 1024
+PROGRESS_STEP = 10
+
+# Seconds a download's size must stay unchanged before it is moved (--watch)
+SETTLE_SECONDS = 30
+
 
 def normalize_name(name):
     """Normalize movie name for matching."""
@@ -28,51 +60,174 @@ def normalize_name(name):
     return name
 
 
-def find_movie_folder(name, year):
-    """Find the movie folder that matches name and year."""
-    target = f"{name} ({year})"
+def clean_name(name):
+    """Lowercase and strip special characters (keeps words and spaces)."""
+    return re.sub(r'[^\w\s]', '', name.lower())
+
+
+class MovieIndex:
+    """Per-run index of movie folders for O(1) name/year lookups.
+
+    Folders are grouped by the "(YYYY)" years in their names. For each year
+    the exact, cleaned and normalized names map straight to the folder, and
+    an inverted token index limits word-overlap matching to folders that
+    share at least one normalized word with the target.
+    """
+
+    def __init__(self, dirnames):
+        self.exact = {}
+        self.clean = {}
+        self.norm = {}
+        self.norm_words = {}
+        self.tokens = {}
+        for dirname in dirnames:
+            for year in set(re.findall(r'\((\d{4})\)', dirname)):
+                self.add(dirname, year)
+
+    @classmethod
+    def from_dir(cls, movies_dir=MOVIES_DIR):
+        return cls(os.listdir(movies_dir))
+
+    def add(self, dirname, year):
+        norm = normalize_name(dirname.replace(f"({year})", ""))
+        words = frozenset(norm.split())
+        self.exact.setdefault((year, dirname.lower()), dirname)
+        self.clean.setdefault((year, clean_name(dirname)), dirname)
+        self.norm.setdefault((year, norm), dirname)
+        self.norm_words[(year, dirname)] = words
+        year_tokens = self.tokens.setdefault(year, {})
+        for word in words:
+            year_tokens.setdefault(word, set()).add(dirname)
+
+    def find(self, name, year):
+        """Return the matching folder name, or None."""
+        target = f"{name} ({year})"
+
+        for table, key in ((self.exact, target.lower()),
+                           (self.clean, clean_name(target)),
+                           (self.norm, normalize_name(name))):
+            dirname = table.get((year, key))
+            if dirname:
+                return dirname
+
+        # Word-overlap match, only against folders sharing a token
+        target_words = set(normalize_name(name).split())
+        year_tokens = self.tokens.get(year, {})
+        shared = set()
+        for word in target_words:
+            shared |= year_tokens.get(word, set())
+
+        candidates = []
+        for dirname in shared:
+            dirname_words = self.norm_words[(year, dirname)]
+            overlap = len(dirname_words & target_words)
+            if overlap >= min(len(dirname_words), len(target_words)) * 0.7:
+                candidates.append((overlap, dirname))
+
+        if candidates:
+            best_overlap, best_dir = max(candidates)
+            if best_overlap >= 2:  # At least 2 words match
+                return best_dir
 
-    # Build list of candidates with scores
+        return None
+
+
+def scan_movie_folder(name, year, dirnames):
+    """Reference linear matcher (one regex pass per folder), used by --benchmark."""
+    target = f"{name} ({year})"
     candidates = []
 
-    for dirname in os.listdir(MOVIES_DIR):
-        # Must have matching year
+    for dirname in dirnames:
         if f"({year})" not in dirname:
             continue
-
-        # Exact match
         if dirname.lower() == target.lower():
-            return os.path.join(MOVIES_DIR, dirname)
-
-        # Fuzzy match - remove special chars
-        clean_dirname = re.sub(r'[^\w\s]', '', dirname.lower())
-        clean_target = re.sub(r'[^\w\s]', '', target.lower())
-        if clean_dirname == clean_target:
-            return os.path.join(MOVIES_DIR, dirname)
-
-        # Normalized match
+            return dirname
+        clean_dirname = clean_name(dirname)
+        if clean_dirname == clean_name(target):
+            return dirname
         norm_dirname = normalize_name(dirname.replace(f"({year})", ""))
         norm_target = normalize_name(name)
         if norm_dirname == norm_target:
-            return os.path.join(MOVIES_DIR, dirname)
-
-        # Substring match - check if key words overlap
+            return dirname
         dirname_words = set(norm_dirname.split())
         target_words = set(norm_target.split())
         overlap = len(dirname_words & target_words)
         if overlap >= min(len(dirname_words), len(target_words)) * 0.7:
             candidates.append((overlap, dirname))
 
-    # Return best candidate if good enough
     if candidates:
         candidates.sort(reverse=True)
         best_overlap, best_dir = candidates[0]
-        if best_overlap >= 2:  # At least 2 words match
-            return os.path.join(MOVIES_DIR, best_dir)
+        if best_overlap >= 2:
+            return best_dir
 
     return None
 
 
+def find_movie_folder(name, year, index=None):
+    """Find the movie folder that matches name and year."""
+    if index is None:
+        index = MovieIndex.from_dir(MOVIES_DIR)
+    dirname = index.find(name, year)
+    return os.path.join(MOVIES_DIR, dirname) if dirname else None
+
+
+def run_benchmark(size=10000, queries=500):
+    """Compare the indexed matcher with a linear scan on a synthetic library.
+
+    Disagreements are expected where the linear scan returns an earlier
+    folder on a weaker (normalized) match while the index finds the exact one.
+    """
+    import random
+    import time
+
+    rng = random.Random(42)
+    vocab = ["star", "night", "return", "dark", "king", "city", "last", "lost",
+             "river", "iron", "storm", "ghost", "empire", "war", "house", "blood",
+             "silent", "golden", "road", "winter", "fire", "moon", "shadow", "edge"]
+    dirnames = []
+    seen = set()
+    while len(dirnames) < size:
+        words = rng.sample(vocab, rng.randint(1, 4))
+        title = " ".join(w.capitalize() for w in words)
+        if rng.random() < 0.2:
+            title = "The " + title
+        if rng.random() < 0.1:
+            title += ": Part " + rng.choice(["II", "III", "2", "3"])
+        dirname = f"{title} ({rng.randint(1950, 2024)})"
+        if dirname not in seen:
+            seen.add(dirname)
+            dirnames.append(dirname)
+
+    lookups = []
+    for dirname in rng.sample(dirnames, queries):
+        name, year = re.match(r"(.+?)\s*\((\d{4})\)", dirname).groups()
+        variant = rng.choice([name, name.replace(" ", "."), name.lower(),
+                              re.sub(r'^The ', '', name), name + " Extended"])
+        lookups.append((variant.replace(".", " ").strip(), year))
+
+    start = time.perf_counter()
+    index = MovieIndex(dirnames)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.find(n, y) for n, y in lookups]
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    linear = [scan_movie_folder(n, y, dirnames) for n, y in lookups]
+    linear_time = time.perf_counter() - start
+
+    agree = sum(1 for a, b in zip(indexed, linear) if a == b)
+    found = sum(1 for a in indexed if a)
+    print(f"Synthetic library: {len(dirnames)} folders, {len(lookups)} lookups")
+    print(f"  Index build:   {build_time * 1000:8.1f} ms")
+    print(f"  Indexed match: {index_time * 1000:8.1f} ms ({index_time / len(lookups) * 1e6:.0f} us/lookup)")
+    print(f"  Linear scan:   {linear_time * 1000:8.1f} ms ({linear_time / len(lookups) * 1e6:.0f} us/lookup)")
+    print(f"  Speedup:       {linear_time / max(index_time + build_time, 1e-9):.0f}x (including build)")
+    print(f"  Matched: {found}/{len(lookups)}, agreement with linear scan: {agree}/{len(lookups)}")
+
+
 def extract_movie_info(filename):
     """Extract movie name and year from filename."""
     # Common patterns
@@ -114,60 +269,322 @@ def find_video_file(path):
     return largest
 
 
-def main():
-    if not os.path.exists(DOWNLOAD_DIR):
-        print(f"Download directory doesn't exist: {DOWNLOAD_DIR}")
-        return
+def copy_range(src_fd, dst_fd, offset, count):
+    """Copy count bytes at offset in-kernel; returns bytes copied."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def sample_digest(path, size, block=1024 * 1024):
+    """Hash the first, middle and last block of a file for a cheap comparison."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - block // 2), max(0, size - block)}):
+            f.seek(offset)
+            h.update(f.read(block))
+    return h.hexdigest()
+
+
+def copy_file_atomic(src, dst):
+    """Chunked in-kernel copy to a temp file next to dst, verified, then renamed.
+
+    Progress is printed every PROGRESS_STEP percent. The source is left in
+    place so the torrent keeps seeding.
+    """
+    size = os.path.getsize(src)
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.partial")
+    copied = 0
+    next_report = PROGRESS_STEP
+    start = time.monotonic()
+
+    try:
+        with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            while copied < size:
+                n = copy_range(fsrc.fileno(), fdst.fileno(), copied, min(COPY_CHUNK, size - copied))
+                if n == 0:
+                    break
+                copied += n
+                if size and copied * 100 // size >= next_report:
+                    rate = copied / max(time.monotonic() - start, 1e-6) / (1024**2)
+                    print(f"      {copied * 100 // size:3d}% ({copied / (1024**3):.1f} GB, {rate:.0f} MB/s)")
+                    next_report = copied * 100 // size + PROGRESS_STEP
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+        if os.path.getsize(tmp_path) != size:
+            raise OSError(f"size mismatch after copy ({os.path.getsize(tmp_path)} != {size})")
+        if sample_digest(tmp_path, size) != sample_digest(src, size):
+            raise OSError("content mismatch after copy")
+
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def place_file(src, dst, placement="link"):
+    """Put src at dst without breaking seeding.
+
+    "link" hardlinks when both paths are on the same filesystem (no data is
+    copied) and otherwise falls back to a verified chunked copy; in both
+    cases the source stays where qBittorrent expects it. "move" keeps the
+    old behaviour of moving the file. Returns the method used.
+    """
+    if placement == "move":
+        shutil.move(src, dst)
+        return "moved"
+
+    if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+        tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.link")
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.link(src, tmp_path)
+        os.replace(tmp_path, dst)
+        return "hardlinked"
+
+    copy_file_atomic(src, dst)
+    return "copied"
+
+
+def organize_item(item, index, placement="link"):
+    """Place the video from one download item into its movie folder.
+
+    Returns True if a file was placed.
+    """
+    item_path = os.path.join(DOWNLOAD_DIR, item)
+
+    # Find the video file
+    video_file = find_video_file(item_path)
+    if not video_file:
+        return False
+
+    # Extract movie info from filename
+    name, year = extract_movie_info(os.path.basename(video_file))
+    if not name or not year:
+        name, year = extract_movie_info(item)
+
+    if not name or not year:
+        print(f"  Skipping (can't parse): {item}")
+        return False
+
+    # Find target movie folder
+    movie_folder = find_movie_folder(name, year, index)
+    if not movie_folder:
+        print(f"  Skipping (no match): {item} -> {name} ({year})")
+        return False
+
+    # Determine target filename (Jellyfin edition format)
+    ext = os.path.splitext(video_file)[1]
+    target_name = f"{os.path.basename(movie_folder)} {{edition-Mobile}}{ext}"
+    target_path = os.path.join(movie_folder, target_name)
+
+    if os.path.exists(target_path):
+        # Hardlinked on an earlier run and still seeding - nothing to do
+        if not os.path.samefile(video_file, target_path):
+            print(f"  Already exists: {target_name}")
+        return False
 
-    print("Scanning for completed mobile downloads...")
+    print(f"  Placing: {os.path.basename(video_file)}")
+    print(f"      -> {target_path}")
 
-    moved = 0
-    for item in os.listdir(DOWNLOAD_DIR):
-        item_path = os.path.join(DOWNLOAD_DIR, item)
+    try:
+        method = place_file(video_file, target_path, placement)
+        print(f"      ({method})")
 
-        # Find the video file
-        video_file = find_video_file(item_path)
-        if not video_file:
-            continue
+        # Clean up the download folder only when the file was moved out of it
+        if method == "moved" and os.path.isdir(item_path):
+            shutil.rmtree(item_path, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"  Error: {e}")
+        return False
 
-        # Extract movie info from filename
-        name, year = extract_movie_info(os.path.basename(video_file))
-        if not name or not year:
-            name, year = extract_movie_info(item)
 
-        if not name or not year:
-            print(f"  Skipping (can't parse): {item}")
-            continue
+def scan_downloads(index, placement="link"):
+    """Organize every item currently in the download directory."""
+    moved = 0
+    for item in os.listdir(DOWNLOAD_DIR):
+        if organize_item(item, index, placement):
+            moved += 1
+    return moved
+
+
+class Inotify:
+    """Minimal recursive inotify watcher using libc through ctypes."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    def add_tree(self, path):
+        """Watch path and every directory below it."""
+        for root, dirs, files in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.WATCH_MASK)
+            if wd >= 0:
+                self.paths[wd] = root
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds; return [(path, mask)] for new events."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            parent = self.paths.get(wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, os.fsdecode(name)) if name else parent
+            # New subfolders (torrent content dirs) need their own watches
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_tree(path)
+            events.append((path, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def item_is_settled(item_path, last_size):
+    """Return (settled, size): no .!qB parts left and size unchanged since last check."""
+    if not os.path.exists(item_path):
+        return False, None
+    if os.path.isfile(item_path):
+        if item_path.endswith(INCOMPLETE_SUFFIX):
+            return False, None
+        return os.path.getsize(item_path) == last_size, os.path.getsize(item_path)
+
+    size = 0
+    for root, dirs, files in os.walk(item_path):
+        for f in files:
+            if f.endswith(INCOMPLETE_SUFFIX):
+                return False, None
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                return False, None
+    return size == last_size, size
+
+
+def watch_downloads(index, settle_seconds=SETTLE_SECONDS, placement="link"):
+    """React to finished downloads as soon as they settle."""
+    inotify = Inotify()
+    inotify.add_tree(DOWNLOAD_DIR)
+    movies_mtime = os.stat(MOVIES_DIR).st_mtime_ns
+    pending = {}  # top-level item -> (size at last check, time of last check)
+
+    print(f"Watching {DOWNLOAD_DIR} (settle time {settle_seconds}s)...")
+
+    try:
+        while True:
+            for path, mask in inotify.read_events(timeout=settle_seconds):
+                if path is None:
+                    # Event queue overflowed - fall back to a full rescan
+                    print("  inotify queue overflow, rescanning")
+                    scan_downloads(index, placement)
+                    continue
+                rel = os.path.relpath(path, DOWNLOAD_DIR)
+                if rel == "." or rel.startswith(".."):
+                    continue
+                item = rel.split(os.sep, 1)[0]
+                pending[item] = (None, time.monotonic())
+
+            now = time.monotonic()
+            for item, (last_size, checked) in list(pending.items()):
+                if now - checked < settle_seconds:
+                    continue
+                settled, size = item_is_settled(os.path.join(DOWNLOAD_DIR, item), last_size)
+                if size is None and not os.path.exists(os.path.join(DOWNLOAD_DIR, item)):
+                    del pending[item]
+                elif settled:
+                    del pending[item]
+                    # Pick up movie folders added since the index was built
+                    mtime = os.stat(MOVIES_DIR).st_mtime_ns
+                    if mtime != movies_mtime:
+                        index = MovieIndex.from_dir(MOVIES_DIR)
+                        movies_mtime = mtime
+                    print(f"Download settled: {item}")
+                    organize_item(item, index, placement)
+                else:
+                    pending[item] = (size, now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inotify.close()
 
-        # Find target movie folder
-        movie_folder = find_movie_folder(name, year)
-        if not movie_folder:
-            print(f"  Skipping (no match): {item} -> {name} ({year})")
-            continue
 
-        # Determine target filename (Jellyfin edition format)
-        ext = os.path.splitext(video_file)[1]
-        target_name = f"{os.path.basename(movie_folder)} {{edition-Mobile}}{ext}"
-        target_path = os.path.join(movie_folder, target_name)
+def main():
+    parser = argparse.ArgumentParser(description="Move completed mobile downloads to movie folders")
+    parser.add_argument("--watch", action="store_true",
+                        help="After the initial scan, keep watching for finished downloads")
+    parser.add_argument("--settle-seconds", type=float, default=SETTLE_SECONDS,
+                        help="Seconds a download's size must stay unchanged before moving it")
+    parser.add_argument("--placement", choices=["link", "move"], default="link",
+                        help="link: hardlink (or verified copy across filesystems) and keep seeding; "
+                             "move: move the file out of the download folder")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Benchmark the folder matcher on a synthetic library")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark()
+        return
 
-        if os.path.exists(target_path):
-            print(f"  Already exists: {target_name}")
-            continue
+    if not os.path.exists(DOWNLOAD_DIR):
+        print(f"Download directory doesn't exist: {DOWNLOAD_DIR}")
+        return
 
-        print(f"  Moving: {os.path.basename(video_file)}")
-        print(f"      -> {target_path}")
+    print("Scanning for completed mobile downloads...")
 
-        try:
-            shutil.move(video_file, target_path)
-            moved += 1
+    index = MovieIndex.from_dir(MOVIES_DIR)
+    moved = scan_downloads(index, args.placement)
 
-            # Clean up empty folder if it was a directory
-            if os.path.isdir(item_path):
-                shutil.rmtree(item_path, ignore_errors=True)
-        except Exception as e:
-            print(f"  Error: {e}")
+    print(f"\nPlaced {moved} files in movie folders")
 
-    print(f"\nMoved {moved} files to movie folders")
+    if args.watch:
+        watch_downloads(index, settle_seconds=args.settle_seconds, placement=args.placement)
 
 
 if __name__ == "__main__":
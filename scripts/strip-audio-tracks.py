@@ -1,108 +1,520 @@
 #!/usr/bin/env python3
-"""Strip non-English audio tracks from MKV files to save space (lossless)"""
+"""Strip non-English audio tracks from MKV files to save space (lossless)
+
+Usage:
+    strip-audio-tracks.py <file.mkv> [--dry-run] [--min-savings SIZE] [--keep-original]
+    strip-audio-tracks.py --library DIR [--dry-run] [--min-savings SIZE] [--keep-original]
+                          [--max-writes N] [--probe-workers N]
+    strip-audio-tracks.py --rollback <file.mkv | DIR>
+
+Files are rewritten crash-safely: ffmpeg writes a hidden .strip-partial file
+in the same directory, which is fsync'd and checked against the source (stream
+count, duration, video packet count) before os.replace() swaps it in, so the
+original is never missing and never copied across datasets. --keep-original
+hardlinks the original to a hidden .orig file first; it is deleted by the
+next run over the same file or library (the space is only freed then), and
+--rollback puts it back instantly. Partials left by a crash are removed once
+they are PARTIAL_MAX_AGE old, so a concurrent run's rewrite is never touched.
+
+Each dropped audio stream is sized from its NUMBER_OF_BYTES statistics tag
+or bit rate, and otherwise by summing its packet sizes with one
+`ffprobe -show_packets` pass over the dropped streams; --dry-run reports the
+reclaimable bytes. Files that would free less than --min-savings (e.g.
+500M, 2G) are left alone, since the rewrite costs a full read and write.
+
+--library probes every MKV under DIR with a bounded worker pool, ranks the
+files by reclaimable bytes and strips them largest-first, at most
+--max-writes rewrites at a time so the pool isn't saturated. Finished files
+are recorded in a ledger (keyed by file identity) so reruns skip them; files
+below --min-savings are recorded with their measured savings, so reruns
+reuse the size instead of repeating the packet pass.
+"""
 
 import subprocess
 import sys
 import os
 import json
-import shutil
+import time
+import argparse
+import threading
+import concurrent.futures
 
-def get_streams(filepath):
-    """Get stream info from file"""
-    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', filepath]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return json.loads(result.stdout).get('streams', [])
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from probe_cache import ProbeCache, ProbeError, FFPROBE, file_key, run_ffprobe
 
-def strip_audio(input_file, dry_run=False):
-    """Strip non-English audio tracks, keeping video and subs intact"""
-    
-    streams = get_streams(input_file)
-    
-    # Categorize streams
+PROBE_CACHE = ProbeCache()
+LEDGER_FILE = "/home/anon/nas-media-server/logs/strip-audio-ledger.json"
+PROBE_WORKERS = 8
+MAX_WRITES = 2
+KEEP_LANGUAGES = ['eng', 'en', 'english', 'und']
+DURATION_TOLERANCE = 1.0  # Seconds a rewrite's duration may differ from the source
+PARTIAL_SUFFIX = '.strip-partial'
+PARTIAL_MAX_AGE = 24 * 3600  # Seconds before an untouched partial counts as a crash leftover
+
+def classify_streams(streams):
+    """Split streams into (video, english_audio, other_audio, subtitles) index lists"""
     video_streams = []
     english_audio = []
     other_audio = []
     subtitle_streams = []
-    
+
     for i, s in enumerate(streams):
         codec_type = s.get('codec_type', '')
         lang = s.get('tags', {}).get('language', 'und').lower()
-        
+
         if codec_type == 'video':
             video_streams.append(i)
         elif codec_type == 'audio':
-            if lang in ['eng', 'en', 'english', 'und']:
+            if lang in KEEP_LANGUAGES:
                 english_audio.append(i)
             else:
                 other_audio.append((i, lang, s.get('codec_name', '?')))
         elif codec_type == 'subtitle':
             subtitle_streams.append(i)
-    
+
+    return video_streams, english_audio, other_audio, subtitle_streams
+
+def parse_size(value):
+    """Parse a size like 500M, 2G or 1048576 into bytes"""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+def format_size(size):
+    return f"{size/1073741824:.2f} GB" if size >= 1073741824 else f"{size/1048576:.1f} MB"
+
+def tagged_stream_bytes(stream, duration):
+    """Stream size from NUMBER_OF_BYTES (exact) or bit rate; (None, None) if neither"""
+    tags = stream.get('tags', {})
+    for key in ('NUMBER_OF_BYTES', 'NUMBER_OF_BYTES-eng'):
+        if str(tags.get(key, '')).isdigit():
+            return int(tags[key]), 'tag'
+    for rate in (stream.get('bit_rate'), tags.get('BPS'), tags.get('BPS-eng')):
+        if rate and str(rate).isdigit() and duration:
+            return int(int(rate) * duration / 8), 'bit rate'
+    return None, None
+
+def packet_bytes(filepath, indices):
+    """Sum packet sizes per stream index with one ffprobe pass over the audio"""
+    cmd = [FFPROBE, '-v', 'error', '-select_streams', 'a',
+           '-show_entries', 'packet=stream_index,size', '-of', 'csv=p=0', filepath]
+    totals = {idx: 0 for idx in indices}
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as proc:
+        for line in proc.stdout:
+            idx, _, size = line.strip().partition(',')
+            if idx.isdigit() and int(idx) in totals and size.isdigit():
+                totals[int(idx)] += int(size)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe -show_packets exited with code {proc.returncode}")
+    return totals
+
+def stream_sizes(filepath, info, indices):
+    """{index: (bytes, method)} for the given streams of a probed file"""
+    streams = info.get('streams', [])
+    try:
+        duration = float(info.get('format', {}).get('duration', 0))
+    except (TypeError, ValueError):
+        duration = 0.0
+    sizes = {idx: tagged_stream_bytes(streams[idx], duration) for idx in indices}
+    untagged = [idx for idx, (size, _) in sizes.items() if size is None]
+    if untagged:
+        for idx, size in packet_bytes(filepath, untagged).items():
+            sizes[idx] = (size, 'packets')
+    return sizes
+
+def reclaimable_bytes(filepath, info):
+    """Bytes freed by dropping the non-English audio: (total, {index: (bytes, method)})"""
+    _, _, other_audio, _ = classify_streams(info.get('streams', []))
+    sizes = stream_sizes(filepath, info, [idx for idx, _, _ in other_audio])
+    return sum(size for size, _ in sizes.values()), sizes
+
+def partial_path(filepath):
+    directory, name = os.path.split(filepath)
+    return os.path.join(directory, f".{name}{PARTIAL_SUFFIX}")
+
+def backup_path(filepath):
+    directory, name = os.path.split(filepath)
+    return os.path.join(directory, f".{name}.orig")
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def count_video_packets(filepath, info=None):
+    """Packets in the first video stream (from mkvmerge's NUMBER_OF_FRAMES tag if present)"""
+    for stream in (info or {}).get('streams', []):
+        if stream.get('codec_type') == 'video':
+            tags = stream.get('tags', {})
+            for key in ('NUMBER_OF_FRAMES', 'NUMBER_OF_FRAMES-eng'):
+                if str(tags.get(key, '')).isdigit():
+                    return int(tags[key])
+            break
+    # Demux-only count, no decoding
+    cmd = [FFPROBE, '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+           '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', filepath]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    value = result.stdout.strip().split(',')[0]
+    return int(value) if result.returncode == 0 and value.isdigit() else None
+
+def verify_rewrite(source_file, source_info, output_file, expected_streams):
+    """Cheap check of a rewrite against its source. Returns (ok, detail)."""
+    try:
+        out_info = run_ffprobe(output_file)
+    except ProbeError as e:
+        return False, f"could not probe output: {e}"
+
+    streams = len(out_info.get('streams', []))
+    if streams != expected_streams:
+        return False, f"{streams} streams, expected {expected_streams}"
+
+    try:
+        src_duration = float(source_info.get('format', {}).get('duration', 0))
+        out_duration = float(out_info.get('format', {}).get('duration', 0))
+    except (TypeError, ValueError):
+        return False, "unknown duration"
+    if abs(src_duration - out_duration) > DURATION_TOLERANCE:
+        return False, f"duration {out_duration:.1f}s vs source {src_duration:.1f}s"
+
+    src_packets = count_video_packets(source_file, source_info)
+    out_packets = count_video_packets(output_file)
+    if src_packets is None or out_packets != src_packets:
+        return False, f"{out_packets} video packets vs source {src_packets}"
+
+    return True, f"{streams} streams, {out_duration:.0f}s, {out_packets} video packets"
+
+def rewrite(input_file, info, english_audio, keep_original=False):
+    """Stream-copy input_file without the dropped audio and atomically replace it.
+
+    The new file is written next to the original, fsync'd and verified
+    before os.replace(); any failure leaves the original untouched.
+    Returns (ok, old_size, new_size, error).
+    """
+    output_file = partial_path(input_file)
+    video_streams, _, _, subtitle_streams = classify_streams(info.get('streams', []))
+    expected_streams = len(video_streams) + len(english_audio) + len(subtitle_streams)
+
+    cmd = ['ffmpeg', '-v', 'error', '-i', input_file, '-map', '0:v']
+
+    # Map English audio
+    for idx in english_audio:
+        cmd.extend(['-map', f'0:{idx}'])
+
+    # Map all subtitles
+    cmd.extend(['-map', '0:s?'])
+
+    # Copy without re-encoding
+    cmd.extend(['-c', 'copy', '-f', 'matroska', '-y', output_file])
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            return False, 0, 0, result.stderr[:200]
+
+        fsync_path(output_file)
+        ok, detail = verify_rewrite(input_file, info, output_file, expected_streams)
+        if not ok:
+            return False, 0, 0, f"verification failed: {detail}"
+
+        old_size = os.path.getsize(input_file)
+        new_size = os.path.getsize(output_file)
+
+        if keep_original:
+            backup = backup_path(input_file)
+            if os.path.exists(backup):
+                os.remove(backup)
+            os.link(input_file, backup)
+
+        # Atomic swap, then make the rename itself durable
+        os.replace(output_file, input_file)
+        fsync_path(os.path.dirname(input_file) or '.')
+        return True, old_size, new_size, None
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+def is_stale_partial(path):
+    """True for a partial nothing has written to for PARTIAL_MAX_AGE"""
+    try:
+        return time.time() - os.path.getmtime(path) > PARTIAL_MAX_AGE
+    except OSError:
+        return False
+
+def clean_leftovers(target):
+    """Delete .orig backups kept by the previous run and stale partials
+
+    For a file only its own backup and partial are considered; for a
+    directory, every leftover under it.
+    """
+    if os.path.isdir(target):
+        paths = [os.path.join(root, name) for root, _, files in os.walk(target)
+                 for name in files if name.startswith('.')]
+    else:
+        paths = [backup_path(target), partial_path(target)]
+    removed = 0
+    for path in paths:
+        if path.endswith('.mkv.orig') or (path.endswith('.mkv' + PARTIAL_SUFFIX)
+                                          and is_stale_partial(path)):
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    if removed:
+        print(f"  Removed {removed} backup/partial file(s) from a previous run")
+
+def rollback(target):
+    """Restore .orig backups for a file or every file under a directory"""
+    if os.path.isdir(target):
+        backups = [os.path.join(root, name) for root, _, files in os.walk(target)
+                   for name in files if name.startswith('.') and name.endswith('.mkv.orig')]
+    else:
+        backups = [backup_path(target)] if os.path.exists(backup_path(target)) else []
+    for backup in backups:
+        directory, name = os.path.split(backup)
+        original = os.path.join(directory, name[1:-len('.orig')])
+        os.replace(backup, original)
+        print(f"  Restored {os.path.basename(original)}")
+    print(f"Rolled back {len(backups)} file(s)")
+
+def strip_audio(input_file, dry_run=False, min_savings=0, keep_original=False):
+    """Strip non-English audio tracks, keeping video and subs intact"""
+
+    info = PROBE_CACHE.probe(input_file)
+    streams = info.get('streams', [])
+    video_streams, english_audio, other_audio, subtitle_streams = classify_streams(streams)
+
     if not other_audio:
         print(f"  No non-English audio to remove")
         return False
-    
-    # Calculate potential savings (rough estimate)
+
+    reclaimable, sizes = reclaimable_bytes(input_file, info)
     print(f"  Video streams: {len(video_streams)}")
     print(f"  English audio: {len(english_audio)}")
     print(f"  Other audio to REMOVE: {len(other_audio)}")
     for idx, lang, codec in other_audio:
-        print(f"    - Stream {idx}: {lang} ({codec})")
+        size, method = sizes[idx]
+        print(f"    - Stream {idx}: {lang} ({codec}) {format_size(size)} [{method}]")
     print(f"  Subtitles: {len(subtitle_streams)}")
-    
+    print(f"  Reclaimable: {reclaimable:,} bytes ({format_size(reclaimable)})")
+
+    if reclaimable < min_savings:
+        print(f"  Skipping: below --min-savings ({format_size(min_savings)})")
+        return False
+
     if dry_run:
         return True
-    
-    # Build ffmpeg command
-    output_file = input_file.rsplit('.', 1)[0] + '.stripped.mkv'
-    
-    cmd = ['ffmpeg', '-i', input_file, '-map', '0:v']
-    
-    # Map English audio
-    for idx in english_audio:
-        cmd.extend(['-map', f'0:{idx}'])
-    
-    # Map all subtitles
-    cmd.extend(['-map', '0:s?'])
-    
-    # Copy without re-encoding
-    cmd.extend(['-c', 'copy', output_file])
-    
+
+    clean_leftovers(input_file)
     print(f"  Running ffmpeg...")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    
-    if result.returncode == 0:
-        # Verify output
-        old_size = os.path.getsize(input_file)
-        new_size = os.path.getsize(output_file)
+    ok, old_size, new_size, error = rewrite(input_file, info, english_audio, keep_original)
+
+    if ok:
         saved = (old_size - new_size) / 1073741824
-        
+
         print(f"  Original: {old_size/1073741824:.1f} GB")
         print(f"  New:      {new_size/1073741824:.1f} GB")
         print(f"  Saved:    {saved:.1f} GB")
-        
-        # Replace original
-        os.remove(input_file)
-        shutil.move(output_file, input_file)
         print(f"  ✓ Replaced original file")
+        if keep_original:
+            print(f"  Original kept as {os.path.basename(backup_path(input_file))} until the next run")
         return True
     else:
-        print(f"  ERROR: {result.stderr[:200]}")
-        if os.path.exists(output_file):
-            os.remove(output_file)
+        print(f"  ERROR: {error}")
         return False
 
+class Ledger:
+    """Files already handled by --library runs, keyed by path and file identity"""
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def entry(self, filepath):
+        """The entry for filepath if the file hasn't changed since, else None"""
+        entry = self.entries.get(filepath)
+        if not entry:
+            return None
+        try:
+            return entry if entry['key'] == file_key(filepath) else None
+        except OSError:
+            return None
+
+    def done(self, filepath):
+        """True if filepath was handled and hasn't changed since"""
+        entry = self.entry(filepath)
+        # Files below --min-savings are reconsidered (with their recorded size)
+        return entry is not None and entry['result'] != 'below-min-savings'
+
+    def record(self, filepath, result, saved=0, reclaimable=None, save=True):
+        with self._lock:
+            self.entries[filepath] = {'key': file_key(filepath), 'result': result,
+                                      'saved': saved, 'at': int(time.time())}
+            if reclaimable is not None:
+                self.entries[filepath]['reclaimable'] = reclaimable
+            if save:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+def find_mkvs(library):
+    for root, dirs, files in os.walk(library):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.endswith('.mkv') and not name.endswith('.stripped.mkv'):
+                yield os.path.join(root, name)
+
+def strip_library(library, dry_run=False, max_writes=MAX_WRITES, probe_workers=PROBE_WORKERS,
+                  min_savings=0, keep_original=False):
+    """Strip every MKV under library, biggest savings first"""
+    if not dry_run:
+        clean_leftovers(library)
+    ledger = Ledger()
+    paths = sorted(find_mkvs(library))
+    todo = [p for p in paths if not ledger.done(p)]
+    print(f"Found {len(paths)} MKV files, {len(paths) - len(todo)} already in ledger")
+
+    infos = PROBE_CACHE.probe_many(todo, workers=probe_workers)
+    PROBE_CACHE.save()
+
+    candidates = []
+    probe_failed = 0
+    for path in todo:
+        info = infos.get(path)
+        if info is None:
+            probe_failed += 1
+            continue
+        _, english_audio, other_audio, _ = classify_streams(info.get('streams', []))
+        if not other_audio:
+            if not dry_run:
+                ledger.record(path, 'nothing-to-strip')
+            continue
+        if not english_audio:
+            print(f"  Skipping {os.path.basename(path)}: no English audio to keep")
+            continue
+        candidates.append((path, info, english_audio, other_audio))
+
+    # Untagged streams need a packet pass, so size files in the probe pool;
+    # files measured (and found too small) by an earlier run reuse that size
+    def size_candidate(candidate):
+        path, info, english_audio, other_audio = candidate
+        entry = ledger.entry(path)
+        if entry and entry.get('reclaimable') is not None:
+            return entry['reclaimable'], path, info, english_audio, other_audio
+        try:
+            size = reclaimable_bytes(path, info)[0]
+        except (OSError, RuntimeError) as e:
+            print(f"  Could not size {os.path.basename(path)}: {e}")
+            return None
+        return size, path, info, english_audio, other_audio
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, probe_workers)) as executor:
+        sized = [c for c in executor.map(size_candidate, candidates) if c]
+
+    candidates = [c for c in sized if c[0] >= min_savings]
+    if len(candidates) < len(sized):
+        print(f"Skipping {len(sized) - len(candidates)} files below --min-savings "
+              f"({format_size(min_savings)})")
+        if not dry_run:
+            for size, path, _, _, _ in sized:
+                if size < min_savings:
+                    ledger.record(path, 'below-min-savings', reclaimable=size, save=False)
+            ledger.save()
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    total = sum(c[0] for c in candidates)
+    print(f"{len(candidates)} files with non-English audio, {total:,} bytes "
+          f"({format_size(total)}) reclaimable")
+
+    if dry_run:
+        for size, path, _, _, other_audio in candidates:
+            langs = ', '.join(lang for _, lang, _ in other_audio)
+            print(f"  {format_size(size):>10}  {os.path.basename(path)} ({langs})")
+        return
+
+    print_lock = threading.Lock()
+    totals = {'stripped': 0, 'failed': 0, 'saved': 0}
+
+    def run(candidate):
+        _, path, info, english_audio, _ = candidate
+        try:
+            ok, old_size, new_size, error = rewrite(path, info, english_audio, keep_original)
+        except OSError as e:
+            ok, old_size, new_size, error = False, 0, 0, str(e)
+        with print_lock:
+            if ok:
+                saved = old_size - new_size
+                totals['stripped'] += 1
+                totals['saved'] += saved
+                print(f"  ✓ {os.path.basename(path)}: saved {saved/1073741824:.2f} GB")
+            else:
+                totals['failed'] += 1
+                print(f"  ERROR {os.path.basename(path)}: {error}")
+        if ok:
+            ledger.record(path, 'stripped', old_size - new_size)
+
+    # Each rewrite is a full sequential read + write of the file, so the
+    # write cap is also the worker count
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_writes)) as executor:
+        list(executor.map(run, candidates))
+
+    print(f"\nStripped {totals['stripped']} files, {totals['failed']} failed, "
+          f"{probe_failed} could not be probed")
+    print(f"Total reclaimed: {totals['saved']/1073741824:.1f} GB")
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: strip-audio-tracks.py <file.mkv> [--dry-run]")
+    parser = argparse.ArgumentParser(description="Strip non-English audio tracks from MKV files")
+    parser.add_argument('file', nargs='?', help="MKV file to strip")
+    parser.add_argument('--dry-run', action='store_true', help="Show what would be removed")
+    parser.add_argument('--library', metavar='DIR', help="Strip every MKV under DIR")
+    parser.add_argument('--min-savings', type=parse_size, default=0, metavar='SIZE',
+                        help="Skip files that would free less than this (e.g. 500M, 2G)")
+    parser.add_argument('--keep-original', action='store_true',
+                        help="Keep each original as a hidden .orig hardlink until the next run")
+    parser.add_argument('--rollback', metavar='PATH',
+                        help="Restore originals kept by --keep-original for a file or directory")
+    parser.add_argument('--max-writes', type=int, default=MAX_WRITES,
+                        help="Files rewritten at once in --library mode")
+    parser.add_argument('--probe-workers', type=int, default=PROBE_WORKERS,
+                        help="Parallel ffprobe processes in --library mode")
+    args = parser.parse_args()
+
+    if args.rollback:
+        rollback(args.rollback)
+        sys.exit(0)
+
+    if not args.file and not args.library:
+        parser.print_usage()
         sys.exit(1)
-    
-    filepath = sys.argv[1]
-    dry_run = '--dry-run' in sys.argv
-    
-    if dry_run:
-        print(f"DRY RUN - Analyzing: {os.path.basename(filepath)}")
-    else:
-        print(f"Processing: {os.path.basename(filepath)}")
-    
-    strip_audio(filepath, dry_run)
+
+    try:
+        if args.library:
+            strip_library(args.library, args.dry_run, args.max_writes, args.probe_workers,
+                          args.min_savings, args.keep_original)
+        else:
+            filepath = args.file
+            if args.dry_run:
+                print(f"DRY RUN - Analyzing: {os.path.basename(filepath)}")
+            else:
+                print(f"Processing: {os.path.basename(filepath)}")
+            strip_audio(filepath, args.dry_run, args.min_savings, args.keep_original)
+    finally:
+        PROBE_CACHE.save()
+        print(f"  {PROBE_CACHE.summary()}")
@@ -32,74 +32,16 @@ curl -sL "https://www.apsattv.com/distro.m3u" -o "$LIVETV_DIR/distro.m3u" || tru
 echo "  Downloading mjh.nz channels..."
 curl -sL "https://i.mjh.nz/all/kodi-tv.m3u8" -o "$LIVETV_DIR/mjh-all-tv.m3u" || true
 
-# Run the filter script
+# Filter all sources straight into the final playlist in one pass (stages
+# in config/iptv/filter-rules.json); the old playlist stays if this fails.
+# Stream probing (the health stage) is off here: add --test-streams to
+# probe every stream and drop the dead ones
 echo "  Filtering channels..."
 python3 "$SCRIPTS_DIR/filter-iptv-channels.py" \
     --input "$LIVETV_DIR/iptv-org-us.m3u" "$LIVETV_DIR/distro.m3u" "$LIVETV_DIR/mjh-all-tv.m3u" \
-    --output "$LIVETV_DIR/curated-temp.m3u" \
+    --output "$LIVETV_DIR/curated-us-final.m3u" \
     --epg "$LIVETV_DIR/combined-epg.xml" "$LIVETV_DIR/mjh-all-epg.xml" \
-    --us-only \
-    --no-religious 2>/dev/null || true
-
-# Apply strict US filter
-python3 << 'PYEOF'
-import re
-
-NON_US_STRICT = [
-    'Hindi', 'Punjabi', 'Tamil', 'Telugu', 'Bengali', 'Marathi', 'Gujarati',
-    'Kannada', 'Malayalam', 'Urdu', 'Arabic', 'Portuguese', 'Russian',
-    'Chinese', 'Korean', 'Japanese', 'Turkish', 'Polish', 'Italian',
-    'India', 'Pakistan', 'Bangladesh', 'Nepal', 'Mexico', 'Brazil',
-    'UK', 'Britain', 'Canada', 'Australia', 'Africa', 'Saudi', 'Iran',
-    'Russia', 'Ukraine', 'China', 'Japan', 'Korea', 'Taiwan',
-    'ABP', 'NDTV', 'Zee', 'Star India', 'Colors', 'Aaj Tak', 'TV9',
-    'Telemundo', 'Univision', 'Azteca', 'Al Arabiya', 'MBC', 'Globo',
-]
-
-def is_us(name, group):
-    text = f"{name} {group}".lower()
-    for ind in NON_US_STRICT:
-        if ind.lower() in text:
-            return False
-    return True
-
-try:
-    with open('/tank/media/livetv/curated-temp.m3u', 'r') as f:
-        content = f.read()
-except:
-    exit(0)
-
-lines = content.split('\n')
-output = ['#EXTM3U']
-
-i = 0
-while i < len(lines):
-    line = lines[i].strip()
-    if line.startswith('#EXTINF'):
-        name = re.search(r',(.+)$', line)
-        name = name.group(1).strip() if name else ''
-        group = re.search(r'group-title="([^"]*)"', line)
-        group = group.group(1) if group else ''
-
-        url = ''
-        for j in range(i + 1, min(i + 3, len(lines))):
-            if lines[j].strip() and not lines[j].strip().startswith('#'):
-                url = lines[j].strip()
-                break
-
-        if is_us(name, group) and url:
-            output.append(line)
-            output.append(url)
-    i += 1
-
-with open('/tank/media/livetv/curated-us-final.m3u', 'w') as f:
-    f.write('\n'.join(output))
-
-print(f"  Final channel count: {len([l for l in output if l.startswith('#EXTINF')])}")
-PYEOF
-
-# Clean up temp file
-rm -f "$LIVETV_DIR/curated-temp.m3u"
+    --rules "$SCRIPTS_DIR/../config/iptv/filter-rules.json" 2>/dev/null || true
 
 # Generate M3U files from online EPG sources
 echo "  Generating M3U files from online EPG sources..."